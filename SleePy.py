@@ -6,6 +6,7 @@ This application manages playlists and plays content with customizable
 actions based on special key presses.
 """
 
+import asyncio
 import logging
 import sys
 
@@ -37,7 +38,9 @@ def main() -> None:
         youtube_auth = YouTubeAuthenticator(audio_player)
         state_machine = StateMachine(config, audio_player, youtube_auth)
         
-        state_machine.run()
+        asyncio.run(state_machine.run())
+    except KeyboardInterrupt:
+        logger.info("Interrupted by user")
     except Exception as e:
         logger.error("Fatal error: %s", e)
         sys.exit(1)
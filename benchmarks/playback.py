@@ -0,0 +1,386 @@
+"""Playback benchmark: SleePy against a fake YouTube API and stub players.
+
+Runs the real StateMachine, YouTubePlayer, LocalPlayer, download queue and
+YouTubeDownloader in a scratch directory. The YouTube Data API is served by
+a local fake with a synthetic playlist, mpv, aplay, amixer, yt-dlp, ffprobe
+and sudo are stubs with configurable latencies (see fakes.py), and keys are
+fed in by a script. Tracks last --track-seconds instead of minutes, so a
+session of dozens of tracks takes seconds. Local tracks are real WAV files
+of 44.1 kHz mono samples, each holding one constant value the aplay stub tells
+the tracks apart by when the pipeline streams them into it.
+
+The script is a list of tokens run in order once SleePy waits for a
+playlist selection: a single character is a key press, 'track' waits until
+the next track starts and '<n>s' waits n seconds. By default it selects the
+playlist of the scenario, skips every --skip-every'th track after
+--skip-after seconds, presses ',' on every --download-every'th track and
+quits once --tracks tracks have started.
+
+Reported:
+    startup          from constructing the state machine to the selection prompt
+    select to audio  from the playlist key to the first track starting
+    transition       from a track ending (or the key that skipped it) to the next one starting
+    output gaps      times the aplay stub ran out of samples while streaming
+    API calls        requests to the fake YouTube API, per track played
+    peak RSS         maximum resident memory of the benchmark process
+
+Run from the repository root:
+    python benchmarks/playback.py [--scenario youtube|local] [--playlist-size 5000] [--tracks 20]
+        [--api-latency 0.02] [--record benchmarks/playback.jsonl] [--max-transition 0.5]
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import resource
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import wave
+from pathlib import Path
+from typing import Dict, List, Optional
+
+ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(ROOT))
+
+import yaml  # noqa: E402
+
+import sleepy.cues  # noqa: E402
+import sleepy.fader  # noqa: E402
+import sleepy.pipeline  # noqa: E402
+from fakes import FakeYouTubeAuthenticator, FakeYouTubeServer, install_stubs  # noqa: E402
+from sleepy import AudioPlayer, ConfigManager, State, StateMachine  # noqa: E402
+from sleepy.input_handler import get_input_reader  # noqa: E402
+from sleepy.metrics import get_metrics  # noqa: E402
+from sleepy.mpv_ipc import MpvIpcBackend  # noqa: E402
+
+PLAYLIST_ID = 'PLbenchmark'
+LOCAL_FOLDER = './local/bench'
+LOCAL_RATE = 44100
+SCENARIO_KEYS = {'youtube': '1', 'local': '2'}
+SKIP_KEYS = ('+', '0')
+DOWNLOAD_KEYS = (',', '.')
+
+
+class EventLog:
+    """Follows the events file the stubs append to."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.events: List[Dict] = []
+        self._offset = 0
+        self._partial = b''
+
+    def poll(self) -> List[Dict]:
+        """Read the events written since the last poll."""
+        try:
+            with open(self.path, 'rb') as f:
+                f.seek(self._offset)
+                data = f.read()
+        except FileNotFoundError:
+            return self.events
+        self._offset += len(data)
+        *lines, self._partial = (self._partial + data).split(b'\n')
+        self.events.extend(json.loads(line) for line in lines if line.strip())
+        return self.events
+
+    def track_starts(self) -> List[Dict]:
+        """Start events of tracks, leaving out sound cues."""
+        return [e for e in self.poll() if e['event'] == 'start' and not e.get('cue')]
+
+
+class KeyScript(threading.Thread):
+    """Feeds scripted key presses to SleePy while it runs."""
+
+    POLL_INTERVAL = 0.002
+
+    def __init__(self, tokens: List[str], state_machine: StateMachine, events: EventLog, timeout: float):
+        super().__init__(name='key-script', daemon=True)
+        self.tokens = tokens
+        self.state_machine = state_machine
+        self.events = events
+        self.timeout = timeout
+        self.ready_at: Optional[float] = None
+        self.presses: List[tuple] = []
+        self.error: Optional[str] = None
+
+    def run(self) -> None:
+        reader = get_input_reader()
+        if not self._wait(lambda: self.state_machine.state.current_state == State.SELECT):
+            self.error = "SleePy did not get to the playlist selection"
+            return
+        self.ready_at = time.time()
+
+        tracks = 0
+        for token in self.tokens:
+            if token == 'track':
+                tracks += 1
+                if not self._wait(lambda: len(self.events.track_starts()) >= tracks):
+                    self.error = f"track {tracks} did not start within {self.timeout:g} s"
+                    break
+            elif len(token) > 1 and token.endswith('s'):
+                time.sleep(float(token[:-1]))
+            else:
+                self.presses.append((time.time(), token))
+                reader.press(token)
+        if self.error or self.tokens[-1] not in ('/', '*'):
+            reader.press('/')
+
+    def _wait(self, condition) -> bool:
+        """Poll a condition until it holds or the timeout passes."""
+        deadline = time.monotonic() + self.timeout
+        while not condition():
+            if time.monotonic() > deadline or self.state_machine.state.current_state == State.QUIT:
+                return False
+            time.sleep(self.POLL_INTERVAL)
+        return True
+
+
+def default_script(args) -> List[str]:
+    """Build the key script of a scenario from the command line options."""
+    tokens = [SCENARIO_KEYS[args.scenario]]
+    for index in range(args.tracks):
+        tokens.append('track')
+        if args.download_every and index % args.download_every == 0:
+            tokens += [f'{args.skip_after / 2:g}s', ',']
+        if index == args.tracks - 1:
+            tokens += [f'{args.skip_after:g}s', '/']
+        elif args.skip_every and index % args.skip_every == args.skip_every - 1:
+            tokens += [f'{args.skip_after:g}s', '+']
+    return tokens
+
+
+def prepare_workspace(workspace: Path, args) -> None:
+    """Write the config, link the sounds and create the local tracks."""
+    (workspace / 'sounds').symlink_to(ROOT / 'sounds')
+    config = {
+        'LogLevel': 'WARNING',
+        'Playlists': {
+            SCENARIO_KEYS['youtube']: {
+                'name': 'benchmark-youtube',
+                'id': PLAYLIST_ID,
+                'delete_after_play': args.delete,
+                'shutdown_after_play': False,
+                'randomize': True,
+            },
+            SCENARIO_KEYS['local']: {
+                'name': 'benchmark-local',
+                'id': LOCAL_FOLDER,
+                'delete_after_play': False,
+                'shutdown_after_play': False,
+                'randomize': True,
+                'crossfade_seconds': args.crossfade,
+            },
+            '4': {
+                'name': 'local-asmr',
+                'id': './local/asmr',
+                'delete_after_play': False,
+                'shutdown_after_play': False,
+                'randomize': True,
+                'storage_codec': 'opus',
+            },
+        },
+        'Downloads': {'capture_streams': not args.no_capture},
+        'Loudness': {'target_lufs': None},
+        'Volume': {'level': 80, 'skip_fade_seconds': args.skip_fade},
+        'Metrics': {'port': 0, 'textfile': None},
+    }
+    (workspace / 'config.yaml').write_text(yaml.safe_dump(config))
+
+    folder = workspace / LOCAL_FOLDER
+    folder.mkdir(parents=True)
+    frames = int(LOCAL_RATE * args.track_seconds)
+    for index in range(args.local_files):
+        with wave.open(str(folder / f'track_{index:05d}.wav'), 'wb') as f:
+            f.setnchannels(1)
+            f.setsampwidth(2)
+            f.setframerate(LOCAL_RATE)
+            f.writeframes((index + 1).to_bytes(2, 'little') * frames)
+
+
+def percentile(values: List[float], fraction: float) -> Optional[float]:
+    """Nearest-rank percentile, None for no values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def transitions(starts: List[Dict], events: List[Dict], presses: List[tuple]) -> List[float]:
+    """Time from the end of each track, or the key that skipped it, to the start of the next."""
+    finished = {e['id']: e['t'] for e in events if e['event'] in ('end', 'stop')}
+    latencies = []
+    for previous, current in zip(starts, starts[1:]):
+        skips = [t for t, key in presses if key in SKIP_KEYS and previous['t'] <= t < current['t']]
+        ended = skips[0] if skips else finished.get(previous['id'])
+        if ended is not None:
+            latencies.append(current['t'] - ended)
+    return latencies
+
+
+def run(args, workspace: Path) -> Dict:
+    """Run one scripted session and measure it."""
+    events = EventLog(workspace / 'events.jsonl')
+    prepare_workspace(workspace, args)
+    os.environ.update(install_stubs(
+        workspace / 'bin',
+        events.path,
+        track_seconds=args.track_seconds,
+        cue_seconds=args.cue_seconds,
+        mpv_start=args.mpv_start,
+        aplay_start=args.aplay_start,
+        ytdlp_seconds=args.ytdlp_seconds,
+    ))
+    server = FakeYouTubeServer({PLAYLIST_ID: args.playlist_size}, latency=args.api_latency)
+    server.start()
+    # Keep the real mixer and sound card out of it, the stubs stand in for them
+    sleepy.fader.alsaaudio = None
+    sleepy.cues.alsaaudio = None
+    sleepy.pipeline.alsaaudio = None
+    get_metrics().reset()
+
+    tokens = args.script.split() if args.script else default_script(args)
+    cwd = os.getcwd()
+    os.chdir(workspace)
+    try:
+        started = time.time()
+        audio_player = AudioPlayer(mute=False)
+        audio_player.mpv = MpvIpcBackend(str(workspace / 'mpv.sock'))
+        youtube_auth = FakeYouTubeAuthenticator(server.url, audio_player)
+        state_machine = StateMachine(ConfigManager(), audio_player, youtube_auth)
+        script = KeyScript(tokens, state_machine, events, args.wait_timeout)
+        script.start()
+        asyncio.run(state_machine.run())
+        script.join(timeout=5)
+        quota_units = youtube_auth.quota.used()
+    finally:
+        os.chdir(cwd)
+        server.stop()
+
+    if script.error:
+        raise RuntimeError(script.error)
+
+    all_events = events.poll()
+    starts = events.track_starts()
+    selects = [t for t, key in script.presses if key == SCENARIO_KEYS.get(args.scenario)]
+    latencies = transitions(starts, all_events, script.presses)
+    api_calls = sum(server.calls.values())
+    calls = {
+        dict(key).get('call', ''): {'count': count, 'mean': round(total / count, 6)}
+        for key, (count, total) in get_metrics().histogram_totals('sleepy_call_seconds').items() if count
+    }
+    return {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': os.uname().nodename,
+        'scenario': args.scenario,
+        'playlist_size': args.playlist_size,
+        'api_latency': args.api_latency,
+        'tracks': len(starts),
+        'startup': round(script.ready_at - started, 4),
+        'select_to_audio': round(starts[0]['t'] - selects[0], 4) if starts and selects else None,
+        'transition_median': round(percentile(latencies, 0.5), 4) if latencies else None,
+        'transition_p95': round(percentile(latencies, 0.95), 4) if latencies else None,
+        'transition_max': round(max(latencies), 4) if latencies else None,
+        'api_calls': dict(server.calls),
+        'api_calls_per_track': round(api_calls / len(starts), 3) if starts else None,
+        'quota_units': quota_units,
+        'downloads_requested': sum(1 for _, key in script.presses if key in DOWNLOAD_KEYS),
+        'downloads': {
+            dict(key).get('source', ''): int(value)
+            for key, value in get_metrics().counter_values('sleepy_downloads_total').items()
+        },
+        'output_gaps': sum(1 for e in all_events if e['event'] == 'gap'),
+        'pipeline_transitions': {
+            dict(key).get('kind', ''): int(value)
+            for key, value in get_metrics().counter_values('sleepy_pipeline_transitions_total').items()
+        },
+        'max_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        'calls': calls,
+    }
+
+
+def ms(value: Optional[float]) -> str:
+    return f"{value * 1000:8.1f} ms" if value is not None else "       - ms"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure SleePy playback against fake YouTube and stub players")
+    parser.add_argument('--scenario', choices=sorted(SCENARIO_KEYS), default='youtube', help="Playlist to play")
+    parser.add_argument('--playlist-size', type=int, default=5000, help="Items in the fake YouTube playlist")
+    parser.add_argument('--local-files', type=int, default=500, help="WAV files in the local playlist")
+    parser.add_argument('--tracks', type=int, default=20, help="Tracks to start before quitting")
+    parser.add_argument('--skip-every', type=int, default=2, help="Skip every n'th track, 0 to let all play out")
+    parser.add_argument('--skip-after', type=float, default=0.3, help="Seconds into a track to press keys")
+    parser.add_argument('--download-every', type=int, default=0, help="Press ',' on every n'th track")
+    parser.add_argument('--delete', action='store_true', help="Delete played YouTube items (batched deletes)")
+    parser.add_argument('--no-capture', action='store_true', help="Do not record streams, download with yt-dlp")
+    parser.add_argument('--script', help="Key script instead of the scenario's, e.g. \"1 track 0.3s + track /\"")
+    parser.add_argument('--track-seconds', type=float, default=1.0, help="Length of every track")
+    parser.add_argument('--crossfade', type=float, default=0.0, help="crossfade_seconds of the local playlist")
+    parser.add_argument('--cue-seconds', type=float, default=0.1, help="Length of every sound cue")
+    parser.add_argument('--api-latency', type=float, default=0.02, help="Seconds per YouTube API request")
+    parser.add_argument('--mpv-start', type=float, default=0.05, help="Seconds mpv takes to start a loaded file")
+    parser.add_argument('--aplay-start', type=float, default=0.0, help="Seconds aplay takes to start")
+    parser.add_argument('--ytdlp-seconds', type=float, default=0.3, help="Seconds per yt-dlp call")
+    parser.add_argument('--skip-fade', type=float, default=0.0, help="Volume.skip_fade_seconds")
+    parser.add_argument('--wait-timeout', type=float, default=30.0, help="Seconds to wait for SleePy at each step")
+    parser.add_argument('--keep', action='store_true', help="Keep the scratch directory")
+    parser.add_argument('--verbose', action='store_true', help="Show SleePy's log")
+    parser.add_argument('--record', help="Append the summary as a JSON line to this file")
+    parser.add_argument('--max-transition', type=float, help="Fail if the p95 transition exceeds this many seconds")
+    args = parser.parse_args()
+
+    logging.basicConfig(
+        level=logging.INFO if args.verbose else logging.ERROR,
+        format="%(asctime)s %(levelname)s %(name)s: %(message)s"
+    )
+    if not args.verbose:
+        # Keys come from the script, there is no keypad or terminal to read
+        logging.getLogger('sleepy.input_handler').setLevel(logging.CRITICAL)
+    record = Path(args.record).resolve() if args.record else None
+    workspace = Path(tempfile.mkdtemp(prefix='sleepy-bench-'))
+    try:
+        summary = run(args, workspace)
+    finally:
+        if args.keep:
+            print(f"scratch directory kept in {workspace}")
+        else:
+            shutil.rmtree(workspace, ignore_errors=True)
+
+    print(f"tracks started  {summary['tracks']:8d}")
+    print(f"startup         {ms(summary['startup'])}")
+    print(f"select to audio {ms(summary['select_to_audio'])}")
+    print(f"transition      {ms(summary['transition_median'])} (median), "
+          f"{ms(summary['transition_p95']).strip()} (p95), {ms(summary['transition_max']).strip()} (max)")
+    if summary['pipeline_transitions'] or summary['output_gaps']:
+        kinds = ', '.join(f"{count} {kind}" for kind, count in sorted(summary['pipeline_transitions'].items()))
+        print(f"output gaps     {summary['output_gaps']:8d} ({kinds or 'no'} pipeline transitions)")
+    print(f"API calls       {sum(summary['api_calls'].values()):8d} "
+          f"({summary['api_calls_per_track']} per track, {summary['quota_units']} quota units)")
+    for method, count in sorted(summary['api_calls'].items()):
+        print(f"  {method:26s} {count:6d}")
+    if summary['downloads_requested']:
+        sources = ', '.join(f"{count} {source}" for source, count in sorted(summary['downloads'].items()))
+        print(f"downloads       {sum(summary['downloads'].values()):8d} of {summary['downloads_requested']} ({sources})")
+    print(f"peak RSS        {summary['max_rss_mb']:8.1f} MB")
+    print("external calls  (count, mean)")
+    for call, stats in sorted(summary['calls'].items()):
+        print(f"  {call:26s} {stats['count']:6d} {stats['mean'] * 1000:8.1f} ms")
+
+    if record:
+        with open(record, 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+
+    if (args.max_transition is not None and summary['transition_p95'] is not None
+            and summary['transition_p95'] > args.max_transition):
+        print(f"p95 transition above {args.max_transition} s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
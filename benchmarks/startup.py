@@ -0,0 +1,106 @@
+"""Startup benchmark: time until `import sleepy` is done and until SleePy is ready.
+
+Each run starts a fresh interpreter that imports the package, builds the
+objects SleePy.py builds and runs the init state (config, download queue,
+library, up.wav) muted. "ready" is the wall time from process start until
+the state machine would wait for a playlist selection.
+
+Run from the repository root:
+    python benchmarks/startup.py [--runs 5] [--record benchmarks/startup.jsonl] [--max-ready 2.0]
+"""
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+
+CHILD = r'''
+import asyncio, json, sys, time
+import_start = time.time()
+import sleepy
+import_done = time.time()
+from sleepy import AudioPlayer, ConfigManager, State, StateMachine, YouTubeAuthenticator
+# Leave the system volume alone while benchmarking
+AudioPlayer._set_system_volume = staticmethod(lambda volume: None)
+audio_player = AudioPlayer(mute=True)
+state_machine = StateMachine(ConfigManager(), audio_player, YouTubeAuthenticator(audio_player))
+asyncio.run(state_machine._state_init())
+ready = time.time()
+assert state_machine.state.current_state == State.SELECT
+state_machine.download_queue.stop()
+state_machine.storage.stop()
+state_machine.loudness.stop()
+state_machine.metrics.stop()
+state_machine.library.close()
+audio_player.close()
+print(json.dumps({
+    'import_start': import_start,
+    'import_done': import_done,
+    'ready': ready,
+    'google_loaded': any(name.startswith(('google', 'googleapiclient')) for name in sys.modules),
+}))
+'''
+
+
+def run_once() -> dict:
+    """Start one SleePy process and collect its timestamps."""
+    started = time.time()
+    result = subprocess.run(
+        [sys.executable, '-c', CHILD],
+        cwd=ROOT,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        check=False,
+        timeout=120
+    )
+    if result.returncode != 0:
+        raise RuntimeError(result.stderr.decode().strip().splitlines()[-1])
+    marks = json.loads(result.stdout.decode().strip().splitlines()[-1])
+    return {
+        'interpreter': marks['import_start'] - started,
+        'import': marks['import_done'] - marks['import_start'],
+        'ready': marks['ready'] - started,
+        'google_loaded': marks['google_loaded'],
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure SleePy import and boot-to-ready time")
+    parser.add_argument('--runs', type=int, default=5, help="Number of fresh processes to time")
+    parser.add_argument('--record', help="Append the summary as a JSON line to this file")
+    parser.add_argument('--max-ready', type=float, help="Fail if the median ready time exceeds this many seconds")
+    args = parser.parse_args()
+
+    runs = [run_once() for _ in range(args.runs)]
+    summary = {
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'host': os.uname().nodename,
+        'runs': len(runs),
+        'import_median': round(statistics.median(r['import'] for r in runs), 4),
+        'ready_median': round(statistics.median(r['ready'] for r in runs), 4),
+        'ready_min': round(min(r['ready'] for r in runs), 4),
+        'google_loaded': any(r['google_loaded'] for r in runs),
+    }
+
+    print(f"import sleepy   {summary['import_median'] * 1000:8.1f} ms (median)")
+    print(f"boot to ready   {summary['ready_median'] * 1000:8.1f} ms (median), {summary['ready_min'] * 1000:.1f} ms (min)")
+    print(f"google imported {summary['google_loaded']}")
+
+    if args.record:
+        with open(args.record, 'a') as f:
+            f.write(json.dumps(summary) + '\n')
+
+    if args.max_ready is not None and summary['ready_median'] > args.max_ready:
+        print(f"ready time above {args.max_ready} s", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,125 @@
+"""One-shot re-encode of the local WAV library into each playlist's storage codec.
+
+Every local playlist in config.yaml with a storage_codec other than wav has
+its WAV files re-encoded with ffmpeg, one job per CPU core. The encoded file
+is written under a hidden temporary name and renamed into place, so a file
+is never visible half-written. Originals are deleted unless --keep is given.
+
+Usage: python migrate_audio.py [--codec opus --bitrate 96k] [--keep] [folders...]
+"""
+
+import argparse
+import logging
+import os
+import subprocess
+import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from sleepy.config import ConfigManager
+from sleepy.constants import STORAGE_CODECS
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(name)s[%(process)d]: %(levelname)s: %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger('sleepy-migrate')
+
+# ffmpeg encoder and container per storage codec
+ENCODERS = {
+    'flac': ('flac', 'flac'),
+    'opus': ('libopus', 'ogg'),
+    'vorbis': ('libvorbis', 'ogg'),
+    'mp3': ('libmp3lame', 'mp3'),
+}
+
+
+def encode(source: Path, codec: str, bitrate: Optional[str], keep: bool) -> Tuple[Path, int, int]:
+    """Re-encode one file next to the original.
+
+    Returns:
+        The source path, its size and the size of the encoded file.
+    """
+    encoder, container = ENCODERS[codec]
+    target = source.with_suffix(STORAGE_CODECS[codec])
+    temp = target.with_name(f'.{target.name}.part')
+
+    cmd = ['ffmpeg', '-nostdin', '-loglevel', 'error', '-y', '-i', str(source), '-vn', '-c:a', encoder]
+    if bitrate and codec != 'flac':
+        cmd += ['-b:a', bitrate]
+    cmd += ['-f', container, str(temp)]
+
+    result = subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=False)
+    if result.returncode != 0:
+        temp.unlink(missing_ok=True)
+        raise RuntimeError(result.stderr.decode().strip())
+
+    # Keep the original mtime, it orders the library by age
+    stat = source.stat()
+    os.utime(temp, (stat.st_atime, stat.st_mtime))
+    temp.replace(target)
+    encoded_size = target.stat().st_size
+    if not keep:
+        source.unlink()
+    return source, stat.st_size, encoded_size
+
+
+def collect_jobs(args) -> List[Tuple[Path, str, Optional[str]]]:
+    """Find the WAV files to re-encode and the codec for each of them."""
+    jobs = []
+    if args.folders:
+        if not args.codec:
+            logger.error("--codec is required when folders are given")
+            return []
+        targets = [(Path(folder), args.codec, args.bitrate) for folder in args.folders]
+    else:
+        config = ConfigManager()
+        config.load()
+        targets = [
+            (Path(playlist.id), args.codec or playlist.storage_codec, args.bitrate or playlist.storage_bitrate)
+            for playlist in config.playlists.values()
+            if playlist.is_local()
+        ]
+
+    seen = set()
+    for folder, codec, bitrate in targets:
+        if codec == 'wav' or folder.resolve() in seen or not folder.is_dir():
+            continue
+        seen.add(folder.resolve())
+        files = sorted(path for path in folder.glob('*.wav') if not path.name.startswith('.'))
+        logger.info("%s: %d files to %s", folder, len(files), codec)
+        jobs += [(path, codec, bitrate) for path in files]
+    return jobs
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('folders', nargs='*', help="Folders to migrate (default: local playlists in config.yaml)")
+    parser.add_argument('--codec', choices=sorted(ENCODERS), help="Override the configured storage codec")
+    parser.add_argument('--bitrate', help="Override the configured bitrate, e.g. 96k")
+    parser.add_argument('--keep', action='store_true', help="Keep the original WAV files")
+    parser.add_argument('--jobs', type=int, default=os.cpu_count() or 1, help="Parallel ffmpeg processes")
+    args = parser.parse_args()
+
+    jobs = collect_jobs(args)
+    if not jobs:
+        logger.info("Nothing to migrate")
+        sys.exit(0)
+
+    saved = 0
+    failed = 0
+    with ThreadPoolExecutor(max_workers=max(1, args.jobs)) as executor:
+        futures = {executor.submit(encode, path, codec, bitrate, args.keep): path for path, codec, bitrate in jobs}
+        for future in as_completed(futures):
+            try:
+                source, before, after = future.result()
+                saved += before - after
+                logger.info("%s: %.1f MB -> %.1f MB", source.name, before / 1e6, after / 1e6)
+            except Exception as e:
+                failed += 1
+                logger.error("Failed to encode %s: %s", futures[future], e)
+
+    logger.info("Migrated %d files, saved %.1f MB, %d failed", len(jobs) - failed, saved / 1e6, failed)
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,130 @@
+"""Download the next tracks of every YouTube playlist for offline playback.
+
+Meant to run from sleepy_mirror.timer while nobody is listening. For each
+YouTube playlist in config.yaml, the playlist index is refreshed and the
+next tracks_per_playlist items (in shuffle order for randomized playlists)
+are downloaded into the mirror through YouTubeDownloader. Copies of videos
+that left a playlist are deleted, then the least recently used files are
+evicted until the mirror fits Mirror.max_size_mb.
+
+Usage: python mirror_playlists.py [--tracks N] [playlist keys...]
+"""
+
+import argparse
+import logging
+import sys
+from typing import List, Set, Tuple
+
+from sleepy.config import ConfigManager
+from sleepy.delete_queue import DeleteQueue
+from sleepy.downloader import YouTubeDownloader
+from sleepy.mirror import PlaylistMirror
+from sleepy.models import PlaylistConfig, PlaylistItem
+from sleepy.playlist_cache import PlaylistCache
+from sleepy.scheduler import ShuffleScheduler
+from sleepy.youtube import YouTubeAuthenticator
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(name)s[%(process)d]: %(levelname)s: %(message)s',
+    handlers=[logging.StreamHandler(sys.stdout)]
+)
+logger = logging.getLogger('sleepy-mirror')
+
+
+def upcoming_items(
+    playlist: PlaylistConfig, cache: PlaylistCache, scheduler: ShuffleScheduler, count: int
+) -> List[PlaylistItem]:
+    """Get the items the player will pick next, in order."""
+    if playlist.randomize:
+        item_ids = scheduler.upcoming(
+            playlist.id,
+            cache.version(playlist.id),
+            lambda: cache.item_ids(playlist.id),
+            count,
+            playlist.shuffle_weighting
+        )
+        items = [cache.find_item(playlist.id, item_id) for item_id in item_ids]
+    else:
+        items = [cache.get_item(playlist.id, idx) for idx in range(min(count, cache.count(playlist.id)))]
+    return [item for item in items if item is not None]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Mirror upcoming YouTube playlist items for offline playback")
+    parser.add_argument('keys', nargs='*', help="Playlist keys from config.yaml (default: all YouTube playlists)")
+    parser.add_argument('--tracks', type=int, help="Items to mirror per playlist (default: Mirror.tracks_per_playlist)")
+    args = parser.parse_args()
+
+    config = ConfigManager()
+    if not config.load():
+        return 1
+    count = args.tracks if args.tracks is not None else config.mirror_tracks_per_playlist
+    if count <= 0:
+        logger.info("Mirroring is disabled (tracks_per_playlist is 0)")
+        return 0
+
+    # Several keys may point at the same playlist
+    playlists = {}
+    for key, playlist in config.playlists.items():
+        if not playlist.is_local() and (not args.keys or key in args.keys):
+            playlists.setdefault(playlist.id, playlist)
+
+    youtube_auth = YouTubeAuthenticator()
+    youtube_auth.quota.daily_limit = config.youtube_quota_per_day
+    youtube_auth.quota.reserve = config.youtube_quota_reserve
+    cache = PlaylistCache()
+    # Only read, the player sends the deletes
+    delete_queue = DeleteQueue(youtube_auth)
+    scheduler = ShuffleScheduler()
+    mirror = PlaylistMirror(max_bytes=config.mirror_max_bytes)
+    downloader = YouTubeDownloader()
+    downloader.set_format(config.mirror_codec, config.mirror_bitrate)
+
+    online = youtube_auth.ensure_client() is not None
+    infos = {}
+    if not online:
+        logger.warning("YouTube API unavailable, mirroring from the cached playlist index")
+    elif youtube_auth.quota.allows('playlists.list'):
+        # One call checks every playlist, instead of one per playlist
+        infos = youtube_auth.get_playlist_infos(list(playlists))
+
+    wanted: Set[Tuple[str, str]] = set()
+    downloaded = failed = 0
+    try:
+        for playlist in playlists.values():
+            if online:
+                cache.refresh(
+                    youtube_auth, playlist.id, info=infos.get(playlist.id), pending_deletes=delete_queue.pending_ids
+                )
+            if not cache.count(playlist.id):
+                logger.warning("Playlist %s is empty or was never fetched", playlist.name)
+                continue
+
+            pruned = mirror.prune(playlist.id, cache.video_ids(playlist.id))
+            if pruned:
+                logger.info("Deleted %d mirrored items that left %s", pruned, playlist.name)
+
+            for item in upcoming_items(playlist, cache, scheduler, count):
+                wanted.add((playlist.id, item.video_id))
+                if mirror.contains(playlist.id, item.video_id):
+                    continue
+                if mirror.fetch(downloader, playlist.id, item):
+                    downloaded += 1
+                else:
+                    failed += 1
+
+        mirror.evict(protect=wanted)
+    finally:
+        youtube_auth.close()
+
+    logger.info(
+        "Mirror done: %d downloaded, %d failed, %.1f MB in use",
+        downloaded, failed, mirror.total_bytes() / 1024 / 1024
+    )
+    mirror.close()
+    return 0 if not failed else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
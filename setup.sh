@@ -2,11 +2,15 @@
 
 echo "Linking systemd services..."
 sudo systemctl link "$(pwd)/setup/sleepy_boot.service"
+sudo systemctl link "$(pwd)/setup/sleepy_mirror.service"
+sudo systemctl link "$(pwd)/setup/sleepy_mirror.timer"
 
 echo "Enabling services..."
 sudo systemctl enable sleepy_boot.service
+sudo systemctl enable sleepy_mirror.timer
 
 echo "Starting services..."
 sudo systemctl start sleepy_boot.service
+sudo systemctl start sleepy_mirror.timer
 
 echo "Done."
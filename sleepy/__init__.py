@@ -3,7 +3,7 @@
 from sleepy.audio import AudioPlayer
 from sleepy.config import ConfigManager
 from sleepy.constants import Action, State
-from sleepy.input_handler import KeyboardPoller
+from sleepy.input_handler import InputReader, KeyboardPoller, KeyPress, get_input_reader
 from sleepy.models import PlaylistConfig
 from sleepy.players import ContentPlayer, LocalPlayer, YouTubePlayer
 from sleepy.state_machine import StateMachine
@@ -14,7 +14,10 @@ __all__ = [
     'ConfigManager',
     'Action',
     'State',
+    'InputReader',
     'KeyboardPoller',
+    'KeyPress',
+    'get_input_reader',
     'PlaylistConfig',
     'ContentPlayer',
     'LocalPlayer',
@@ -1,17 +1,27 @@
 """Audio playback and sound effects management."""
 
+import asyncio
 import logging
 import subprocess
+import threading
 import time
 from pathlib import Path
-from typing import List
+from typing import Awaitable, Callable, List, Optional, Tuple
 from sleepy.state import StateContainer
 
 from sleepy.constants import (
     AUDIO_SOUND_DIR,
     AUDIO_VOLUME_LEVEL,
+    FAILED_KEY,
+    INTERRUPT_KEY,
 )
-from sleepy.input_handler import KeyboardPoller
+from sleepy.cues import CuePlayer
+from sleepy.fader import VolumeFader
+from sleepy.input_handler import get_input_reader
+from sleepy.metrics import get_metrics
+from sleepy.mpv_ipc import MpvIpcBackend
+from sleepy.pipeline import LocalPipeline, PlaybackHandle
+from sleepy.positions import PositionStore
 
 LOGGER = logging.getLogger(__name__)
 
@@ -23,50 +33,120 @@ class AudioPlayer:
     MPV_CMD = 'mpv'
     
     RIGHT_ARROW = '\x1b[C'
+    MIN_GAIN_DB = 0.1  # smaller loudness corrections are not worth leaving aplay for
+    POSITION_INTERVAL = 10.0  # seconds between updates of the stored playback position
     
     def __init__(self, mute: bool = False):
+        self.mpv = MpvIpcBackend()
+        self.pipeline = LocalPipeline()
+        self.fader = VolumeFader()
+        self.volume = AUDIO_VOLUME_LEVEL
+        self.skip_fade = 0.0
+        self._interrupt = asyncio.Event()
+        self._queue_lock = threading.Lock()
+        self._stream_active = False
+        self._pending_stream: Optional[Tuple[str, Optional[str], float]] = None
+        self._pending_local: Optional[Tuple[str, float, float, float]] = None
+        # Where playback stopped, for tracks that have a state.current_position_key
+        self.positions: Optional[PositionStore] = None
+        self._gain_db = 0.0
+        self.cues = CuePlayer(AUDIO_SOUND_DIR)
         self.set_mute(mute)
 
-    def set_mute(self, mute: bool = True):
+    def set_mute(self, mute: bool = True, fade: float = 0):
+        """Mute or unmute the system volume.
+        
+        Args:
+            mute: Mute if True, restore the playback volume otherwise.
+            fade: Seconds to ramp the volume over, 0 to switch at once.
+        """
         self.mute = mute
-        if mute:
-            self._set_system_volume(0)
+        volume = 0 if mute else self.volume
+        if fade > 0:
+            self.fader.fade(volume, fade)
+            LOGGER.info("System volume faded to %d%%", volume)
         else:
-            self._set_system_volume(AUDIO_VOLUME_LEVEL)
+            self._set_system_volume(volume)
+    
+    def fade_out(self, duration: float) -> bool:
+        """Ramp the system volume down to silence, blocking until done.
+        
+        Returns:
+            True if silence was reached, False if the fade was superseded.
+        """
+        LOGGER.info("Fading out over %.1f s", duration)
+        return self.fader.fade(0, duration)
+    
+    def interrupt(self) -> None:
+        """Stop the cancellable playback in progress, e.g. when the sleep timer expires.
+        
+        The playback call returns INTERRUPT_KEY. Must be called from the event loop.
+        """
+        self._interrupt.set()
+    
+    def _set_system_volume(self, volume) -> None:
+        """Set system ALSA volume."""
+        self.fader.set(volume)
+        LOGGER.info("System volume set to %d%%", volume)
     
-    @staticmethod
-    def _set_system_volume(volume) -> None:
-        """Set system ALSA volume on startup."""
+    def play_sound(self, sound_file: str, wait: bool = True) -> None:
+        """Play a sound effect file.
+        
+        Args:
+            sound_file: File name inside the sound directory.
+            wait: Block until the sound has finished playing.
+        """
+        if self.mute:
+            return
+        
+        if self.cues.available:
+            handle = self.cues.play(sound_file)
+            if handle is not None:
+                if wait:
+                    handle.wait()
+                return
+        
+        sound_path = Path(AUDIO_SOUND_DIR) / sound_file
         try:
-            subprocess.run(
-                ['amixer', 'sset', 'Master', f'{volume}%'],
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                check=False
-            )
-            LOGGER.info("System volume set to %d%%", volume)
+            cmd = [self.APLAY_CMD, str(sound_path)]
+            if wait:
+                subprocess.run(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+            else:
+                subprocess.Popen(cmd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except FileNotFoundError:
+            LOGGER.error("Audio player not found: %s", self.APLAY_CMD)
         except Exception as e:
-            LOGGER.warning("Failed to set system volume: %s", e)
+            LOGGER.error("Failed to play sound %s: %s", sound_file, e)
     
-    def play_sound(self, sound_file: str) -> None:
-        """Play a sound effect file."""
+    async def play_sound_async(self, sound_file: str) -> None:
+        """Play a sound effect file without blocking the event loop.
+        
+        Args:
+            sound_file: File name inside the sound directory.
+        """
         if self.mute:
             return
         
+        if self.cues.available:
+            handle = self.cues.play(sound_file)
+            if handle is not None:
+                await asyncio.to_thread(handle.wait)
+                return
+        
         sound_path = Path(AUDIO_SOUND_DIR) / sound_file
         try:
-            subprocess.run(
-                [self.APLAY_CMD, str(sound_path)],
+            proc = await asyncio.create_subprocess_exec(
+                self.APLAY_CMD, str(sound_path),
                 stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                check=False
+                stderr=subprocess.DEVNULL
             )
+            await proc.wait()
         except FileNotFoundError:
             LOGGER.error("Audio player not found: %s", self.APLAY_CMD)
         except Exception as e:
             LOGGER.error("Failed to play sound %s: %s", sound_file, e)
     
-    def play_sound_cancellable(self, state: StateContainer, action_keys: List[str], non_terminating_keys: List[str] = []) -> str:
+    async def play_sound_cancellable(self, state: StateContainer, action_keys: List[str], non_terminating_keys: List[str] = []) -> str:
         """Play a sound file, allowing cancellation via special keys.
         
         Args:
@@ -74,14 +154,65 @@ class AudioPlayer:
             action_keys: Keys that can cancel playback.
             non_terminating_keys: Keys that don't stop playback (default: empty list).
         """
-        return self._run_cancellable_process(
+        audio_path = Path(state.current_audio_file)
+        if (self.cues.available and self.cues.has_sound(audio_path.name)
+                and audio_path.resolve().parent == Path(AUDIO_SOUND_DIR).resolve()):
+            handle = self.cues.play(audio_path.name)
+            LOGGER.info("Playing sound cue: %s. Waiting for keys: %s", audio_path.name, action_keys)
+            
+            async def cancel() -> None:
+                handle.cancel()
+            
+            return await self._wait_cancellable(
+                asyncio.to_thread(handle.wait),
+                cancel,
+                action_keys,
+                non_terminating_keys,
+                state
+            )
+        
+        if audio_path.suffix.lower() == '.wav':
+            handle = await asyncio.to_thread(
+                self._play_local, str(audio_path), self._gain(state), state.current_start
+            )
+            if handle is not None:
+                LOGGER.info("Playing %s through the pipeline. Waiting for keys: %s", audio_path, action_keys)
+                
+                async def stop() -> None:
+                    await self._faded(asyncio.to_thread(self.pipeline.stop))
+                
+                return await self._wait_cancellable(
+                    asyncio.to_thread(handle.wait),
+                    stop,
+                    action_keys,
+                    non_terminating_keys,
+                    state,
+                    lambda: handle.position
+                )
+        with self._queue_lock:
+            self._pending_local = None
+        
+        if audio_path.suffix.lower() != '.wav' or self._gain(state) or state.current_start:
+            # aplay only handles PCM at unity gain from the start, anything else is played by mpv
+            if await asyncio.to_thread(self.mpv.ensure_running):
+                return await self._run_cancellable_stream(
+                    str(audio_path.resolve()), action_keys, non_terminating_keys, state
+                )
+            return await self._run_cancellable_process(
+                [self.MPV_CMD, '--no-video', *self._gain_args(state), *self._start_args(state), str(audio_path)],
+                action_keys,
+                non_terminating_keys,
+                state
+            )
+        
+        return await self._run_cancellable_process(
             [self.APLAY_CMD, str(state.current_audio_file)],
             action_keys,
             non_terminating_keys,
             state
         )
     
-    def stream_video_sound_cancellable(
+    async def stream_video_sound_cancellable(
         self, state: StateContainer, action_keys: List[str], non_terminating_keys: List[str] = []) -> str:
         """Stream video audio, allowing cancellation via special keys.
         
@@ -90,20 +221,166 @@ class AudioPlayer:
             action_keys: Keys that can cancel playback.
             non_terminating_keys: Keys that don't stop playback (default: empty list).
         """
+        url = state.current_stream_url or state.current_video_url
+        if await asyncio.to_thread(self.mpv.ensure_running):
+            return await self._run_cancellable_stream(
+                url, action_keys, non_terminating_keys, state, record_to=state.current_capture_file
+            )
+
+        LOGGER.warning("mpv IPC backend unavailable, starting a process per track")
+        cmd = [self.MPV_CMD, '--no-video', *self._gain_args(state), *self._start_args(state)]
+        if state.current_stream_url:
+            # Already resolved by the prefetcher, skip mpv's ytdl_hook
+            cmd.append('--ytdl=no')
+        if state.current_capture_file:
+            cmd.append(f'--stream-record={state.current_capture_file}')
+        cmd.append(url)
 
-        return self._run_cancellable_process(
-            [
-                self.MPV_CMD,
-                '--no-video',
-                state.current_video_url
-            ],
+        return await self._run_cancellable_process(
+            cmd,
             action_keys,
             non_terminating_keys,
             state
         )
     
-    @staticmethod
-    def _run_cancellable_process(cmd: List[str], action_keys: List[str], non_terminating_keys: List[str] = [], state: StateContainer = None) -> str:
+    def _gain(self, state: StateContainer) -> float:
+        """Get the playback gain of a track, 0 if it is too small to apply."""
+        return state.current_gain_db if abs(state.current_gain_db) >= self.MIN_GAIN_DB else 0.0
+    
+    def _gain_args(self, state: StateContainer) -> List[str]:
+        """Get the mpv options that apply the playback gain of a track."""
+        if not self._gain(state):
+            return []
+        return [f'--volume-gain={state.current_gain_db:.2f}']
+    
+    def _start_args(self, state: StateContainer) -> List[str]:
+        """Get the mpv options that start a track at its resume position."""
+        if not state.current_start:
+            return []
+        return [f'--start={state.current_start:.3f}']
+    
+    def queue_stream(self, url: str, record_to: Optional[str] = None, start: float = 0.0) -> bool:
+        """Append a stream to the persistent mpv playlist for a gapless transition.
+        
+        If the current stream has not been loaded yet, the URL is appended
+        as soon as it is.
+        
+        Args:
+            url: The URL to play after the current one.
+            record_to: File to write the received stream to while it plays.
+            start: Seconds into the stream to start at.
+            
+        Returns:
+            True if the stream was queued, False otherwise.
+        """
+        with self._queue_lock:
+            if not self._stream_active:
+                self._pending_stream = (url, record_to, start)
+                return True
+            return self.mpv.loadfile(url, append=True, record_to=record_to, start=start) is not None
+    
+    def queue_local(self, path: str, gain_db: float = 0.0, crossfade: float = 0.0, start: float = 0.0) -> None:
+        """Queue a local file behind the one about to play, for a gapless or crossfaded transition.
+        
+        The file is handed to the pipeline once the current file plays
+        through it; if the current file is played by mpv or aplay instead,
+        nothing is queued.
+        
+        Args:
+            path: The file to play after the current one.
+            gain_db: Playback gain of the file.
+            crossfade: Seconds to overlap the two files, 0 for a gapless switch.
+            start: Seconds into the file to start at.
+        """
+        with self._queue_lock:
+            self._pending_local = (path, gain_db if abs(gain_db) >= self.MIN_GAIN_DB else 0.0, crossfade, start)
+    
+    def stop_stream(self) -> None:
+        """Stop the persistent mpv player and the pipeline, dropping any queued stream or file."""
+        with self._queue_lock:
+            self._pending_stream = None
+            self._pending_local = None
+        self.mpv.stop()
+        self.pipeline.stop()
+    
+    def close(self) -> None:
+        """Shut down the persistent mpv player, the pipeline, the cue output and the mixer."""
+        self.mpv.close()
+        self.pipeline.close()
+        self.cues.close()
+        self.fader.close()
+    
+    async def _run_cancellable_stream(self, url: str, action_keys: List[str], non_terminating_keys: List[str] = [], state: StateContainer = None, record_to: Optional[str] = None) -> str:
+        """Play a URL on the persistent mpv player, allowing cancellation via special keys.
+        
+        If the URL was queued earlier and mpv already switched over to it,
+        the running playback is picked up instead of being restarted.
+        
+        Returns:
+            The key pressed to cancel, FAILED_KEY if mpv ended the stream
+            with anything but its end, or empty string if playback completed
+            normally.
+        """
+        gain_db = state.current_gain_db if state is not None and abs(state.current_gain_db) >= self.MIN_GAIN_DB else 0.0
+        # A restarted mpv starts at unity gain again, so only a gain that was set needs undoing
+        if gain_db or self._gain_db:
+            await asyncio.to_thread(self.mpv.set_gain, gain_db)
+            self._gain_db = gain_db
+        entry_id = await asyncio.to_thread(self.mpv.attach, url)
+        if entry_id is not None:
+            LOGGER.info("Continuing queued stream: %s. Waiting for keys: %s", url, action_keys)
+        else:
+            start = state.current_start if state is not None else 0.0
+            entry_id = await asyncio.to_thread(self.mpv.loadfile, url, False, record_to, start)
+            if entry_id is None:
+                LOGGER.error("Failed to load stream %s", url)
+                return FAILED_KEY
+            LOGGER.info("Started stream: %s. Waiting for keys: %s", url, action_keys)
+        
+        async def cancel() -> None:
+            await self._faded(asyncio.to_thread(self.mpv.stop))
+        
+        await asyncio.to_thread(self._set_stream_active, True)
+        try:
+            return await self._wait_cancellable(
+                asyncio.to_thread(self.mpv.wait_for_end, entry_id, None),
+                cancel,
+                action_keys,
+                non_terminating_keys,
+                state,
+                lambda: self.mpv.time_pos(entry_id)
+            )
+        finally:
+            self._set_stream_active(False)
+    
+    def _play_local(self, path: str, gain_db: float, start: float = 0.0) -> Optional[PlaybackHandle]:
+        """Play a file through the pipeline, or pick it up if it was queued, and queue the pending file.
+        
+        Returns:
+            The playback handle, or None if the pipeline cannot play the file.
+        """
+        handle = self.pipeline.attach(path)
+        if handle is not None:
+            LOGGER.debug("Continuing queued file: %s", path)
+        else:
+            handle = self.pipeline.play(path, gain_db, start)
+            if handle is None:
+                return None
+        with self._queue_lock:
+            pending, self._pending_local = self._pending_local, None
+        if pending and pending[0] != path:
+            self.pipeline.queue(*pending)
+        return handle
+    
+    def _set_stream_active(self, active: bool) -> None:
+        """Mark whether a stream is playing, appending a pending stream behind it."""
+        with self._queue_lock:
+            self._stream_active = active
+            pending, self._pending_stream = self._pending_stream, None
+            if active and pending:
+                self.mpv.loadfile(pending[0], append=True, record_to=pending[1], start=pending[2])
+    
+    async def _run_cancellable_process(self, cmd: List[str], action_keys: List[str], non_terminating_keys: List[str] = [], state: StateContainer = None) -> str:
         """Run a process, allowing cancellation via special keys.
         
         Args:
@@ -112,48 +389,158 @@ class AudioPlayer:
             non_terminating_keys: Keys that don't stop playback (default: empty list).
         
         Returns:
-            The key pressed to cancel, or empty string if process completed normally.
+            The key pressed to cancel, FAILED_KEY if the process exited with
+            an error, or empty string if process completed normally.
         """
 
         try:
-            import os
-            proc = subprocess.Popen(
-                cmd,
-                stdin=subprocess.PIPE,
-                stdout=subprocess.DEVNULL,
-                stderr=subprocess.DEVNULL,
-                preexec_fn=os.setpgrp if hasattr(os, 'setpgrp') else None
-            )
+            with get_metrics().timer('sleepy_call_seconds', call=f'{Path(cmd[0]).name}:spawn'):
+                proc = await asyncio.create_subprocess_exec(
+                    *cmd,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    start_new_session=True
+                )
         except Exception as e:
             LOGGER.error("Failed to start process %s: %s", ' '.join(cmd), e)
-            return ""
+            return FAILED_KEY
         
         LOGGER.info(
             "Started process: %s. Waiting for keys: %s",
             ' '.join(cmd), action_keys
         )
+        started = time.monotonic()
+        start = state.current_start if state is not None else 0.0
         
-        try:
-            with KeyboardPoller() as kp:
-                while proc.poll() is None:
-                    if kp.kbhit():
-                        key = kp.getch()
-                        if  key in non_terminating_keys:
-                            LOGGER.info("Key '%s' pressed (non-terminating).", key)
-                            if state:
-                                state.do_download = True
-                        elif key in action_keys:
-                            LOGGER.info("Key '%s' pressed, terminating process.", key)
-                            proc.terminate()
-                            try:
-                                proc.wait(timeout=5)
-                            except subprocess.TimeoutExpired:
-                                LOGGER.warning("Process did not terminate, killing.")
-                                proc.kill()
-                            return key
-                    time.sleep(0.1)
-        except Exception as e:
-            LOGGER.error("Error while monitoring process: %s", e)
+        async def stop() -> None:
             proc.terminate()
+            try:
+                await asyncio.wait_for(proc.wait(), timeout=5)
+            except asyncio.TimeoutError:
+                LOGGER.warning("Process did not terminate, killing.")
+                proc.kill()
+        
+        async def terminate() -> None:
+            if proc.returncode is None:
+                await self._faded(stop())
+        
+        async def ended() -> Optional[str]:
+            returncode = await proc.wait()
+            return None if returncode == 0 else f'exit status {returncode}'
+        
+        return await self._wait_cancellable(
+            ended(),
+            terminate,
+            action_keys,
+            non_terminating_keys,
+            state,
+            # A process cannot be asked, it has played for as long as it ran
+            lambda: start + time.monotonic() - started
+        )
+    
+    async def _faded(self, stop: Awaitable) -> None:
+        """Fade out over skip_fade seconds, stop playback and restore the volume."""
+        if self.mute or self.skip_fade <= 0:
+            await stop
+            return
+        await asyncio.to_thread(self.fader.fade, 0, self.skip_fade)
+        await stop
+        await asyncio.to_thread(self._set_system_volume, self.volume)
+    
+    async def _wait_cancellable(self, finished: Awaitable, cancel: Callable[[], Awaitable], action_keys: List[str], non_terminating_keys: List[str] = [], state: StateContainer = None, position: Optional[Callable[[], Optional[float]]] = None) -> str:
+        """Wait for playback to finish, allowing cancellation via special keys.
+        
+        While a track with a position key plays, its position is stored
+        every POSITION_INTERVAL seconds and when it is stopped, and it is
+        forgotten once the track has played to its end.
         
-        return ""
+        Args:
+            finished: Completes once playback has ended, with None or 'eof'
+                if it played to its end and the reason it stopped otherwise.
+            cancel: Stops playback.
+            action_keys: Keys that can cancel playback.
+            non_terminating_keys: Keys that don't stop playback (default: empty list).
+            state: Program state, with the position key of the track.
+            position: Returns the playback position in seconds.
+        
+        Returns:
+            The key pressed to cancel, INTERRUPT_KEY if interrupt() was
+            called, FAILED_KEY if playback ended early, or empty string if
+            playback completed normally.
+        """
+        reader = get_input_reader()
+        finished_task = asyncio.ensure_future(finished)
+        interrupt_task = asyncio.ensure_future(self._interrupt.wait())
+        key_task = None
+        position_key = None
+        if self.positions is not None and position is not None and state is not None:
+            position_key = state.current_position_key
+        tracker_task = asyncio.ensure_future(self._track_position(position_key, position)) if position_key else None
+        
+        async def stop() -> None:
+            if tracker_task is not None:
+                tracker_task.cancel()
+                # Read before stopping, a stopped player has no position
+                await asyncio.to_thread(self._store_position, position_key, position)
+            await cancel()
+        
+        try:
+            while True:
+                key_task = asyncio.ensure_future(reader.get_key_async())
+                done, _ = await asyncio.wait(
+                    {finished_task, key_task, interrupt_task}, return_when=asyncio.FIRST_COMPLETED
+                )
+                if interrupt_task in done:
+                    self._interrupt.clear()
+                    LOGGER.info("Playback interrupted.")
+                    await stop()
+                    return INTERRUPT_KEY
+                key = key_task.result() if key_task in done else None
+                if  key in non_terminating_keys:
+                    LOGGER.info("Key '%s' pressed (non-terminating).", key)
+                    if state:
+                        state.do_download = True
+                elif key in action_keys:
+                    LOGGER.info("Key '%s' pressed, stopping playback.", key)
+                    await stop()
+                    return key
+                if finished_task in done:
+                    reason = finished_task.result()
+                    if reason not in (None, 'eof'):
+                        LOGGER.warning("Playback ended early: %s", reason)
+                        if tracker_task is not None:
+                            tracker_task.cancel()
+                            await asyncio.to_thread(self._store_position, position_key, position)
+                        return FAILED_KEY
+                    if tracker_task is not None:
+                        tracker_task.cancel()
+                        await asyncio.to_thread(self.positions.forget, position_key)
+                    return ""
+        except Exception as e:
+            LOGGER.error("Error while monitoring playback: %s", e)
+            await stop()
+            return FAILED_KEY
+        finally:
+            if key_task is not None and not key_task.done():
+                key_task.cancel()
+            if tracker_task is not None:
+                tracker_task.cancel()
+            interrupt_task.cancel()
+    
+    async def _track_position(self, key: str, position: Callable[[], Optional[float]]) -> None:
+        """Update the stored position of the playing track every POSITION_INTERVAL seconds."""
+        while True:
+            await asyncio.sleep(self.POSITION_INTERVAL)
+            try:
+                await asyncio.to_thread(self._store_position, key, position, False)
+            except Exception as e:
+                LOGGER.warning("Failed to track the playback position: %s", e)
+    
+    def _store_position(self, key: str, position: Callable[[], Optional[float]], flush: bool = True) -> None:
+        """Store the current position of a track, writing it to disk at once if flush is set."""
+        seconds = position()
+        if seconds is not None:
+            self.positions.update(key, seconds)
+        if flush:
+            self.positions.flush()
@@ -0,0 +1,188 @@
+"""Recording of streamed YouTube audio, so downloading a played track needs no second fetch."""
+
+import glob
+import logging
+import re
+import subprocess
+import time
+from pathlib import Path
+from typing import List, Optional
+from urllib.parse import parse_qs, urlsplit
+
+from sleepy.constants import CAPTURE_DIR
+
+LOGGER = logging.getLogger(__name__)
+
+# Container of a googlevideo stream by its mime parameter
+STREAM_CONTAINERS = {
+    'audio/webm': '.webm',
+    'audio/mp4': '.m4a',
+}
+
+# Storage codecs a captured container can be kept as without re-encoding
+STORABLE_AS = {
+    '.webm': ('opus', 'vorbis'),
+}
+
+
+class StreamCapture:
+    """Files mpv records streams into while playing them.
+
+    mpv writes the received audio to ``<title> [<video_id>].part.<ext>``
+    (the stream-record option). A track that played to its end is renamed
+    to ``<title> [<video_id>].<ext>``, the name yt-dlp would give it, and a
+    download of it becomes a move. Tracks that were skipped are deleted,
+    only the most recent complete captures are kept.
+    """
+
+    PART_MARK = '.part'
+    KEEP = 3  # complete captures kept for downloads requested later
+    PART_MAX_AGE = 6 * 60 * 60  # seconds after which an unfinished recording is abandoned
+    DURATION_TOLERANCE = 1.0  # seconds a complete recording may fall short of the track
+
+    def __init__(self, root: str = CAPTURE_DIR):
+        self.root = Path(root)
+        # Storage codec of downloads, None to record nothing
+        self.codec: Optional[str] = None
+
+    def start(self, video_id: str, title: Optional[str], stream_url: Optional[str]) -> Optional[str]:
+        """Get the file to record a stream into.
+
+        Args:
+            video_id: YouTube video ID.
+            title: Video title, used for the file name.
+            stream_url: Direct stream URL resolved by yt-dlp.
+
+        Returns:
+            Absolute path of the recording, or None if the stream could not
+            be stored as a download, e.g. a watch URL or a mirrored file.
+        """
+        if not self.codec or not stream_url or not stream_url.startswith(('http://', 'https://')):
+            return None
+        mime = parse_qs(urlsplit(stream_url).query).get('mime', [''])[0]
+        container = STREAM_CONTAINERS.get(mime)
+        if self.codec not in STORABLE_AS.get(container, ()):
+            return None
+        try:
+            self.root.mkdir(parents=True, exist_ok=True)
+        except OSError as e:
+            LOGGER.warning("Cannot create capture directory %s: %s", self.root, e)
+            return None
+        return str((self.root / f'{_file_stem(title, video_id)}{self.PART_MARK}{container}').resolve())
+
+    def finish(self, path: str, duration: Optional[float] = None) -> None:
+        """Keep the recording of a track that played to its end.
+
+        The recording is discarded if it is shorter than the track, e.g.
+        because the connection dropped and mpv took that for the end.
+
+        Args:
+            path: The recording, as returned by start().
+            duration: Duration of the track in seconds, if known.
+        """
+        if duration:
+            recorded = _probe_duration(path)
+            if recorded is not None and recorded < duration - self.DURATION_TOLERANCE:
+                LOGGER.warning(
+                    "Capture %s covers %.0f of %.0f s, discarding it", Path(path).name, recorded, duration
+                )
+                self.discard(path)
+                return
+        part = Path(path)
+        try:
+            part.rename(part.with_name(part.name[:-len(self.PART_MARK + part.suffix)] + part.suffix))
+            LOGGER.debug("Captured %s", part.name)
+        except FileNotFoundError:
+            return
+        except OSError as e:
+            LOGGER.warning("Failed to keep capture %s: %s", part, e)
+        self._prune()
+
+    def discard(self, path: str) -> None:
+        """Delete a recording of a track that did not play to its end."""
+        try:
+            Path(path).unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            LOGGER.warning("Failed to delete capture %s: %s", path, e)
+
+    def take(self, video_id: str, codec: str) -> Optional[Path]:
+        """Find the complete capture of a video that can be stored in a codec.
+
+        Returns:
+            The capture file, or None if there is none.
+        """
+        for path in self.root.glob(f'*[[]{glob.escape(video_id)}[]].*'):
+            if self.PART_MARK not in path.suffixes and codec in STORABLE_AS.get(path.suffix, ()):
+                return path
+        return None
+
+    def evict(self) -> int:
+        """Delete every complete capture and abandoned recording to free disk space.
+
+        Returns:
+            The number of bytes freed.
+        """
+        freed = 0
+        for path in self._stale(keep=0):
+            try:
+                size = path.stat().st_size
+            except OSError:
+                continue
+            self.discard(str(path))
+            if not path.exists():
+                freed += size
+        return freed
+
+    def _prune(self) -> None:
+        """Drop old complete captures and abandoned recordings."""
+        for path in self._stale(self.KEEP):
+            self.discard(str(path))
+
+    def _stale(self, keep: int) -> List[Path]:
+        """Get the complete captures beyond the newest keep ones and the abandoned recordings."""
+        try:
+            files = sorted(((path.stat().st_mtime, path) for path in self.root.iterdir()), reverse=True)
+        except OSError:
+            return []
+        complete = [path for _, path in files if self.PART_MARK not in path.suffixes]
+        abandoned = [
+            path for mtime, path in files
+            if self.PART_MARK in path.suffixes and time.time() - mtime > self.PART_MAX_AGE
+        ]
+        return complete[keep:] + abandoned
+
+
+def stream_duration(stream_url: Optional[str]) -> Optional[float]:
+    """Get the duration of a googlevideo stream from its dur parameter, or None if it has none."""
+    if not stream_url:
+        return None
+    try:
+        return float(parse_qs(urlsplit(stream_url).query)['dur'][0])
+    except (KeyError, ValueError):
+        return None
+
+
+def _probe_duration(path: str) -> Optional[float]:
+    """Get the duration of a recording with ffprobe, or None if it cannot be measured."""
+    try:
+        result = subprocess.run(
+            ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            check=False,
+            timeout=30
+        )
+        return float(result.stdout.decode().strip())
+    except FileNotFoundError:
+        LOGGER.debug("ffprobe not found, keeping %s unchecked", path)
+    except Exception as e:
+        LOGGER.debug("Failed to probe %s: %s", path, e)
+    return None
+
+
+def _file_stem(title: Optional[str], video_id: str) -> str:
+    """File name of a video without extension, as yt-dlp names it."""
+    title = re.sub(r'[\\/:*?"<>|\x00-\x1f]', '_', title or '').strip(' .')
+    return f'{title} [{video_id}]' if title else f'[{video_id}]'
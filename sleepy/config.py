@@ -2,11 +2,21 @@
 
 import logging
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional
 
 import yaml
 
-from sleepy.models import PlaylistConfig
+from sleepy.constants import (
+    AUDIO_VOLUME_LEVEL,
+    EVICTION_POLICIES,
+    SHUFFLE_WEIGHTINGS,
+    METRICS_FILE,
+    METRICS_PORT,
+    SKIP_FADE_SECONDS,
+    SLEEP_FADE_SECONDS,
+    STORAGE_CODECS,
+)
+from sleepy.models import PlaylistConfig, StorageQuota
 
 LOGGER = logging.getLogger(__name__)
 
@@ -19,6 +29,27 @@ class ConfigManager:
     def __init__(self):
         self.playlists: Dict[str, PlaylistConfig] = {}
         self.log_level = 'INFO'
+        self.download_workers = 1
+        self.download_max_attempts = 5
+        self.download_retry_backoff = 60.0
+        self.download_capture = True
+        self.youtube_quota_per_day = 10000
+        self.youtube_quota_reserve = 500
+        self.mirror_tracks_per_playlist = 0
+        self.mirror_max_bytes = 2048 * 1024 * 1024
+        self.mirror_codec = 'opus'
+        self.mirror_bitrate: Optional[str] = '96k'
+        self.storage_quotas: List[StorageQuota] = []
+        self.storage_min_free_bytes = 500 * 1024 * 1024
+        self.storage_log_max_age = 14 * 24 * 60 * 60
+        self.loudness_target: Optional[float] = None  # off unless the Loudness section sets a target
+        self.loudness_max_boost = 10.0
+        self.volume_level = AUDIO_VOLUME_LEVEL
+        self.skip_fade = SKIP_FADE_SECONDS
+        self.sleep_fade = SLEEP_FADE_SECONDS
+        self.metrics_port = METRICS_PORT
+        self.metrics_file: Optional[str] = METRICS_FILE
+        self.metrics_interval = 60.0
     
     def load(self) -> bool:
         """Load configuration from YAML file.
@@ -40,6 +71,64 @@ class ConfigManager:
             LOGGER.setLevel(log_level)
             LOGGER.info("Log level set to %s", self.log_level)
             
+            # Load download queue settings
+            downloads = config.get('Downloads') or {}
+            self.download_workers = int(downloads.get('workers', 1))
+            self.download_max_attempts = int(downloads.get('max_attempts', 5))
+            self.download_retry_backoff = float(downloads.get('retry_backoff', 60))
+            self.download_capture = bool(downloads.get('capture_streams', True))
+            
+            # Load YouTube API settings
+            youtube = config.get('YouTube') or {}
+            self.youtube_quota_per_day = int(youtube.get('quota_per_day', 10000))
+            self.youtube_quota_reserve = int(youtube.get('quota_reserve', 500))
+            
+            # Load offline mirror settings
+            mirror = config.get('Mirror') or {}
+            self.mirror_tracks_per_playlist = int(mirror.get('tracks_per_playlist', 0))
+            self.mirror_max_bytes = int(float(mirror.get('max_size_mb', 2048)) * 1024 * 1024)
+            self.mirror_codec = str(mirror.get('codec', 'opus')).lower()
+            self.mirror_bitrate = mirror.get('bitrate', '96k')
+            if self.mirror_codec not in STORAGE_CODECS:
+                LOGGER.warning("Unknown mirror codec '%s', using opus", self.mirror_codec)
+                self.mirror_codec = 'opus'
+            
+            # Load storage limits
+            storage = config.get('Storage') or {}
+            self.storage_min_free_bytes = int(float(storage.get('min_free_mb', 500)) * 1024 * 1024)
+            self.storage_log_max_age = float(storage.get('log_max_age_days', 14)) * 24 * 60 * 60
+            self.storage_quotas = []
+            for folder, limits in (storage.get('folders') or {}).items():
+                limits = limits or {}
+                quota = StorageQuota(
+                    folder=folder,
+                    max_bytes=int(float(limits['max_size_mb']) * 1024 * 1024) if 'max_size_mb' in limits else None,
+                    max_files=int(limits['max_files']) if 'max_files' in limits else None,
+                    policy=str(limits.get('policy', 'lru')).lower(),
+                )
+                if quota.policy not in EVICTION_POLICIES:
+                    LOGGER.warning("Folder '%s' has unknown eviction policy '%s', using lru", folder, quota.policy)
+                    quota.policy = 'lru'
+                self.storage_quotas.append(quota)
+            
+            # Load loudness normalization settings
+            loudness = config.get('Loudness') or {}
+            target = loudness.get('target_lufs')
+            self.loudness_target = float(target) if target is not None else None
+            self.loudness_max_boost = float(loudness.get('max_boost_db', 10))
+            
+            # Load volume and fade settings
+            volume = config.get('Volume') or {}
+            self.volume_level = max(0, min(100, int(volume.get('level', AUDIO_VOLUME_LEVEL))))
+            self.skip_fade = float(volume.get('skip_fade_seconds', SKIP_FADE_SECONDS))
+            self.sleep_fade = float(volume.get('sleep_fade_seconds', SLEEP_FADE_SECONDS))
+            
+            # Load metrics export settings
+            metrics = config.get('Metrics') or {}
+            self.metrics_port = int(metrics.get('port') or 0) if 'port' in metrics else METRICS_PORT
+            self.metrics_file = metrics.get('textfile', METRICS_FILE) or None
+            self.metrics_interval = float(metrics.get('interval_seconds', 60))
+            
             # Load playlists
             self.playlists = {}
             playlist_data = config.get('Playlists', {})
@@ -55,10 +144,28 @@ class ConfigManager:
                         randomize=data.get('randomize', False),
                         delete_on_skip=data.get('delete_on_skip', False),
                         move_to_asmr_on_dot=data.get('move_to_asmr_on_dot', False),
+                        storage_codec=str(data.get('storage_codec', 'wav')).lower(),
+                        storage_bitrate=data.get('storage_bitrate'),
+                        shuffle_weighting=data.get('shuffle_weighting'),
+                        sleep_timer=float(data['sleep_timer']) if data.get('sleep_timer') else None,
+                        crossfade=max(0.0, float(data.get('crossfade_seconds') or 0)),
+                        resume=data.get('resume', False),
                     )
                     if not playlist.id:
                         LOGGER.warning("Playlist '%s' has no ID, skipping", key)
                         continue
+                    if playlist.storage_codec not in STORAGE_CODECS:
+                        LOGGER.warning(
+                            "Playlist '%s' has unknown storage codec '%s', using wav",
+                            key, playlist.storage_codec
+                        )
+                        playlist.storage_codec = 'wav'
+                    if playlist.shuffle_weighting not in (None, *SHUFFLE_WEIGHTINGS):
+                        LOGGER.warning(
+                            "Playlist '%s' has unknown shuffle weighting '%s', using uniform",
+                            key, playlist.shuffle_weighting
+                        )
+                        playlist.shuffle_weighting = None
                     self.playlists[key] = playlist
                 except Exception as e:
                     LOGGER.error("Failed to load playlist '%s': %s", key, e)
@@ -72,3 +179,18 @@ class ConfigManager:
         except Exception as e:
             LOGGER.error("Failed to load configuration: %s", e)
             return False
+    
+    def playlist_for_folder(self, folder: str) -> Optional[PlaylistConfig]:
+        """Get the local playlist that plays a folder.
+        
+        Args:
+            folder: Path of the folder, e.g. './local/asmr'.
+            
+        Returns:
+            The first local playlist pointing at the folder, or None.
+        """
+        target = Path(folder).resolve()
+        for playlist in self.playlists.values():
+            if playlist.is_local() and Path(playlist.id).resolve() == target:
+                return playlist
+        return None
@@ -34,9 +34,55 @@ SPECIAL_ACTIONS = {
 
 SPECIAL_KEYS = list(SPECIAL_ACTIONS.keys())
 NON_TERMINATING_KEYS = [',', '.']  # Keys that don't stop playback
+INTERRUPT_KEY = 'interrupt'  # Returned by playback stopped through AudioPlayer.interrupt()
+FAILED_KEY = 'failed'  # Returned by playback that ended with an error instead of playing to its end
 YOUTUBE_SCOPE = ['https://www.googleapis.com/auth/youtube.force-ssl']
 
+# Quota units per YouTube Data API call
+YOUTUBE_QUOTA_COSTS = {
+    'playlists.list': 1,
+    'playlistItems.list': 1,
+    'videos.list': 1,
+    'playlistItems.delete': 50,
+}
+
 # Audio settings
 AUDIO_VOLUME_LEVEL = 80
+SKIP_FADE_SECONDS = 0.5
+SLEEP_FADE_SECONDS = 60
+METRICS_PORT = 9137
 AUDIO_SOUND_DIR = './sounds'
-LOCAL_ASMR_DIR = './local/asmr'
\ No newline at end of file
+LOCAL_ASMR_DIR = './local/asmr'
+MIRROR_DIR = './local/mirror'
+
+# Storage codecs for local files and the file extension they are stored with
+STORAGE_CODECS = {
+    'wav': '.wav',
+    'flac': '.flac',
+    'opus': '.opus',
+    'vorbis': '.ogg',
+    'mp3': '.mp3',
+}
+
+# Optional weightings of the shuffle order of randomized playlists
+SHUFFLE_WEIGHTINGS = ('plays', 'recency')
+
+# Policies for choosing the files to delete when a folder is over its quota
+EVICTION_POLICIES = ('lru', 'oldest')
+
+# File extensions LocalPlayer picks up from a folder
+AUDIO_EXTENSIONS = frozenset(STORAGE_CODECS.values()) | {'.m4a', '.webm'}
+
+# Persistent caches
+CACHE_DIR = './cache'
+PLAYLIST_CACHE_FILE = f'{CACHE_DIR}/playlists.db'
+DOWNLOAD_QUEUE_FILE = f'{CACHE_DIR}/downloads.db'
+LIBRARY_FILE = f'{CACHE_DIR}/library.db'
+SHUFFLE_FILE = f'{CACHE_DIR}/shuffle.db'
+YOUTUBE_DISCOVERY_FILE = f'{CACHE_DIR}/youtube-v3-discovery.json'
+QUOTA_FILE = f'{CACHE_DIR}/quota.db'
+DELETE_QUEUE_FILE = f'{CACHE_DIR}/deletes.db'
+MIRROR_FILE = f'{CACHE_DIR}/mirror.db'
+METRICS_FILE = f'{CACHE_DIR}/metrics.prom'
+CAPTURE_DIR = f'{CACHE_DIR}/capture'
+POSITIONS_FILE = f'{CACHE_DIR}/positions.db'
@@ -0,0 +1,190 @@
+"""OAuth credential storage and proactive token refresh."""
+
+import json
+import logging
+import os
+import pickle
+import threading
+import time
+from datetime import timezone
+from pathlib import Path
+from typing import List, Optional
+
+from sleepy.constants import YOUTUBE_SCOPE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class CredentialManager:
+    """Keeps the OAuth credentials valid and shares one HTTP session.
+
+    Credentials are stored as JSON (a ``token.pickle`` from older versions
+    is converted once). A background thread refreshes the access token
+    shortly before it expires, so API calls never wait for a refresh.
+    All API calls go through one authorized httplib2 session, which keeps
+    its connection to the API host alive between requests.
+
+    The Google libraries are imported on first use, see YouTubeAuthenticator.
+    """
+
+    CREDENTIALS_FILE = 'cred.json'
+    TOKEN_FILE = 'token.json'
+    LEGACY_TOKEN_FILE = 'token.pickle'
+    REFRESH_MARGIN = 5 * 60  # seconds before expiry to refresh the token
+    RETRY_INTERVAL = 60      # seconds between attempts after a failed refresh
+    HTTP_TIMEOUT = 30        # seconds per API request
+
+    def __init__(self, scopes: List[str] = YOUTUBE_SCOPE):
+        self.scopes = scopes
+        self.creds = None
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._refresher: Optional[threading.Thread] = None
+        self._session = None
+        self._http = None
+
+    def load(self) -> Optional[object]:
+        """Load the stored credentials, converting a legacy pickle token once.
+
+        Returns:
+            The credentials, or None if none are stored.
+        """
+        from google.oauth2.credentials import Credentials
+
+        if not Path(self.TOKEN_FILE).exists() and Path(self.LEGACY_TOKEN_FILE).exists():
+            self._migrate_pickle()
+        if not Path(self.TOKEN_FILE).exists():
+            return None
+
+        try:
+            with open(self.TOKEN_FILE) as f:
+                creds = Credentials.from_authorized_user_info(json.load(f), self.scopes)
+            LOGGER.info("Loaded credentials from %s (expiry: %s)", self.TOKEN_FILE, creds.expiry)
+            self.creds = creds
+            return creds
+        except Exception as e:
+            LOGGER.error("Failed to load credentials: %s", e)
+            return None
+
+    def save(self, creds) -> bool:
+        """Write credentials to the token file, readable by the owner only.
+
+        Returns:
+            True if the credentials were written, False otherwise.
+        """
+        temp = f'{self.TOKEN_FILE}.tmp'
+        try:
+            fd = os.open(temp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                f.write(creds.to_json())
+            os.replace(temp, self.TOKEN_FILE)
+            LOGGER.debug("Credentials saved to %s", self.TOKEN_FILE)
+            return True
+        except Exception as e:
+            LOGGER.error("Failed to save credentials: %s", e)
+            return False
+
+    def refresh(self) -> bool:
+        """Refresh the access token with the refresh token.
+
+        Returns:
+            True if the credentials are valid afterwards, False otherwise.
+        """
+        from google.auth.transport.requests import Request
+        import requests
+
+        with self._lock:
+            creds = self.creds
+            if creds is None or not creds.refresh_token:
+                return False
+            if self._session is None:
+                self._session = requests.Session()
+            try:
+                creds.refresh(Request(session=self._session))
+            except Exception as e:
+                LOGGER.error("Failed to refresh credentials: %s", e)
+                return False
+        LOGGER.info("Credentials refreshed, new expiry: %s", creds.expiry)
+        self.save(creds)
+        return True
+
+    def acquire(self) -> Optional[object]:
+        """Run the interactive OAuth flow for new credentials.
+
+        Returns:
+            The new credentials, or None if the flow failed.
+        """
+        from google_auth_oauthlib.flow import InstalledAppFlow
+
+        try:
+            flow = InstalledAppFlow.from_client_secrets_file(self.CREDENTIALS_FILE, self.scopes)
+            creds = flow.run_console()
+            if not creds:
+                LOGGER.warning("No credentials obtained from authentication flow")
+                return None
+        except (KeyboardInterrupt, EOFError):
+            LOGGER.warning("Authentication cancelled by user")
+            return None
+        except Exception as e:
+            LOGGER.error("Authentication failed: %s", e)
+            return None
+
+        LOGGER.info("New credentials acquired")
+        self.creds = creds
+        self.save(creds)
+        return creds
+
+    def authorized_http(self):
+        """Get the shared authorized HTTP session for API calls."""
+        import google_auth_httplib2
+        import httplib2
+
+        if self._http is None:
+            self._http = google_auth_httplib2.AuthorizedHttp(
+                self.creds, http=httplib2.Http(timeout=self.HTTP_TIMEOUT)
+            )
+        return self._http
+
+    def start(self) -> None:
+        """Start refreshing the token in the background before it expires."""
+        if self._refresher is not None and self._refresher.is_alive():
+            return
+        self._stopping.clear()
+        self._refresher = threading.Thread(target=self._refresh_loop, name='token-refresh', daemon=True)
+        self._refresher.start()
+
+    def close(self) -> None:
+        """Stop the background refresh."""
+        self._stopping.set()
+        if self._refresher is not None:
+            self._refresher.join(timeout=2)
+            self._refresher = None
+
+    def _refresh_loop(self) -> None:
+        """Sleep until shortly before the token expires, then refresh it."""
+        while not self._stopping.is_set():
+            expiry = getattr(self.creds, 'expiry', None)
+            if expiry is None:
+                # Without an expiry the token is refreshed when a call fails
+                return
+            # google-auth keeps the expiry as a naive UTC datetime
+            delay = expiry.replace(tzinfo=timezone.utc).timestamp() - time.time() - self.REFRESH_MARGIN
+            if delay > 0:
+                LOGGER.debug("Next token refresh in %.0f s", delay)
+                if self._stopping.wait(delay):
+                    return
+                continue
+            if not self.refresh() and self._stopping.wait(self.RETRY_INTERVAL):
+                return
+
+    def _migrate_pickle(self) -> None:
+        """Convert the legacy pickled token to JSON and remove the pickle."""
+        try:
+            with open(self.LEGACY_TOKEN_FILE, 'rb') as f:
+                creds = pickle.load(f)
+            if not self.save(creds):
+                return
+            os.remove(self.LEGACY_TOKEN_FILE)
+            LOGGER.info("Converted %s to %s", self.LEGACY_TOKEN_FILE, self.TOKEN_FILE)
+        except Exception as e:
+            LOGGER.error("Failed to convert %s: %s", self.LEGACY_TOKEN_FILE, e)
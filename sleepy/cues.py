@@ -0,0 +1,205 @@
+"""Preloaded, in-process playback of UI sound cues."""
+
+import logging
+import queue
+import threading
+import time
+import wave
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Optional
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+LOGGER = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Sound:
+    """A decoded PCM sound held in memory."""
+    name: str
+    channels: int
+    sample_width: int
+    rate: int
+    frames: bytes
+
+    @property
+    def frame_size(self) -> int:
+        return self.channels * self.sample_width
+
+    @property
+    def duration(self) -> float:
+        return len(self.frames) / self.frame_size / self.rate
+
+
+class CueHandle:
+    """Handle to a cue that was handed to the output thread."""
+
+    def __init__(self, sound: Sound):
+        self.sound = sound
+        self.cancelled = False
+        self.written = threading.Event()
+        self.ends_at = float('inf')
+
+    def finished(self) -> bool:
+        """Check whether the cue has been fully played or cancelled."""
+        return self.written.is_set() and (self.cancelled or time.monotonic() >= self.ends_at)
+
+    def wait(self) -> None:
+        """Block until the cue has been played."""
+        self.written.wait()
+        if not self.cancelled:
+            time.sleep(max(0.0, self.ends_at - time.monotonic()))
+
+    def cancel(self) -> None:
+        """Stop the cue at the next period boundary."""
+        self.cancelled = True
+
+
+class CuePlayer:
+    """Plays preloaded sounds through one persistent ALSA output stream.
+
+    All WAV files of the sound directory are decoded once into memory. A
+    single output thread keeps the PCM device open and writes the cue
+    buffers to it, so playing a cue costs no fork, exec or device open.
+    A new cue preempts the one that is currently playing.
+    """
+
+    DEVICE = 'default'
+    PERIOD_FRAMES = 512
+
+    _FORMATS = {
+        1: 'PCM_FORMAT_U8',
+        2: 'PCM_FORMAT_S16_LE',
+        3: 'PCM_FORMAT_S24_3LE',
+        4: 'PCM_FORMAT_S32_LE',
+    }
+
+    def __init__(self, sound_dir: str, device: str = DEVICE):
+        self.device = device
+        self.sounds: Dict[str, Sound] = {}
+        self._queue: "queue.Queue[Optional[CueHandle]]" = queue.Queue()
+        self._current: Optional[CueHandle] = None
+        self._thread: Optional[threading.Thread] = None
+        self._pcm = None
+        self._pcm_params = None
+
+        if alsaaudio is None:
+            LOGGER.info("alsaaudio not installed, sound cues fall back to aplay")
+            return
+        self._load(Path(sound_dir))
+
+    @property
+    def available(self) -> bool:
+        """Check whether in-process playback can be used."""
+        return alsaaudio is not None and bool(self.sounds)
+
+    def has_sound(self, name: str) -> bool:
+        """Check whether a sound is preloaded."""
+        return name in self.sounds
+
+    def play(self, name: str) -> Optional[CueHandle]:
+        """Queue a preloaded sound, preempting the current cue.
+
+        Args:
+            name: File name of the sound, e.g. 'ok.wav'.
+
+        Returns:
+            A handle to wait on or cancel, or None if the sound is unknown.
+        """
+        sound = self.sounds.get(name)
+        if sound is None:
+            return None
+
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._output_loop, name='cues', daemon=True)
+            self._thread.start()
+
+        if self._current is not None:
+            self._current.cancel()
+        handle = CueHandle(sound)
+        self._current = handle
+        self._queue.put(handle)
+        return handle
+
+    def close(self) -> None:
+        """Stop the output thread and close the device."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout=2)
+        self._thread = None
+
+    def _load(self, sound_dir: Path) -> None:
+        """Decode all WAV files of a directory into memory."""
+        for path in sorted(sound_dir.glob('*.wav')):
+            try:
+                with wave.open(str(path), 'rb') as w:
+                    self.sounds[path.name] = Sound(
+                        name=path.name,
+                        channels=w.getnchannels(),
+                        sample_width=w.getsampwidth(),
+                        rate=w.getframerate(),
+                        frames=w.readframes(w.getnframes()),
+                    )
+            except Exception as e:
+                LOGGER.warning("Failed to preload sound %s: %s", path, e)
+        LOGGER.info("Preloaded %d sounds from %s", len(self.sounds), sound_dir)
+
+    def _open(self, sound: Sound):
+        """Open the PCM device, or reopen it if the sound needs another format."""
+        params = (sound.channels, sound.sample_width, sound.rate)
+        if self._pcm is not None and self._pcm_params == params:
+            return self._pcm
+
+        if self._pcm is not None:
+            self._pcm.close()
+        self._pcm = alsaaudio.PCM(
+            type=alsaaudio.PCM_PLAYBACK,
+            mode=alsaaudio.PCM_NORMAL,
+            device=self.device,
+            channels=sound.channels,
+            rate=sound.rate,
+            format=getattr(alsaaudio, self._FORMATS[sound.sample_width]),
+            periodsize=self.PERIOD_FRAMES,
+        )
+        self._pcm_params = params
+        LOGGER.debug("Opened ALSA device %s for %s", self.device, params)
+        return self._pcm
+
+    def _output_loop(self) -> None:
+        """Write queued cues to the output device."""
+        while True:
+            handle = self._queue.get()
+            if handle is None:
+                break
+
+            try:
+                if not handle.cancelled:
+                    self._write(handle)
+            except Exception as e:
+                LOGGER.error("Failed to play sound %s: %s", handle.sound.name, e)
+                handle.cancel()
+                if self._pcm is not None:
+                    self._pcm.close()
+                    self._pcm = None
+            finally:
+                handle.written.set()
+
+        if self._pcm is not None:
+            self._pcm.close()
+            self._pcm = None
+
+    def _write(self, handle: CueHandle) -> None:
+        """Write one cue to the device period by period."""
+        sound = handle.sound
+        pcm = self._open(sound)
+        handle.ends_at = time.monotonic() + sound.duration
+        data = memoryview(sound.frames)
+        step = self.PERIOD_FRAMES * sound.frame_size
+        for offset in range(0, len(data), step):
+            if handle.cancelled:
+                return
+            pcm.write(data[offset:offset + step])
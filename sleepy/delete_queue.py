@@ -0,0 +1,185 @@
+"""Persistent background queue for YouTube playlist item deletes."""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Set
+
+from sleepy.constants import DELETE_QUEUE_FILE
+from sleepy.quota import QuotaExhaustedError
+
+LOGGER = logging.getLogger(__name__)
+
+
+class DeleteQueue:
+    """Playlist item deletes stored on disk and sent in batches.
+
+    Playback does not wait for a delete any more: the item ID is stored
+    and a worker thread sends the pending deletes as one batch request.
+    Deletes that fail are retried with backoff, and deletes the quota
+    cannot cover wait for the quota reset. Pending deletes survive a
+    shutdown and are sent after the next start.
+    """
+
+    BATCH_SIZE = 50        # most calls the API accepts in one batch
+    RETRY_BACKOFF = 60.0   # seconds before the first retry, doubled per attempt
+    MAX_BACKOFF = 60 * 60
+
+    def __init__(self, youtube_auth, db_path: str = DELETE_QUEUE_FILE):
+        self.youtube_auth = youtube_auth
+        self._worker: Optional[threading.Thread] = None
+        self._stopping = False
+        self._sending = False
+        self._cond = threading.Condition()
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS deletes (
+                    item_id TEXT PRIMARY KEY,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def start(self) -> None:
+        """Start the worker thread."""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stopping = False
+        pending = self.pending_count()
+        if pending:
+            LOGGER.info("Resuming %d queued playlist item deletes", pending)
+        self._worker = threading.Thread(target=self._work, name='youtube-deletes', daemon=True)
+        self._worker.start()
+
+    def stop(self) -> None:
+        """Let the worker exit once the current batch is sent."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._worker = None
+
+    def enqueue(self, item_id: str) -> None:
+        """Queue the delete of a playlist item, once per item."""
+        with self._cond, self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO deletes (item_id, created_at) VALUES (?, ?)", (item_id, time.time())
+            )
+            self._cond.notify_all()
+        LOGGER.debug("Queued delete of playlist item %s", item_id)
+
+    def pending_count(self) -> int:
+        """Get the number of deletes that were not sent yet."""
+        with self._cond:
+            row = self._conn.execute("SELECT COUNT(*) FROM deletes").fetchone()
+        return row[0]
+
+    def pending_ids(self) -> Set[str]:
+        """Get the IDs of the items whose delete was not sent yet."""
+        with self._cond:
+            return {row[0] for row in self._conn.execute("SELECT item_id FROM deletes")}
+
+    def flush(self, timeout: float) -> bool:
+        """Wait until all due deletes are sent.
+
+        Args:
+            timeout: Seconds to wait at most.
+
+        Returns:
+            True if nothing due is left, False on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._sending or self._due(time.time()):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._worker is None:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def _due(self, now: float) -> List[str]:
+        """Get the IDs of the deletes that are due. The caller holds the lock."""
+        return [
+            row[0] for row in self._conn.execute(
+                "SELECT item_id FROM deletes WHERE next_attempt_at <= ? ORDER BY created_at LIMIT ?",
+                (now, self.BATCH_SIZE)
+            )
+        ]
+
+    def _work(self) -> None:
+        """Worker loop: send due deletes in batches."""
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    now = time.time()
+                    item_ids = self._due(now)
+                    if item_ids:
+                        self._sending = True
+                        break
+                    row = self._conn.execute("SELECT MIN(next_attempt_at) FROM deletes").fetchone()
+                    self._cond.wait(row[0] - now if row[0] is not None else None)
+
+            try:
+                self._finish(item_ids, self._send(item_ids))
+            finally:
+                with self._cond:
+                    self._sending = False
+                    self._cond.notify_all()
+
+    def _send(self, item_ids: List[str]) -> Optional[dict]:
+        """Send one batch of deletes.
+
+        Returns:
+            Maps item IDs to True if deleted, False if failed. Empty if the
+            batch could not be sent, None if it waits for the quota reset.
+        """
+        if self.youtube_auth.ensure_client() is None:
+            return {}
+        try:
+            return self.youtube_auth.remove_playlist_items(item_ids)
+        except QuotaExhaustedError as e:
+            delay = self.youtube_auth.quota.seconds_until_reset()
+            LOGGER.warning("%s, retrying %d deletes in %.0f s", e, len(item_ids), delay)
+            with self._cond, self._conn:
+                self._conn.executemany(
+                    "UPDATE deletes SET next_attempt_at = ? WHERE item_id = ?",
+                    [(time.time() + delay, item_id) for item_id in item_ids]
+                )
+            return None
+        except Exception as e:
+            LOGGER.error("Failed to send playlist item deletes: %s", e)
+            return {}
+
+    def _finish(self, item_ids: List[str], results: Optional[dict]) -> None:
+        """Drop sent deletes and schedule retries for the failed ones."""
+        if results is None:
+            return
+        done = [item_id for item_id in item_ids if results.get(item_id)]
+        failed = [item_id for item_id in item_ids if not results.get(item_id)]
+        with self._cond, self._conn:
+            self._conn.executemany("DELETE FROM deletes WHERE item_id = ?", [(item_id,) for item_id in done])
+            for item_id in failed:
+                row = self._conn.execute(
+                    "SELECT attempts FROM deletes WHERE item_id = ?", (item_id,)
+                ).fetchone()
+                attempts = (row[0] if row else 0) + 1
+                delay = min(self.MAX_BACKOFF, self.RETRY_BACKOFF * 2 ** (attempts - 1))
+                self._conn.execute(
+                    "UPDATE deletes SET attempts = ?, next_attempt_at = ? WHERE item_id = ?",
+                    (attempts, time.time() + delay, item_id)
+                )
+            self._cond.notify_all()
+        if done:
+            LOGGER.info("Deleted %d playlist items", len(done))
+        if failed:
+            LOGGER.warning("Failed to delete %d playlist items, retrying later", len(failed))
@@ -0,0 +1,222 @@
+"""Persistent background queue for video downloads."""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+from sleepy.constants import DOWNLOAD_QUEUE_FILE
+
+LOGGER = logging.getLogger(__name__)
+
+
+def extract_video_id(url: str) -> str:
+    """Get the YouTube video ID of a watch URL, or the URL itself if it has none."""
+    parsed = urlparse(url)
+    video_ids = parse_qs(parsed.query).get('v')
+    if video_ids:
+        return video_ids[0]
+    if parsed.netloc.endswith('youtu.be') and parsed.path.strip('/'):
+        return parsed.path.strip('/')
+    return url
+
+
+class DownloadQueue:
+    """Download jobs stored on disk and worked off by a bounded thread pool.
+
+    Jobs are keyed by video ID, so requesting the same video twice does
+    not download it twice. Failed jobs are retried with exponential
+    backoff. Jobs that were pending or running when the program stopped
+    are picked up again on the next start. A finished job is requested
+    again if its file was removed since, and forgotten after MAX_AGE.
+    """
+
+    STATUS_PENDING = 'pending'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+
+    MAX_AGE = 90 * 24 * 60 * 60  # finished jobs older than this are dropped
+
+    def __init__(self, downloader, audio_player=None, db_path: str = DOWNLOAD_QUEUE_FILE):
+        self.downloader = downloader
+        self.audio_player = audio_player
+        self.max_attempts = 5
+        self.retry_backoff = 60.0
+        self._workers: List[threading.Thread] = []
+        self._stopping = False
+        self._cond = threading.Condition()
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS jobs (
+                    video_id TEXT PRIMARY KEY,
+                    url TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    attempts INTEGER NOT NULL DEFAULT 0,
+                    next_attempt_at REAL NOT NULL DEFAULT 0,
+                    created_at REAL NOT NULL
+                )
+                """
+            )
+
+    def start(self, workers: int = 1, max_attempts: int = 5, retry_backoff: float = 60.0) -> None:
+        """Resume interrupted jobs and start the worker threads.
+
+        Args:
+            workers: Number of downloads that may run at the same time.
+            max_attempts: Attempts before a job is given up.
+            retry_backoff: Seconds before the first retry, doubled per attempt.
+        """
+        if self._workers:
+            return
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self._stopping = False
+
+        with self._cond, self._conn:
+            resumed = self._conn.execute(
+                "UPDATE jobs SET status = ? WHERE status = ?",
+                (self.STATUS_PENDING, self.STATUS_RUNNING)
+            ).rowcount
+            self._conn.execute(
+                "DELETE FROM jobs WHERE status IN (?, ?) AND created_at < ?",
+                (self.STATUS_DONE, self.STATUS_FAILED, time.time() - self.MAX_AGE)
+            )
+        pending = self.pending_count()
+        if pending:
+            LOGGER.info("Resuming %d queued downloads (%d were interrupted)", pending, resumed)
+
+        for n in range(max(1, workers)):
+            worker = threading.Thread(target=self._work, name=f'download-{n}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def stop(self) -> None:
+        """Let the workers exit once their current job is done."""
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self._workers = []
+
+    def enqueue(self, url: str) -> bool:
+        """Add a download job unless the video is already queued or its download still exists.
+
+        Args:
+            url: The YouTube video URL to download.
+
+        Returns:
+            True if a new job was added, False if it was a duplicate.
+        """
+        video_id = extract_video_id(url)
+        with self._cond, self._conn:
+            row = self._conn.execute(
+                "SELECT status FROM jobs WHERE video_id = ?", (video_id,)
+            ).fetchone()
+            if row and row[0] == self.STATUS_DONE and self.downloader.find_download(url) is None:
+                LOGGER.info("Downloaded file of %s is gone, downloading again", video_id)
+            elif row and row[0] != self.STATUS_FAILED:
+                LOGGER.info("Download of %s already %s, skipping", video_id, row[0])
+                return False
+            self._conn.execute(
+                "INSERT OR REPLACE INTO jobs (video_id, url, status, attempts, next_attempt_at, created_at) "
+                "VALUES (?, ?, ?, 0, 0, ?)",
+                (video_id, url, self.STATUS_PENDING, time.time())
+            )
+            self._cond.notify()
+        LOGGER.info("Queued download of %s", video_id)
+        return True
+
+    def pending_count(self) -> int:
+        """Get the number of jobs that still have to run."""
+        with self._cond:
+            row = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN (?, ?)",
+                (self.STATUS_PENDING, self.STATUS_RUNNING)
+            ).fetchone()
+        return row[0]
+
+    def _claim(self) -> Tuple[Optional[Tuple[str, str, int]], Optional[float]]:
+        """Take the next due job.
+
+        Returns:
+            The (video_id, url, attempts) of the claimed job or None, and the
+            seconds until the next pending job is due if nothing was claimed.
+        """
+        now = time.time()
+        row = self._conn.execute(
+            "SELECT video_id, url, attempts FROM jobs WHERE status = ? AND next_attempt_at <= ? "
+            "ORDER BY created_at LIMIT 1",
+            (self.STATUS_PENDING, now)
+        ).fetchone()
+        if row:
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE jobs SET status = ? WHERE video_id = ?", (self.STATUS_RUNNING, row[0])
+                )
+            return row, None
+
+        row = self._conn.execute(
+            "SELECT MIN(next_attempt_at) FROM jobs WHERE status = ?", (self.STATUS_PENDING,)
+        ).fetchone()
+        return None, (row[0] - now if row[0] is not None else None)
+
+    def _work(self) -> None:
+        """Worker loop: claim jobs and download them."""
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopping:
+                        return
+                    job, wait = self._claim()
+                    if job:
+                        break
+                    self._cond.wait(wait)
+
+            video_id, url, attempts = job
+            attempt = attempts + 1
+            last_attempt = attempt >= self.max_attempts
+            LOGGER.info("Downloading %s (attempt %d/%d)", video_id, attempt, self.max_attempts)
+            try:
+                success = self.downloader.download(url, write_failure_log=last_attempt)
+            except Exception as e:
+                LOGGER.error("Download of %s crashed: %s", video_id, e)
+                success = False
+            self._finish(video_id, attempt, success, last_attempt)
+
+    def _finish(self, video_id: str, attempt: int, success: bool, last_attempt: bool) -> None:
+        """Record the outcome of a download attempt."""
+        if success:
+            status, next_attempt_at = self.STATUS_DONE, 0.0
+        elif last_attempt:
+            status, next_attempt_at = self.STATUS_FAILED, 0.0
+        else:
+            status = self.STATUS_PENDING
+            next_attempt_at = time.time() + self.retry_backoff * 2 ** (attempt - 1)
+
+        with self._cond, self._conn:
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, attempts = ?, next_attempt_at = ? WHERE video_id = ?",
+                (status, attempt, next_attempt_at, video_id)
+            )
+            self._cond.notify_all()
+
+        if success:
+            LOGGER.info("Download of %s completed", video_id)
+            if self.audio_player:
+                self.audio_player.play_sound("ok.wav", wait=False)
+        elif last_attempt:
+            LOGGER.error("Download of %s failed after %d attempts", video_id, attempt)
+            if self.audio_player:
+                self.audio_player.play_sound("error.wav", wait=False)
+        else:
+            LOGGER.warning(
+                "Download of %s failed, retrying in %.0f s",
+                video_id, next_attempt_at - time.time()
+            )
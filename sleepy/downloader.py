@@ -1,26 +1,62 @@
 """YouTube video downloader."""
 
+import glob
 import logging
+import shutil
 import subprocess
 from datetime import datetime
 from pathlib import Path
+from typing import Optional
 
-from sleepy.constants import LOCAL_ASMR_DIR
+from sleepy.capture import StreamCapture
+from sleepy.constants import LOCAL_ASMR_DIR, STORAGE_CODECS
+from sleepy.download_queue import extract_video_id
+from sleepy.metrics import get_metrics
 
 LOGGER = logging.getLogger(__name__)
 
 
 class YouTubeDownloader:
-    """Handles downloading YouTube videos as audio files."""
+    """Handles downloading YouTube videos as audio files.
     
-    def __init__(self, audio_player=None):
+    A video that was streamed to its end is taken from the stream capture
+    instead of being fetched again.
+    """
+    
+    def __init__(self, audio_player=None, capture: Optional[StreamCapture] = None):
         self.audio_player = audio_player
+        self.capture = capture
+        self.codec = 'wav'
+        self.bitrate: Optional[str] = None
+    
+    def set_format(self, codec: str, bitrate: Optional[str] = None) -> None:
+        """Set the format downloads are stored in.
+        
+        Args:
+            codec: One of STORAGE_CODECS, e.g. 'opus' or 'flac'.
+            bitrate: Target bitrate for lossy codecs, e.g. '96k'.
+        """
+        if codec not in STORAGE_CODECS:
+            LOGGER.warning("Unknown storage codec '%s', keeping %s", codec, self.codec)
+            return
+        self.codec = codec
+        self.bitrate = bitrate
+        LOGGER.info("Downloads are stored as %s%s", codec, f" at {bitrate}" if bitrate else "")
     
-    def download(self, url: str) -> bool:
+    def download(
+        self,
+        url: str,
+        write_failure_log: bool = True,
+        output_dir: str = LOCAL_ASMR_DIR,
+        output_name: Optional[str] = None
+    ) -> bool:
         """Download a YouTube video as audio.
         
         Args:
             url: The YouTube video URL to download.
+            write_failure_log: Write a download_failed_*.log file on failure.
+            output_dir: Directory to store the file in.
+            output_name: File name without extension, the video title by default.
             
         Returns:
             True if successful, False otherwise.
@@ -29,42 +65,88 @@ class YouTubeDownloader:
         
         try:
             # Ensure output directory exists
-            Path(LOCAL_ASMR_DIR).mkdir(parents=True, exist_ok=True)
+            Path(output_dir).mkdir(parents=True, exist_ok=True)
+            
+            if self._store_capture(url, output_dir, output_name):
+                return True
             
             cmd = [
                 'yt-dlp',
                 '--extract-audio',
-                '--audio-format', 'wav',
-                '-P', LOCAL_ASMR_DIR,
-                url
+                '--audio-format', self.codec,
             ]
+            if self.bitrate and self.codec not in ('wav', 'flac'):
+                cmd += ['--audio-quality', self.bitrate.upper()]
+            cmd += ['-P', output_dir]
+            if output_name:
+                cmd += ['-o', f'{output_name}.%(ext)s']
+            cmd.append(url)
             
-            result = subprocess.run(
-                cmd,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.PIPE,
-                check=False,
-                timeout=300
-            )
+            with get_metrics().timer('sleepy_call_seconds', call='yt-dlp:download'):
+                result = subprocess.run(
+                    cmd,
+                    stdout=subprocess.PIPE,
+                    stderr=subprocess.PIPE,
+                    check=False,
+                    timeout=300
+                )
             
             if result.returncode == 0:
                 LOGGER.info("Video downloaded successfully")
+                get_metrics().inc('sleepy_downloads_total', source='yt-dlp')
                 return True
             else:
                 error_msg = result.stderr.decode()
                 LOGGER.error("Video download failed: %s", error_msg)
-                self._write_download_failed_log(url, error_msg)
+                if write_failure_log:
+                    self._write_download_failed_log(url, error_msg)
                 return False
         except subprocess.TimeoutExpired:
             error_msg = "Download timed out"
             LOGGER.error("Video download timed out")
-            self._write_download_failed_log(url, error_msg)
+            if write_failure_log:
+                self._write_download_failed_log(url, error_msg)
             return False
         except Exception as e:
             error_msg = str(e)
             LOGGER.error("Failed to download video: %s", error_msg)
-            self._write_download_failed_log(url, error_msg)
+            if write_failure_log:
+                self._write_download_failed_log(url, error_msg)
+            return False
+    
+    @staticmethod
+    def find_download(url: str, output_dir: str = LOCAL_ASMR_DIR) -> Optional[Path]:
+        """Find the file a video was downloaded to under its default name, 'Title [id].ext'.
+        
+        Returns:
+            The downloaded file, or None if there is none (anymore).
+        """
+        for path in Path(output_dir).glob(f'*[[]{glob.escape(extract_video_id(url))}[]].*'):
+            # yt-dlp downloads into '<name>.<ext>.part' first
+            if '.part' not in path.suffixes:
+                return path
+        return None
+    
+    def _store_capture(self, url: str, output_dir: str, output_name: Optional[str]) -> bool:
+        """Move the captured stream of a video into the output directory.
+        
+        Returns:
+            True if the video was stored, False if there is no usable capture.
+        """
+        if self.capture is None:
+            return False
+        captured = self.capture.take(extract_video_id(url), self.codec)
+        if captured is None:
+            return False
+        target = Path(output_dir) / (f'{output_name}{captured.suffix}' if output_name else captured.name)
+        try:
+            shutil.move(str(captured), str(target))
+        except OSError as e:
+            LOGGER.warning("Failed to store capture %s, downloading instead: %s", captured, e)
             return False
+        LOGGER.info("Stored captured stream as %s", target)
+        get_metrics().inc('sleepy_downloads_total', source='capture')
+        return True
     
     @staticmethod
     def _write_download_failed_log(url: str, reason: str) -> None:
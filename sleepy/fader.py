@@ -0,0 +1,134 @@
+"""System volume control with smooth fades."""
+
+import logging
+import subprocess
+import threading
+import time
+from typing import Optional
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+from sleepy.metrics import get_metrics
+
+LOGGER = logging.getLogger(__name__)
+
+
+class VolumeFader:
+    """Sets the ALSA mixer volume and ramps it at a fixed update rate.
+
+    The mixer is driven in-process through ``alsaaudio.Mixer`` if
+    pyalsaaudio is installed, otherwise through one long-running
+    ``amixer --stdin`` process, so a fade step never costs a fork. Only one
+    fade runs at a time: starting a fade or setting the volume supersedes
+    the fade in progress.
+    """
+
+    CONTROL = 'Master'
+    UPDATE_INTERVAL = 0.05  # seconds between volume steps during a fade
+    AMIXER_CMD = 'amixer'
+
+    def __init__(self, control: str = CONTROL):
+        self.control = control
+        self.volume: Optional[int] = None
+        self._lock = threading.Lock()
+        self._mixer = None
+        self._amixer: Optional[subprocess.Popen] = None
+        self._cancel = threading.Event()
+
+    def set(self, volume: int) -> None:
+        """Set the volume at once, stopping any fade.
+
+        Args:
+            volume: Volume in percent of the mixer range.
+        """
+        self._cancel.set()
+        self._apply(volume)
+
+    def fade(self, target: int, duration: float) -> bool:
+        """Ramp the volume to a target, blocking until done.
+
+        Args:
+            target: Volume in percent of the mixer range.
+            duration: Seconds the ramp takes.
+
+        Returns:
+            True if the target was reached, False if the fade was superseded.
+        """
+        self._cancel.set()
+        cancel = threading.Event()
+        self._cancel = cancel
+        start = self.volume if self.volume is not None else target
+        began = time.monotonic()
+        while not cancel.is_set():
+            progress = min(1.0, (time.monotonic() - began) / duration) if duration > 0 else 1.0
+            self._apply(round(start + (target - start) * progress), cancel)
+            if progress >= 1.0:
+                return True
+            cancel.wait(self.UPDATE_INTERVAL)
+        return False
+
+    def close(self) -> None:
+        """Stop any fade and release the mixer."""
+        self._cancel.set()
+        with self._lock:
+            if self._mixer is not None:
+                self._mixer.close()
+                self._mixer = None
+            if self._amixer is not None:
+                try:
+                    self._amixer.stdin.close()
+                    self._amixer.wait(timeout=2)
+                except (OSError, subprocess.TimeoutExpired):
+                    self._amixer.kill()
+                self._amixer = None
+
+    def _apply(self, volume: int, cancel: Optional[threading.Event] = None) -> None:
+        """Write a volume to the mixer, skipping unchanged values and superseded fade steps."""
+        volume = max(0, min(100, volume))
+        with self._lock:
+            if volume == self.volume or cancel is not None and cancel.is_set():
+                return
+            with get_metrics().timer('sleepy_call_seconds', call='mixer'):
+                if self._set_mixer(volume) or self._set_amixer(volume):
+                    self.volume = volume
+
+    def _set_mixer(self, volume: int) -> bool:
+        """Set the volume through pyalsaaudio."""
+        if alsaaudio is None:
+            return False
+        try:
+            if self._mixer is None:
+                self._mixer = alsaaudio.Mixer(self.control)
+            self._mixer.setvolume(volume)
+            return True
+        except alsaaudio.ALSAAudioError as e:
+            LOGGER.warning("Failed to set mixer %s: %s", self.control, e)
+            self._mixer = None
+            return False
+
+    def _set_amixer(self, volume: int) -> bool:
+        """Set the volume through the persistent amixer process."""
+        if self._amixer is None or self._amixer.poll() is not None:
+            try:
+                self._amixer = subprocess.Popen(
+                    [self.AMIXER_CMD, '--stdin', '--quiet'],
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.DEVNULL,
+                    stderr=subprocess.DEVNULL,
+                    text=True
+                )
+            except OSError as e:
+                LOGGER.warning("Failed to start %s: %s", self.AMIXER_CMD, e)
+                self._amixer = None
+                return False
+        try:
+            self._amixer.stdin.write(f"sset {self.control} {volume}%\n")
+            self._amixer.stdin.flush()
+            return True
+        except OSError as e:
+            LOGGER.warning("Failed to set volume through %s: %s", self.AMIXER_CMD, e)
+            self._amixer = None
+            return False
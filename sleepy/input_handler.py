@@ -1,11 +1,21 @@
 """Keyboard input handling."""
 
+import asyncio
 import logging
+import queue
 import select
 import sys
 import termios
+import threading
+import time
 import tty
-from typing import Optional
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Set
+
+try:
+    import evdev
+except ImportError:
+    evdev = None
 
 LOGGER = logging.getLogger(__name__)
 
@@ -45,3 +55,252 @@ class KeyboardPoller:
         if self.fd is None:
             return ""
         return sys.stdin.read(1)
+
+
+@dataclass(frozen=True)
+class KeyPress:
+    """A key press delivered by the InputReader."""
+    key: str
+    long_press: bool = False
+
+
+class InputReader:
+    """Reads key presses on a dedicated thread into a queue.
+
+    Keypad events are read from evdev input devices, which works without a
+    controlling terminal (e.g. under systemd). If evdev is not available or
+    no keyboard device is found, the TTY is read in cbreak mode instead.
+    Both readers block on the device, so nothing wakes up between presses.
+    """
+
+    LONG_PRESS_SECONDS = 1.0
+    RESCAN_INTERVAL = 2.0  # seconds between device scans when none is found
+
+    # evdev key codes mapped to the characters the TTY would deliver
+    KEYCODE_CHARS = {
+        **{f'KEY_KP{n}': str(n) for n in range(10)},
+        **{f'KEY_{n}': str(n) for n in range(10)},
+        'KEY_KPPLUS': '+',
+        'KEY_KPMINUS': '-',
+        'KEY_KPASTERISK': '*',
+        'KEY_KPSLASH': '/',
+        'KEY_KPDOT': '.',
+        'KEY_KPCOMMA': ',',
+        'KEY_KPENTER': '\n',
+        'KEY_MINUS': '-',
+        'KEY_SLASH': '/',
+        'KEY_DOT': '.',
+        'KEY_COMMA': ',',
+        'KEY_ENTER': '\n',
+        'KEY_BACKSPACE': '\x7f',
+    }
+
+    def __init__(self):
+        self._queue: "queue.Queue[Optional[KeyPress]]" = queue.Queue()
+        self._held: Dict[str, float] = {}
+        self._long_pressed: Set[str] = set()
+        self._thread: Optional[threading.Thread] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_queue: Optional[asyncio.Queue] = None
+
+    def bind_loop(self, loop: asyncio.AbstractEventLoop) -> None:
+        """Deliver key presses to an asyncio event loop instead of the thread queue.
+
+        Must be called from within the running loop. Presses that are
+        already queued are carried over.
+        """
+        self._async_queue = asyncio.Queue()
+        while True:
+            try:
+                self._async_queue.put_nowait(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        self._loop = loop
+
+    def start(self) -> None:
+        """Start the reader thread if it is not running yet."""
+        if self._thread is not None and self._thread.is_alive():
+            return
+
+        if evdev is not None:
+            target = self._read_evdev
+        elif sys.stdin.isatty():
+            LOGGER.info("evdev not installed, reading keys from the terminal")
+            target = self._read_tty
+        else:
+            LOGGER.error("No key input available: evdev not installed and stdin is not a terminal")
+            return
+
+        self._thread = threading.Thread(target=target, name='input', daemon=True)
+        self._thread.start()
+
+    def get_press(self, timeout: Optional[float] = None) -> Optional[KeyPress]:
+        """Wait for the next key press.
+
+        Args:
+            timeout: Seconds to wait, or None to wait indefinitely.
+
+        Returns:
+            The key press, or None on timeout or when woken up.
+        """
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def get_key(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Wait for the next key, ignoring long-press notifications.
+
+        Args:
+            timeout: Seconds to wait, or None to wait indefinitely.
+
+        Returns:
+            The pressed key, or None on timeout or when woken up.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            press = self.get_press(remaining)
+            if press is None or not press.long_press:
+                return press.key if press else None
+
+    async def get_key_async(self, timeout: Optional[float] = None) -> Optional[str]:
+        """Await the next key, ignoring long-press notifications.
+
+        Requires bind_loop() to have been called.
+
+        Args:
+            timeout: Seconds to wait, or None to wait indefinitely.
+
+        Returns:
+            The pressed key, or None on timeout or when woken up.
+        """
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            remaining = None if deadline is None else max(0.0, deadline - loop.time())
+            try:
+                press = await asyncio.wait_for(self._async_queue.get(), remaining)
+            except asyncio.TimeoutError:
+                return None
+            if press is None or not press.long_press:
+                return press.key if press else None
+
+    def wake(self) -> None:
+        """Make a waiting get_key() or get_press() return None."""
+        self._put(None)
+
+    def press(self, key: str, long_press: bool = False) -> None:
+        """Deliver a key press as if it was read from a device, e.g. from a script."""
+        self._put(KeyPress(key, long_press))
+
+    def _put(self, press: Optional[KeyPress]) -> None:
+        """Hand a key press to the bound event loop or the thread queue."""
+        loop = self._loop
+        if loop is not None and not loop.is_closed():
+            loop.call_soon_threadsafe(self._async_queue.put_nowait, press)
+        else:
+            self._queue.put(press)
+
+    def clear(self) -> None:
+        """Drop all queued key presses."""
+        while True:
+            try:
+                self._queue.get_nowait()
+            except queue.Empty:
+                break
+        while self._async_queue is not None and not self._async_queue.empty():
+            self._async_queue.get_nowait()
+
+    def is_held(self, key: str) -> bool:
+        """Check whether a key is currently held down (evdev only)."""
+        return key in self._held
+
+    def held_for(self, key: str) -> float:
+        """Seconds a key has been held down, or 0 if it is not held (evdev only)."""
+        pressed_at = self._held.get(key)
+        return time.monotonic() - pressed_at if pressed_at is not None else 0.0
+
+    def _read_tty(self) -> None:
+        """Read characters from the terminal in cbreak mode."""
+        try:
+            with KeyboardPoller() as kp:
+                while True:
+                    key = kp.getch()
+                    if not key:
+                        LOGGER.warning("Terminal input closed")
+                        return
+                    self._put(KeyPress(key))
+        except Exception as e:
+            LOGGER.error("Terminal key reader stopped: %s", e)
+
+    def _read_evdev(self) -> None:
+        """Read key events from all keyboard-like evdev devices."""
+        while True:
+            devices = self._find_devices()
+            if not devices:
+                time.sleep(self.RESCAN_INTERVAL)
+                continue
+
+            try:
+                while True:
+                    readable, _, _ = select.select(devices, [], [])
+                    for device in readable:
+                        for event in device.read():
+                            if event.type == evdev.ecodes.EV_KEY:
+                                self._handle_key_event(evdev.categorize(event))
+            except OSError as e:
+                LOGGER.warning("Input device lost, rescanning: %s", e)
+            finally:
+                for device in devices:
+                    try:
+                        device.close()
+                    except OSError:
+                        pass
+
+    def _find_devices(self) -> List:
+        """Open all input devices that report keypad or keyboard keys."""
+        devices = []
+        for path in evdev.list_devices():
+            try:
+                device = evdev.InputDevice(path)
+                keys = device.capabilities().get(evdev.ecodes.EV_KEY, [])
+                if evdev.ecodes.KEY_KP0 in keys or evdev.ecodes.KEY_0 in keys:
+                    LOGGER.info("Reading keys from %s (%s)", device.name, path)
+                    devices.append(device)
+                else:
+                    device.close()
+            except OSError as e:
+                LOGGER.debug("Cannot open input device %s: %s", path, e)
+        return devices
+
+    def _handle_key_event(self, key_event) -> None:
+        """Translate an evdev key event into queued key presses."""
+        keycodes = key_event.keycode if isinstance(key_event.keycode, list) else [key_event.keycode]
+        key = next((self.KEYCODE_CHARS[code] for code in keycodes if code in self.KEYCODE_CHARS), None)
+        if key is None:
+            return
+
+        if key_event.keystate == key_event.key_down:
+            self._held[key] = time.monotonic()
+            self._long_pressed.discard(key)
+            self._put(KeyPress(key))
+        elif key_event.keystate == key_event.key_hold:
+            # Auto-repeat events arrive while the key stays down
+            if key not in self._long_pressed and self.held_for(key) >= self.LONG_PRESS_SECONDS:
+                self._long_pressed.add(key)
+                self._put(KeyPress(key, long_press=True))
+        elif key_event.keystate == key_event.key_up:
+            self._held.pop(key, None)
+
+
+_INPUT_READER: Optional[InputReader] = None
+
+
+def get_input_reader() -> InputReader:
+    """Get the process-wide input reader, starting it on first use."""
+    global _INPUT_READER
+    if _INPUT_READER is None:
+        _INPUT_READER = InputReader()
+    _INPUT_READER.start()
+    return _INPUT_READER
@@ -0,0 +1,420 @@
+"""Persistent index of the local audio folders."""
+
+import logging
+import os
+import sqlite3
+import subprocess
+import threading
+import time
+import wave
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+try:
+    import inotify_simple
+except ImportError:
+    inotify_simple = None
+
+from sleepy.constants import AUDIO_EXTENSIONS, EVICTION_POLICIES, LIBRARY_FILE, STORAGE_CODECS
+from sleepy.models import LibraryTrack
+
+LOGGER = logging.getLogger(__name__)
+
+_CODECS = {ext: codec for codec, ext in STORAGE_CODECS.items()}
+
+
+def is_playable(name: str) -> bool:
+    """Check whether a file name looks like a finished audio file."""
+    return not name.startswith('.') and Path(name).suffix.lower() in AUDIO_EXTENSIONS
+
+
+class MediaLibrary:
+    """SQLite-backed index of the audio files in the local playlist folders.
+
+    The track rows keep per-file metadata and play statistics. For each
+    folder the paths are also held in an in-memory list, so picking a
+    track by index and removing one are O(1). Folders are kept current
+    incrementally: through inotify if ``inotify_simple`` is installed,
+    otherwise by rescanning a folder only when its mtime changed. The
+    bytes used per folder are kept up to date along with the lists.
+    """
+
+    PROBE_INTERVAL = 60  # seconds between passes over tracks without a duration
+    _COLUMNS = "path, folder, size, mtime, codec, duration, loudness, play_count, last_played"
+
+    def __init__(self, db_path: str = LIBRARY_FILE):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.RLock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._folders: Dict[str, List[str]] = {}
+        self._positions: Dict[str, int] = {}
+        self._folder_mtimes: Dict[str, int] = {}
+        self._generations: Dict[str, int] = {}
+        self._bytes: Dict[str, int] = {}
+        self._session = os.urandom(4).hex()
+        self._inotify = None
+        self._watches: Dict[int, str] = {}
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS tracks (
+                    path TEXT PRIMARY KEY,
+                    folder TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    mtime REAL NOT NULL,
+                    codec TEXT NOT NULL,
+                    duration REAL,
+                    loudness REAL,
+                    play_count INTEGER NOT NULL DEFAULT 0,
+                    last_played REAL,
+                    loudness_failed_at REAL
+                );
+                CREATE INDEX IF NOT EXISTS idx_tracks_folder ON tracks (folder);
+                CREATE TABLE IF NOT EXISTS folders (
+                    folder TEXT PRIMARY KEY,
+                    mtime_ns INTEGER NOT NULL
+                );
+                """
+            )
+            # Indexes created before failed measurements were recorded
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(tracks)")}
+            if 'loudness_failed_at' not in columns:
+                self._conn.execute("ALTER TABLE tracks ADD COLUMN loudness_failed_at REAL")
+        for path, folder, size in self._conn.execute("SELECT path, folder, size FROM tracks ORDER BY path"):
+            self._append(folder, path, size)
+        for folder, mtime_ns in self._conn.execute("SELECT folder, mtime_ns FROM folders"):
+            self._folder_mtimes[folder] = mtime_ns
+
+    def start(self) -> None:
+        """Start the inotify watcher and the background duration probe."""
+        if self._threads:
+            return
+        self._stopping.clear()
+        if inotify_simple is not None:
+            self._inotify = inotify_simple.INotify()
+            self._threads.append(threading.Thread(target=self._watch_loop, name='library-watch', daemon=True))
+        else:
+            LOGGER.info("inotify_simple not installed, local folders are rescanned when their mtime changes")
+        self._threads.append(threading.Thread(target=self._probe_loop, name='library-probe', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def close(self) -> None:
+        """Stop the background threads."""
+        self._stopping.set()
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
+            self._watches = {}
+
+    def refresh(self, folder: str) -> None:
+        """Bring the index of a folder up to date.
+
+        Costs a single stat if the folder did not change since the last
+        call, and nothing at all if the folder is watched through inotify.
+        """
+        key = self._key(folder)
+        if key in self._watches.values():
+            return
+        try:
+            mtime_ns = os.stat(key).st_mtime_ns
+        except OSError:
+            mtime_ns = None
+        if mtime_ns is not None and self._folder_mtimes.get(key) == mtime_ns:
+            self._watch(key)
+            return
+
+        # Watch before scanning so no change slips in between
+        self._watch(key)
+        try:
+            names = {
+                entry.path for entry in os.scandir(key)
+                if is_playable(entry.name) and entry.is_file()
+            }
+        except OSError as e:
+            LOGGER.warning("Failed to scan folder %s: %s", key, e)
+            names = set()
+
+        with self._lock:
+            known = set(self._folders.get(key, ()))
+            for path in known - names:
+                self._remove_row(path)
+            for path in sorted(names - known):
+                self._add_row(path)
+            with self._conn:
+                if mtime_ns is None:
+                    self._conn.execute("DELETE FROM folders WHERE folder = ?", (key,))
+                    self._folder_mtimes.pop(key, None)
+                else:
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO folders (folder, mtime_ns) VALUES (?, ?)", (key, mtime_ns)
+                    )
+                    self._folder_mtimes[key] = mtime_ns
+        LOGGER.info(
+            "Indexed %s: %d tracks (%d added, %d removed)",
+            key, len(names), len(names - known), len(known - names)
+        )
+
+    def count(self, folder: str) -> int:
+        """Get the number of indexed tracks in a folder."""
+        with self._lock:
+            return len(self._folders.get(self._key(folder), ()))
+
+    def version(self, folder: str) -> str:
+        """Get a token that changes whenever files were added to or removed from a folder."""
+        key = self._key(folder)
+        with self._lock:
+            return f"{self._session}:{self._generations.get(key, 0)}"
+
+    def paths(self, folder: str) -> List[str]:
+        """Get the paths of all indexed tracks in a folder."""
+        with self._lock:
+            return list(self._folders.get(self._key(folder), ()))
+
+    def usage(self, folder: str) -> Tuple[int, int]:
+        """Get the number of indexed tracks in a folder and their total size in bytes."""
+        key = self._key(folder)
+        with self._lock:
+            return len(self._folders.get(key, ())), self._bytes.get(key, 0)
+
+    def eviction_order(self, folder: str, policy: str, limit: int = 50) -> List[LibraryTrack]:
+        """Get the tracks of a folder that should be deleted first.
+
+        Args:
+            folder: Path of the folder.
+            policy: One of EVICTION_POLICIES: 'lru' orders by the last
+                playback (tracks never played by when they were added),
+                'oldest' by when the file was added.
+            limit: Maximum number of tracks to return.
+        """
+        if policy not in EVICTION_POLICIES:
+            raise ValueError(f"Unknown eviction policy: {policy}")
+        order = "COALESCE(last_played, mtime)" if policy == 'lru' else "mtime"
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM tracks WHERE folder = ? ORDER BY {order} LIMIT ?",
+                (self._key(folder), limit)
+            ).fetchall()
+        return [LibraryTrack(*row) for row in rows]
+
+    def get_track(self, folder: str, index: int) -> Optional[LibraryTrack]:
+        """Get the track at a position of a folder's index.
+
+        Args:
+            folder: Path of the folder, e.g. './local/asmr'.
+            index: Zero-based position, below count(folder).
+
+        Returns:
+            The track, or None if there is no track at that position.
+        """
+        with self._lock:
+            paths = self._folders.get(self._key(folder), [])
+            if not 0 <= index < len(paths):
+                return None
+            return self.get(paths[index])
+
+    def get(self, path: str) -> Optional[LibraryTrack]:
+        """Get an indexed track by its path."""
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT {self._COLUMNS} FROM tracks WHERE path = ?", (self._key(path),)
+            ).fetchone()
+        return LibraryTrack(*row) if row else None
+
+    def add(self, path: str) -> None:
+        """Index a single file that was added to a folder."""
+        with self._lock:
+            self._add_row(self._key(path))
+
+    def remove(self, path: str) -> None:
+        """Drop a single file from the index."""
+        with self._lock:
+            self._remove_row(self._key(path))
+
+    def move(self, source: str, dest: str) -> None:
+        """Carry a track and its play statistics over to a new path."""
+        source, dest = self._key(source), self._key(dest)
+        with self._lock:
+            track = self.get(source)
+            self._remove_row(source)
+            self._add_row(dest)
+            if track is not None:
+                with self._conn:
+                    self._conn.execute(
+                        "UPDATE tracks SET duration = COALESCE(duration, ?), loudness = COALESCE(loudness, ?), "
+                        "play_count = play_count + ?, last_played = COALESCE(last_played, ?) WHERE path = ?",
+                        (track.duration, track.loudness, track.play_count, track.last_played, dest)
+                    )
+
+    def mark_played(self, path: str) -> None:
+        """Count a playback of a track."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE tracks SET play_count = play_count + 1, last_played = ? WHERE path = ?",
+                (time.time(), self._key(path))
+            )
+
+    def set_loudness(self, path: str, loudness: float) -> None:
+        """Store the measured integrated loudness of a track in LUFS."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE tracks SET loudness = ? WHERE path = ?", (loudness, self._key(path))
+            )
+
+    def set_loudness_failed(self, path: str) -> None:
+        """Record that the loudness of a track could not be measured."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE tracks SET loudness_failed_at = ? WHERE path = ?", (time.time(), self._key(path))
+            )
+
+    def unmeasured(self, limit: int = 100, retry_after: float = 7 * 24 * 60 * 60) -> List[str]:
+        """Get the paths of tracks whose loudness was not measured yet.
+
+        Tracks whose measurement failed are left out for retry_after seconds,
+        e.g. until ffmpeg was installed. A replaced file is indexed anew and
+        measured again at once.
+        """
+        with self._lock:
+            return [
+                row[0] for row in self._conn.execute(
+                    "SELECT path FROM tracks WHERE loudness IS NULL "
+                    "AND (loudness_failed_at IS NULL OR loudness_failed_at < ?) ORDER BY mtime DESC LIMIT ?",
+                    (time.time() - retry_after, limit)
+                )
+            ]
+
+    @staticmethod
+    def _key(path: str) -> str:
+        """Normalize a path so './local/asmr' and 'local/asmr/' match."""
+        return os.path.normpath(path)
+
+    def _append(self, folder: str, path: str, size: int) -> None:
+        """Add a path to the in-memory folder list."""
+        paths = self._folders.setdefault(folder, [])
+        self._positions[path] = len(paths)
+        paths.append(path)
+        self._generations[folder] = self._generations.get(folder, 0) + 1
+        self._bytes[folder] = self._bytes.get(folder, 0) + size
+
+    def _add_row(self, path: str) -> None:
+        """Index a file. The caller holds the lock."""
+        if path in self._positions:
+            return
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return
+        suffix = Path(path).suffix.lower()
+        duration = self._wav_duration(path) if suffix == '.wav' else None
+        folder = os.path.dirname(path)
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO tracks (path, folder, size, mtime, codec, duration) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (path, folder, stat.st_size, stat.st_mtime, _CODECS.get(suffix, suffix.lstrip('.')), duration)
+            )
+        self._append(folder, path, stat.st_size)
+
+    def _remove_row(self, path: str) -> None:
+        """Drop a file from the index. The caller holds the lock."""
+        index = self._positions.pop(path, None)
+        if index is None:
+            return
+        folder = os.path.dirname(path)
+        paths = self._folders[folder]
+        self._generations[folder] = self._generations.get(folder, 0) + 1
+        # Swap the last path into the hole to keep removal O(1)
+        last = paths.pop()
+        if last != path:
+            paths[index] = last
+            self._positions[last] = index
+        with self._conn:
+            row = self._conn.execute("SELECT size FROM tracks WHERE path = ?", (path,)).fetchone()
+            self._conn.execute("DELETE FROM tracks WHERE path = ?", (path,))
+        if row:
+            self._bytes[folder] = max(0, self._bytes.get(folder, 0) - row[0])
+
+    @staticmethod
+    def _wav_duration(path: str) -> Optional[float]:
+        """Read the duration from a WAV header."""
+        try:
+            with wave.open(path, 'rb') as w:
+                return w.getnframes() / w.getframerate()
+        except Exception:
+            return None
+
+    def _watch(self, folder: str) -> None:
+        """Add an inotify watch for a folder if inotify is running."""
+        if self._inotify is None or folder in self._watches.values() or not os.path.isdir(folder):
+            return
+        flags = inotify_simple.flags
+        try:
+            wd = self._inotify.add_watch(
+                folder, flags.CLOSE_WRITE | flags.MOVED_TO | flags.DELETE | flags.MOVED_FROM
+            )
+        except OSError as e:
+            LOGGER.warning("Failed to watch %s: %s", folder, e)
+            return
+        self._watches[wd] = folder
+
+    def _watch_loop(self) -> None:
+        """Apply inotify events to the index."""
+        flags = inotify_simple.flags
+        while not self._stopping.is_set():
+            try:
+                events = self._inotify.read(timeout=1000)
+            except (OSError, ValueError):
+                break
+            for event in events:
+                if event.mask & flags.Q_OVERFLOW:
+                    LOGGER.warning("inotify queue overflowed, rescanning on next access")
+                    self._folder_mtimes.clear()
+                    self._watches.clear()
+                    continue
+                folder = self._watches.get(event.wd)
+                if folder is None or not is_playable(event.name):
+                    continue
+                path = os.path.join(folder, event.name)
+                if event.mask & (flags.CLOSE_WRITE | flags.MOVED_TO):
+                    self.add(path)
+                else:
+                    self.remove(path)
+
+    def _probe_loop(self) -> None:
+        """Fill in the duration of compressed tracks with ffprobe."""
+        failed = set()
+        while not self._stopping.is_set():
+            with self._lock:
+                paths = [
+                    row[0] for row in self._conn.execute("SELECT path FROM tracks WHERE duration IS NULL")
+                    if row[0] not in failed
+                ]
+            for path in paths:
+                if self._stopping.is_set():
+                    return
+                try:
+                    result = subprocess.run(
+                        ['ffprobe', '-v', 'error', '-show_entries', 'format=duration', '-of', 'csv=p=0', path],
+                        stdout=subprocess.PIPE,
+                        stderr=subprocess.DEVNULL,
+                        check=False,
+                        timeout=30
+                    )
+                    duration = float(result.stdout.decode().strip())
+                except FileNotFoundError:
+                    LOGGER.info("ffprobe not found, durations of compressed tracks stay unknown")
+                    return
+                except Exception as e:
+                    LOGGER.debug("Failed to probe %s: %s", path, e)
+                    failed.add(path)
+                    continue
+                with self._lock, self._conn:
+                    self._conn.execute("UPDATE tracks SET duration = ? WHERE path = ?", (duration, path))
+            self._stopping.wait(self.PROBE_INTERVAL)
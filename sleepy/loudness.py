@@ -0,0 +1,269 @@
+"""EBU R128 loudness measurement of the local library and playback gain."""
+
+import logging
+import math
+import subprocess
+import threading
+import wave
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+LOGGER = logging.getLogger(__name__)
+
+BLOCK = 0.4                # seconds per gating block
+STEP = 0.1                 # seconds between block starts (75 % overlap)
+ABSOLUTE_GATE = -70.0      # LUFS
+RELATIVE_GATE = -10.0      # LU below the absolute-gated loudness
+CHUNK_SECONDS = 5          # seconds of audio decoded and filtered at once
+FIR_LENGTH = 16384         # taps of the truncated K-weighting impulse response
+DECODE_RATE = 48000        # rate compressed files are decoded at
+
+_fir_cache: Dict[int, 'np.ndarray'] = {}
+
+
+def available() -> bool:
+    """Check whether loudness can be measured (NumPy is installed)."""
+    return np is not None
+
+
+def gain_db(loudness: Optional[float], target: Optional[float], max_boost: float) -> float:
+    """Get the playback gain that brings a track to the target loudness.
+
+    Args:
+        loudness: Integrated loudness of the track in LUFS, None if unknown.
+        target: Target loudness in LUFS, None to disable normalization.
+        max_boost: Largest gain in dB applied to quiet tracks.
+
+    Returns:
+        The gain in dB, 0 if the loudness or the target is unknown.
+    """
+    if loudness is None or target is None:
+        return 0.0
+    return min(max_boost, target - loudness)
+
+
+def _k_weighting_fir(rate: int) -> 'np.ndarray':
+    """Get the impulse response of the BS.1770 K-weighting filter at a sample rate.
+
+    The two biquads (high shelf and high pass, coefficients as in
+    libebur128 so any rate works) are run once on an impulse; the
+    response has decayed far below measurement precision after
+    FIR_LENGTH samples, so filtering becomes an FFT convolution.
+    """
+    if rate in _fir_cache:
+        return _fir_cache[rate]
+
+    k = math.tan(math.pi * 1681.974450955533 / rate)
+    q = 0.7071752369554196
+    vh = 10 ** (3.999843853973347 / 20)
+    vb = vh ** 0.4996667741545416
+    a0 = 1 + k / q + k * k
+    shelf = (
+        ((vh + vb * k / q + k * k) / a0, 2 * (k * k - vh) / a0, (vh - vb * k / q + k * k) / a0),
+        (2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0),
+    )
+    k = math.tan(math.pi * 38.13547087602444 / rate)
+    q = 0.5003270373238773
+    a0 = 1 + k / q + k * k
+    highpass = ((1.0, -2.0, 1.0), (2 * (k * k - 1) / a0, (1 - k / q + k * k) / a0))
+
+    signal = [0.0] * FIR_LENGTH
+    signal[0] = 1.0
+    for (b0, b1, b2), (a1, a2) in (shelf, highpass):
+        x1 = x2 = y1 = y2 = 0.0
+        out = []
+        for x in signal:
+            y = b0 * x + b1 * x1 + b2 * x2 - a1 * y1 - a2 * y2
+            x2, x1, y2, y1 = x1, x, y1, y
+            out.append(y)
+        signal = out
+    _fir_cache[rate] = np.array(signal)
+    return _fir_cache[rate]
+
+
+class LoudnessMeter:
+    """Integrated loudness (EBU R128 / ITU-R BS.1770) over audio fed in chunks.
+
+    Each chunk is K-weighted by FFT convolution, with the tail of the
+    previous chunk carried over, and reduced to the mean square of every
+    100 ms step. A 400 ms gating block is the mean of four steps, so only
+    one float per step is kept, whatever the length of the track.
+    """
+
+    def __init__(self, rate: int, channels: int):
+        self.rate = rate
+        self.channels = channels
+        self._fir = _k_weighting_fir(rate)
+        self._history = np.zeros((FIR_LENGTH - 1, channels))
+        self._step = int(round(rate * STEP))
+        self._leftover = np.zeros(0)
+        self._steps = []
+
+    def add(self, samples: 'np.ndarray') -> None:
+        """Add samples, shaped (frames, channels) and scaled to [-1, 1]."""
+        if not len(samples):
+            return
+        frames = len(samples)
+        signal = np.concatenate([self._history, samples])
+        self._history = signal[-(FIR_LENGTH - 1):]
+
+        size = 1 << (len(signal) - 1).bit_length()
+        spectrum = np.fft.rfft(signal, size, axis=0) * np.fft.rfft(self._fir, size)[:, None]
+        weighted = np.fft.irfft(spectrum, size, axis=0)[FIR_LENGTH - 1:FIR_LENGTH - 1 + frames]
+
+        # Channel weights are 1 for left, right and centre
+        power = np.concatenate([self._leftover, np.sum(weighted ** 2, axis=1)])
+        whole = len(power) // self._step * self._step
+        self._steps.extend(power[:whole].reshape(-1, self._step).mean(axis=1))
+        self._leftover = power[whole:]
+
+    def integrated(self) -> Optional[float]:
+        """Get the gated integrated loudness in LUFS, or None if the audio is silent or too short."""
+        steps = np.array(self._steps)
+        per_block = int(round(BLOCK / STEP))
+        if len(steps) < per_block:
+            return None
+        blocks = np.convolve(steps, np.ones(per_block) / per_block, mode='valid')
+        blocks = blocks[blocks > 0]
+        loudness = -0.691 + 10 * np.log10(blocks) if len(blocks) else blocks
+
+        gated = blocks[loudness > ABSOLUTE_GATE]
+        if not len(gated):
+            return None
+        threshold = -0.691 + 10 * math.log10(gated.mean()) + RELATIVE_GATE
+        gated = blocks[loudness > max(ABSOLUTE_GATE, threshold)]
+        return float(-0.691 + 10 * math.log10(gated.mean()))
+
+
+def _read_wav(path: str) -> Iterator[Tuple[int, 'np.ndarray']]:
+    """Yield (rate, samples) chunks of a PCM WAV file."""
+    with wave.open(path, 'rb') as w:
+        rate, channels, width = w.getframerate(), w.getnchannels(), w.getsampwidth()
+        if width not in (1, 2, 3, 4):
+            raise ValueError(f"Unsupported sample width: {width}")
+        while True:
+            raw = w.readframes(rate * CHUNK_SECONDS)
+            if not raw:
+                return
+            if width == 1:
+                samples = (np.frombuffer(raw, np.uint8).astype(np.float64) - 128) / 128
+            elif width == 3:
+                # Little-endian 24 bit: pad each sample to 32 bit
+                padded = np.zeros((len(raw) // 3, 4), np.uint8)
+                padded[:, 1:] = np.frombuffer(raw, np.uint8).reshape(-1, 3)
+                samples = padded.view('<i4').ravel() / 2.0 ** 31
+            else:
+                dtype = '<i2' if width == 2 else '<i4'
+                samples = np.frombuffer(raw, dtype) / float(2 ** (8 * width - 1))
+            yield rate, samples.reshape(-1, channels)
+
+
+def _read_ffmpeg(path: str) -> Iterator[Tuple[int, 'np.ndarray']]:
+    """Yield (rate, samples) chunks of any file ffmpeg decodes, as 48 kHz stereo."""
+    proc = subprocess.Popen(
+        ['ffmpeg', '-nostdin', '-v', 'error', '-i', path, '-vn', '-ac', '2', '-ar', str(DECODE_RATE), '-f', 'f32le', '-'],
+        stdout=subprocess.PIPE,
+        stderr=subprocess.DEVNULL
+    )
+    chunk = DECODE_RATE * CHUNK_SECONDS * 2 * 4
+    try:
+        while True:
+            raw = proc.stdout.read(chunk)
+            if not raw:
+                break
+            yield DECODE_RATE, np.frombuffer(raw[:len(raw) // 8 * 8], '<f4').astype(np.float64).reshape(-1, 2)
+    finally:
+        proc.stdout.close()
+        proc.kill()
+        proc.wait()
+    if proc.returncode not in (0, -9):
+        raise RuntimeError(f"ffmpeg exited with {proc.returncode}")
+
+
+def measure_file(path: str, stop: Optional[threading.Event] = None) -> Optional[float]:
+    """Measure the integrated loudness of an audio file in LUFS.
+
+    The file is decoded in chunks of CHUNK_SECONDS, so memory use does not
+    depend on its length. WAV files are read directly, other formats are
+    decoded by ffmpeg.
+
+    Returns:
+        The loudness, or None if the file is silent or could not be read.
+    """
+    reader = _read_wav if Path(path).suffix.lower() == '.wav' else _read_ffmpeg
+    meter = None
+    try:
+        for rate, samples in reader(path):
+            if stop is not None and stop.is_set():
+                return None
+            if meter is None:
+                meter = LoudnessMeter(rate, samples.shape[1])
+            meter.add(samples)
+    except Exception as e:
+        LOGGER.warning("Failed to measure loudness of %s: %s", path, e)
+        return None
+    return meter.integrated() if meter else None
+
+
+class LoudnessAnalyzer:
+    """Measures the loudness of new library tracks in the background.
+
+    Every track is measured once; the result is stored in the library, so
+    restarts only analyse files that were added since.
+    """
+
+    ANALYZE_INTERVAL = 60  # seconds between passes over unmeasured tracks
+
+    def __init__(self, library):
+        self.library = library
+        self.folders: List[str] = []
+        self._stopping = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def start(self, folders: Iterable[str] = ()) -> None:
+        """Start the analyzer thread, if NumPy is installed.
+
+        Args:
+            folders: Local playlist folders to bring up to date before each
+                pass, so tracks are measured before they are first played.
+        """
+        self.folders = list(folders)
+        if not available():
+            LOGGER.info("numpy not installed, tracks play without loudness normalization")
+            return
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stopping.clear()
+        self._worker = threading.Thread(target=self._analyze_loop, name='loudness', daemon=True)
+        self._worker.start()
+
+    def stop(self) -> None:
+        """Stop the analyzer after the current chunk."""
+        self._stopping.set()
+        if self._worker is not None:
+            self._worker.join(timeout=2)
+            self._worker = None
+
+    def _analyze_loop(self) -> None:
+        """Measure every track without a loudness, then wait for new ones."""
+        while not self._stopping.is_set():
+            for folder in self.folders:
+                self.library.refresh(folder)
+            for path in self.library.unmeasured():
+                if self._stopping.is_set():
+                    return
+                loudness = measure_file(path, self._stopping)
+                if loudness is None:
+                    if self._stopping.is_set():
+                        return
+                    # Stored, so silent or unreadable files do not crowd out the others
+                    self.library.set_loudness_failed(path)
+                    continue
+                self.library.set_loudness(path, loudness)
+                LOGGER.debug("Loudness of %s: %.1f LUFS", path, loudness)
+            self._stopping.wait(self.ANALYZE_INTERVAL)
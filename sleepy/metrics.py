@@ -0,0 +1,277 @@
+"""In-process latency histograms and counters with a Prometheus text export."""
+
+import bisect
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+LOGGER = logging.getLogger(__name__)
+
+# Upper bounds in seconds, from IPC round trips up to multi-hour tracks
+DEFAULT_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0, 1800.0, 7200.0,
+)
+
+HELP = {
+    'sleepy_state_seconds': "Time spent in each state of the state machine",
+    'sleepy_track_phase_seconds': "Time spent in each phase of a track, per player",
+    'sleepy_call_seconds': "Duration of calls to external programs and APIs",
+    'sleepy_first_audio_seconds': "Time from loading a track until audio plays",
+    'sleepy_prefetch_total': "Tracks that were or were not prefetched in time",
+    'sleepy_youtube_quota_units_total': "YouTube API quota units spent, per method",
+    'sleepy_storage_deleted_bytes_total': "Bytes deleted to keep folders within their quotas",
+    'sleepy_mirror_evicted_bytes_total': "Bytes evicted from the offline mirror",
+    'sleepy_downloads_total': "Downloads stored, from a captured stream or fetched by yt-dlp",
+    'sleepy_pipeline_transitions_total': "Switches between local tracks without reopening the output",
+}
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+class Histogram:
+    """Counts of observations per bucket, their sum and their number."""
+
+    def __init__(self, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add an observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Registry of the histograms, counters and gauges of the process.
+
+    Recording costs a dict lookup and a bisect under a lock, so it can sit
+    on every hot path. Series are keyed by metric name and labels and are
+    only formatted when the registry is rendered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, Histogram]] = {}
+        self._counters: Dict[str, Dict[Labels, float]] = {}
+        self._gauges: Dict[str, Dict[Labels, Callable[[], float]]] = {}
+        self._help: Dict[str, str] = dict(HELP)
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        """Record a duration in a histogram."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = Histogram()
+            histogram.observe(seconds)
+
+    def inc(self, name: str, value: float = 1, **labels: str) -> None:
+        """Add to a counter."""
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + value
+
+    def gauge(self, name: str, read: Callable[[], float], text: Optional[str] = None, **labels: str) -> None:
+        """Register a value that is read when the metrics are rendered."""
+        with self._lock:
+            self._gauges.setdefault(name, {})[tuple(sorted(labels.items()))] = read
+        if text:
+            self._help[name] = text
+
+    @contextmanager
+    def timer(self, name: str, **labels: str) -> Iterator[None]:
+        """Record the duration of a block in a histogram, also if it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def histogram_totals(self, name: str) -> Dict[Labels, Tuple[int, float]]:
+        """Get the number and sum of the observations of each series of a histogram."""
+        with self._lock:
+            return {key: (h.count, h.sum) for key, h in self._histograms.get(name, {}).items()}
+
+    def counter_values(self, name: str) -> Dict[Labels, float]:
+        """Get the value of each series of a counter."""
+        with self._lock:
+            return dict(self._counters.get(name, {}))
+
+    def render(self) -> str:
+        """Format all metrics in the Prometheus text exposition format."""
+        lines: List[str] = []
+        with self._lock:
+            histograms = {
+                name: {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+            counters = {name: dict(series) for name, series in self._counters.items()}
+            gauges = {name: dict(series) for name, series in self._gauges.items()}
+
+        for name in sorted(histograms):
+            self._header(lines, name, 'histogram')
+            for key, (counts, total, count, buckets) in sorted(histograms[name].items()):
+                cumulative = 0
+                for bound, bucket_count in zip(buckets, counts):
+                    cumulative += bucket_count
+                    lines.append(f"{name}_bucket{_labels(key + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_labels(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_labels(key)} {total:.6f}")
+                lines.append(f"{name}_count{_labels(key)} {count}")
+        for name in sorted(counters):
+            self._header(lines, name, 'counter')
+            for key, value in sorted(counters[name].items()):
+                lines.append(f"{name}{_labels(key)} {value:g}")
+        for name in sorted(gauges):
+            self._header(lines, name, 'gauge')
+            for key, read in sorted(gauges[name].items(), key=lambda entry: entry[0]):
+                try:
+                    lines.append(f"{name}{_labels(key)} {read():g}")
+                except Exception as e:
+                    LOGGER.debug("Failed to read gauge %s: %s", name, e)
+        return '\n'.join(lines) + '\n'
+
+    def reset(self) -> None:
+        """Drop all recorded values, keeping gauges and help texts."""
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+
+    def _header(self, lines: List[str], name: str, kind: str) -> None:
+        """Add the HELP and TYPE lines of a metric."""
+        if name in self._help:
+            lines.append(f"# HELP {name} {self._help[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def _labels(key: Labels) -> str:
+    """Format a label set, e.g. {state="play"}."""
+    if not key:
+        return ''
+    pairs = ','.join(
+        '{}="{}"'.format(label, str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for label, value in key
+    )
+    return '{' + pairs + '}'
+
+
+_METRICS: Optional[Metrics] = None
+
+
+def get_metrics() -> Metrics:
+    """Get the shared metrics registry."""
+    global _METRICS
+    if _METRICS is None:
+        _METRICS = Metrics()
+    return _METRICS
+
+
+class MetricsExporter:
+    """Serves the metrics over HTTP on localhost and snapshots them to a file.
+
+    ``GET /metrics`` answers with the current values for a Prometheus
+    scrape or curl. The text file, if configured, is rewritten atomically
+    every interval and on stop, in the format of the node_exporter textfile
+    collector, so the numbers of the last session survive a shutdown.
+    """
+
+    HOST = '127.0.0.1'
+
+    def __init__(self, metrics: Optional[Metrics] = None):
+        self.metrics = metrics or get_metrics()
+        self.port = 0
+        self.textfile: Optional[str] = None
+        self.interval = 60.0
+        self._server: Optional[ThreadingHTTPServer] = None
+        self._threads: List[threading.Thread] = []
+        self._stopping = threading.Event()
+
+    def configure(self, port: int, textfile: Optional[str], interval: float) -> None:
+        """Set where to export.
+
+        Args:
+            port: Local TCP port of the HTTP endpoint, 0 to disable it.
+            textfile: Path of the snapshot file, None to disable it.
+            interval: Seconds between snapshots.
+        """
+        self.port = port
+        self.textfile = textfile
+        self.interval = interval
+
+    def start(self) -> None:
+        """Start the HTTP endpoint and the snapshot thread."""
+        if self._threads:
+            return
+        self._stopping.clear()
+        if self.port:
+            metrics = self.metrics
+
+            class Handler(BaseHTTPRequestHandler):
+                def do_GET(self):
+                    if self.path.split('?')[0] not in ('/', '/metrics'):
+                        self.send_error(404)
+                        return
+                    body = metrics.render().encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                    self.send_header('Content-Length', str(len(body)))
+                    self.end_headers()
+                    self.wfile.write(body)
+
+                def log_message(self, format, *args):
+                    LOGGER.debug("Metrics request: " + format, *args)
+
+            try:
+                self._server = ThreadingHTTPServer((self.HOST, self.port), Handler)
+                self._server.daemon_threads = True
+                self._threads.append(
+                    threading.Thread(target=self._server.serve_forever, name='metrics-http', daemon=True)
+                )
+                LOGGER.info("Serving metrics on http://%s:%d/metrics", self.HOST, self.port)
+            except OSError as e:
+                LOGGER.warning("Failed to serve metrics on port %d: %s", self.port, e)
+                self._server = None
+        if self.textfile:
+            self._threads.append(threading.Thread(target=self._snapshot_loop, name='metrics-file', daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self) -> None:
+        """Stop exporting, writing a last snapshot."""
+        self._stopping.set()
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+        for thread in self._threads:
+            thread.join(timeout=2)
+        self._threads = []
+        if self.textfile:
+            self.write(self.textfile)
+
+    def write(self, path: str) -> None:
+        """Write the current metrics to a file, replacing it atomically."""
+        target = Path(path)
+        try:
+            target.parent.mkdir(parents=True, exist_ok=True)
+            tmp = target.with_name(f'.{target.name}.{os.getpid()}')
+            tmp.write_text(self.metrics.render())
+            os.replace(tmp, target)
+        except OSError as e:
+            LOGGER.warning("Failed to write metrics to %s: %s", path, e)
+
+    def _snapshot_loop(self) -> None:
+        """Rewrite the snapshot file every interval."""
+        while not self._stopping.wait(self.interval):
+            self.write(self.textfile)
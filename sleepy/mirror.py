@@ -0,0 +1,211 @@
+"""Offline copies of upcoming YouTube playlist items."""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Iterable, Optional
+
+from sleepy.constants import MIRROR_DIR, MIRROR_FILE
+from sleepy.metrics import get_metrics
+from sleepy.models import PlaylistItem
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PlaylistMirror:
+    """Size-capped local cache of YouTube playlist items.
+
+    A scheduled job (mirror_playlists.py) downloads the next items of each
+    playlist into ``<root>/<playlist_id>/<video_id>.<ext>`` while the
+    network is idle, and YouTubePlayer plays these files instead of
+    streaming. Once the cache is larger than max_bytes, the files used
+    least recently are evicted first.
+    """
+
+    DEFAULT_MAX_BYTES = 2048 * 1024 * 1024
+
+    def __init__(self, root: str = MIRROR_DIR, db_path: str = MIRROR_FILE, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.root = Path(root)
+        self.max_bytes = max_bytes
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS files (
+                    playlist_id TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    path TEXT NOT NULL,
+                    size INTEGER NOT NULL,
+                    added_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    PRIMARY KEY (playlist_id, video_id)
+                );
+                CREATE INDEX IF NOT EXISTS idx_files_last_used
+                    ON files (last_used);
+                """
+            )
+
+    def lookup(self, playlist_id: str, video_id: str) -> Optional[str]:
+        """Get the local copy of a video and mark it as used.
+
+        Returns:
+            The absolute path of the file, or None if it is not mirrored.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path FROM files WHERE playlist_id = ? AND video_id = ?", (playlist_id, video_id)
+            ).fetchone()
+            if row is None:
+                return None
+            if not Path(row[0]).exists():
+                LOGGER.debug("Mirrored file is gone: %s", row[0])
+                with self._conn:
+                    self._conn.execute(
+                        "DELETE FROM files WHERE playlist_id = ? AND video_id = ?", (playlist_id, video_id)
+                    )
+                return None
+            with self._conn:
+                self._conn.execute(
+                    "UPDATE files SET last_used = ? WHERE playlist_id = ? AND video_id = ?",
+                    (time.time(), playlist_id, video_id)
+                )
+        return row[0]
+
+    def contains(self, playlist_id: str, video_id: str) -> bool:
+        """Check whether a video is mirrored, without marking it as used."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path FROM files WHERE playlist_id = ? AND video_id = ?", (playlist_id, video_id)
+            ).fetchone()
+        return row is not None and Path(row[0]).exists()
+
+    def fetch(self, downloader, playlist_id: str, item: PlaylistItem) -> Optional[str]:
+        """Download a playlist item into the mirror.
+
+        Args:
+            downloader: The YouTubeDownloader, set to the mirror's format.
+            playlist_id: ID of the playlist the item belongs to.
+            item: The playlist item.
+
+        Returns:
+            The path of the mirrored file, or None if the download failed.
+        """
+        folder = self.root / playlist_id
+        if not downloader.download(item.url, write_failure_log=False, output_dir=str(folder), output_name=item.video_id):
+            return None
+        files = [path for path in folder.glob(f'{item.video_id}.*') if not path.name.endswith('.part')]
+        if not files:
+            LOGGER.error("Download of %s left no file in %s", item.video_id, folder)
+            return None
+        path = str(max(files, key=lambda path: path.stat().st_mtime).resolve())
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO files (playlist_id, video_id, path, size, added_at, last_used) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (playlist_id, item.video_id, path, Path(path).stat().st_size, now, now)
+            )
+        LOGGER.info("Mirrored %s (%s)", item.title or item.video_id, playlist_id)
+        return path
+
+    def remove(self, playlist_id: str, video_id: str) -> None:
+        """Delete the local copy of a video, e.g. once it left the playlist."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT path FROM files WHERE playlist_id = ? AND video_id = ?", (playlist_id, video_id)
+            ).fetchone()
+            if row is None:
+                return
+            with self._conn:
+                self._conn.execute(
+                    "DELETE FROM files WHERE playlist_id = ? AND video_id = ?", (playlist_id, video_id)
+                )
+        self._unlink(row[0])
+
+    def prune(self, playlist_id: str, video_ids: Iterable[str]) -> int:
+        """Delete the copies of videos that are no longer in a playlist.
+
+        Args:
+            playlist_id: ID of the playlist.
+            video_ids: IDs of all videos still in the playlist.
+
+        Returns:
+            The number of files deleted.
+        """
+        keep = set(video_ids)
+        with self._lock:
+            gone = [
+                row for row in self._conn.execute(
+                    "SELECT video_id, path FROM files WHERE playlist_id = ?", (playlist_id,)
+                ) if row[0] not in keep
+            ]
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM files WHERE playlist_id = ? AND video_id = ?",
+                    [(playlist_id, video_id) for video_id, _ in gone]
+                )
+        for _, path in gone:
+            self._unlink(path)
+        return len(gone)
+
+    def total_bytes(self) -> int:
+        """Get the size of all mirrored files."""
+        with self._lock:
+            row = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()
+        return row[0]
+
+    def evict(self, protect: Iterable[tuple] = (), max_bytes: Optional[int] = None) -> int:
+        """Delete the least recently used files until the cache fits max_bytes.
+
+        Args:
+            protect: (playlist_id, video_id) pairs that must be kept, e.g.
+                the items about to play.
+            max_bytes: Size to shrink to instead of the configured cap.
+
+        Returns:
+            The number of bytes freed.
+        """
+        protected = set(protect)
+        limit = self.max_bytes if max_bytes is None else max_bytes
+        freed = 0
+        with self._lock:
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM files").fetchone()[0]
+            victims = []
+            for playlist_id, video_id, path, size in self._conn.execute(
+                "SELECT playlist_id, video_id, path, size FROM files ORDER BY last_used"
+            ).fetchall():
+                if total - freed <= limit:
+                    break
+                if (playlist_id, video_id) in protected:
+                    continue
+                victims.append((playlist_id, video_id, path))
+                freed += size
+            with self._conn:
+                self._conn.executemany(
+                    "DELETE FROM files WHERE playlist_id = ? AND video_id = ?",
+                    [(playlist_id, video_id) for playlist_id, video_id, _ in victims]
+                )
+        for _, _, path in victims:
+            self._unlink(path)
+        if victims:
+            get_metrics().inc('sleepy_mirror_evicted_bytes_total', freed)
+            LOGGER.info("Evicted %d mirrored files (%.1f MB)", len(victims), freed / 1024 / 1024)
+        return freed
+
+    def close(self) -> None:
+        """Close the index database."""
+        with self._lock:
+            self._conn.close()
+
+    @staticmethod
+    def _unlink(path: str) -> None:
+        """Delete a mirrored file, ignoring files that are already gone."""
+        try:
+            Path(path).unlink(missing_ok=True)
+            LOGGER.debug("Deleted mirrored file %s", path)
+        except OSError as e:
+            LOGGER.warning("Failed to delete mirrored file %s: %s", path, e)
@@ -1,6 +1,8 @@
 """Data models for SleePy application."""
 
-from dataclasses import dataclass
+import time
+from dataclasses import dataclass, field
+from typing import Optional
 
 
 @dataclass
@@ -15,7 +17,60 @@ class PlaylistConfig:
     download_after_play: bool = False
     delete_on_skip: bool = False
     move_to_asmr_on_dot: bool = False
+    storage_codec: str = 'wav'
+    storage_bitrate: Optional[str] = None
+    shuffle_weighting: Optional[str] = None
+    sleep_timer: Optional[float] = None
+    crossfade: float = 0.0
+    resume: bool = False
     
     def is_local(self) -> bool:
         """Check if this is a local file playlist."""
         return self.id.startswith('./')
+
+
+@dataclass
+class PlaylistItem:
+    """A single cached entry of a YouTube playlist."""
+    item_id: str
+    video_id: str
+    title: str
+    position: int
+
+    @property
+    def url(self) -> str:
+        """Watch URL of the video."""
+        return f"https://www.youtube.com/watch?v={self.video_id}"
+
+
+@dataclass
+class ResolvedTrack:
+    """A playlist item with its metadata and stream URL resolved for playback."""
+    playlist_id: str
+    item: PlaylistItem
+    title: Optional[str] = None
+    stream_url: Optional[str] = None
+    resolved_at: float = field(default_factory=time.time)
+
+
+@dataclass
+class LibraryTrack:
+    """A local audio file with the metadata kept by the media library."""
+    path: str
+    folder: str
+    size: int
+    mtime: float
+    codec: str
+    duration: Optional[float] = None
+    loudness: Optional[float] = None
+    play_count: int = 0
+    last_played: Optional[float] = None
+
+
+@dataclass
+class StorageQuota:
+    """Limits on the size of a local folder."""
+    folder: str
+    max_bytes: Optional[int] = None
+    max_files: Optional[int] = None
+    policy: str = 'lru'
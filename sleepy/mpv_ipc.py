@@ -0,0 +1,351 @@
+"""Long-lived mpv process controlled over its JSON IPC socket."""
+
+import json
+import logging
+import os
+import socket
+import subprocess
+import threading
+import time
+from typing import Any, Dict, Optional, Set
+
+from sleepy.metrics import get_metrics
+
+LOGGER = logging.getLogger(__name__)
+
+
+class MpvIpcBackend:
+    """Keeps one idle mpv instance around and drives it with IPC commands.
+
+    Tracks are loaded with ``loadfile``; every loaded file gets a playlist
+    entry ID which is used to wait for its ``end-file`` event. Appending the
+    next track while the current one plays lets mpv switch over gaplessly.
+    """
+
+    MPV_CMD = 'mpv'
+    SOCKET_PATH = '/tmp/sleepy-mpv.sock'
+    STARTUP_TIMEOUT = 10  # seconds to wait for the IPC socket
+    COMMAND_TIMEOUT = 5   # seconds to wait for a command reply
+
+    def __init__(self, socket_path: str = SOCKET_PATH):
+        self.socket_path = socket_path
+        self._proc: Optional[subprocess.Popen] = None
+        self._sock: Optional[socket.socket] = None
+        self._reader: Optional[threading.Thread] = None
+        self._send_lock = threading.Lock()
+        self._cond = threading.Condition()
+        self._request_id = 0
+        self._replies: Dict[int, Dict] = {}
+        self._entries: Dict[int, str] = {}
+        self._ended: Dict[int, str] = {}
+        self._waiting: Set[int] = set()
+        self._playing_entry: Optional[int] = None
+        self._loaded_at: Dict[int, float] = {}
+
+    def is_running(self) -> bool:
+        """Check if the mpv process is alive and connected."""
+        return self._proc is not None and self._proc.poll() is None and self._sock is not None
+
+    def ensure_running(self) -> bool:
+        """Start mpv if it is not running yet.
+
+        Returns:
+            True if mpv is running and connected, False otherwise.
+        """
+        if self.is_running():
+            return True
+        self.close()
+
+        started = time.perf_counter()
+        try:
+            if os.path.exists(self.socket_path):
+                os.unlink(self.socket_path)
+            self._proc = subprocess.Popen(
+                [
+                    self.MPV_CMD,
+                    '--idle=yes',
+                    '--no-video',
+                    '--no-terminal',
+                    '--gapless-audio=weak',
+                    '--prefetch-playlist=yes',
+                    f'--input-ipc-server={self.socket_path}',
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                preexec_fn=os.setpgrp if hasattr(os, 'setpgrp') else None
+            )
+        except Exception as e:
+            LOGGER.error("Failed to start mpv: %s", e)
+            self._proc = None
+            return False
+
+        deadline = time.monotonic() + self.STARTUP_TIMEOUT
+        while time.monotonic() < deadline and self._proc.poll() is None:
+            try:
+                sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                sock.connect(self.socket_path)
+                self._sock = sock
+                break
+            except OSError:
+                sock.close()
+                time.sleep(0.05)
+
+        if self._sock is None:
+            LOGGER.error("mpv IPC socket did not come up at %s", self.socket_path)
+            self.close()
+            return False
+
+        self._reader = threading.Thread(target=self._read_loop, name='mpv-ipc', daemon=True)
+        self._reader.start()
+        get_metrics().observe('sleepy_call_seconds', time.perf_counter() - started, call='mpv:spawn')
+        LOGGER.info("Started mpv IPC backend (pid %d)", self._proc.pid)
+        return True
+
+    def command(self, *args: Any, timeout: float = COMMAND_TIMEOUT) -> Optional[Dict]:
+        """Send a command and wait for its reply.
+
+        Args:
+            *args: The mpv command and its arguments.
+            timeout: Seconds to wait for the reply.
+
+        Returns:
+            The reply message, or None if mpv is gone or did not answer.
+        """
+        if not self.is_running():
+            return None
+
+        with get_metrics().timer('sleepy_call_seconds', call=f'mpv:{args[0]}'):
+            return self._command(list(args), args[0], timeout)
+
+    def command_named(self, name: str, timeout: float = COMMAND_TIMEOUT, **args: Any) -> Optional[Dict]:
+        """Send a command with named arguments and wait for its reply.
+
+        Named arguments stay valid when mpv inserts new positional ones.
+        """
+        if not self.is_running():
+            return None
+
+        with get_metrics().timer('sleepy_call_seconds', call=f'mpv:{name}'):
+            return self._command({'name': name, **args}, name, timeout)
+
+    def _command(self, command: Any, name: str, timeout: float) -> Optional[Dict]:
+        """Send a command and wait for its reply."""
+        with self._cond:
+            self._request_id += 1
+            request_id = self._request_id
+
+        payload = json.dumps({'command': command, 'request_id': request_id}) + '\n'
+        try:
+            with self._send_lock:
+                self._sock.sendall(payload.encode())
+        except OSError as e:
+            LOGGER.error("Failed to send mpv command %s: %s", name, e)
+            return None
+
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while request_id not in self._replies:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0 or self._sock is None:
+                    LOGGER.warning("No reply from mpv for command %s", name)
+                    return None
+                self._cond.wait(remaining)
+            reply = self._replies.pop(request_id)
+
+        if reply.get('error') != 'success':
+            LOGGER.warning("mpv command %s failed: %s", name, reply.get('error'))
+        return reply
+
+    def loadfile(
+        self, url: str, append: bool = False, record_to: Optional[str] = None, start: float = 0.0
+    ) -> Optional[int]:
+        """Load a file or URL.
+
+        Args:
+            url: What to play.
+            append: Append to the playlist instead of replacing it.
+            record_to: File to write the received stream to while it plays.
+            start: Seconds into the file or stream to start at.
+
+        Returns:
+            The playlist entry ID, or None if loading failed.
+        """
+        flags = 'append' if append else 'replace'
+        # Per-file options, so a queued entry does not record over or seek the playing one
+        options = []
+        if record_to:
+            options.append(f'stream-record=%{len(record_to.encode())}%{record_to}')
+        if start > 0:
+            options.append(f'start={start:.3f}')
+        if options:
+            reply = self.command_named('loadfile', url=url, flags=flags, options=','.join(options))
+        else:
+            reply = self.command('loadfile', url, flags)
+        if not reply or reply.get('error') != 'success':
+            return None
+
+        entry_id = (reply.get('data') or {}).get('playlist_entry_id')
+        if entry_id is None:
+            LOGGER.error("mpv did not return a playlist entry ID (mpv >= 0.33 is required)")
+            return None
+
+        with self._cond:
+            if not append:
+                self._loaded_at[entry_id] = time.perf_counter()
+                # Replacing drops every other entry from mpv's playlist
+                self._entries = {
+                    other_id: other_url for other_id, other_url in self._entries.items()
+                    if other_id == self._playing_entry
+                }
+            self._entries[entry_id] = url
+        LOGGER.debug("mpv loaded entry %d (%s): %s", entry_id, 'append' if append else 'replace', url)
+        return entry_id
+
+    def attach(self, url: str, timeout: float = 1.0) -> Optional[int]:
+        """Get the entry ID of the playing entry if it is playing the given URL.
+
+        If the URL is queued but mpv has not switched to it yet, waits up to
+        timeout seconds for the switch.
+        """
+        def is_playing() -> bool:
+            return self._playing_entry is not None and self._entries.get(self._playing_entry) == url
+
+        with self._cond:
+            if url in self._entries.values():
+                self._cond.wait_for(lambda: is_playing() or self._sock is None, timeout)
+            if is_playing():
+                return self._playing_entry
+        return None
+
+    def time_pos(self, entry_id: int) -> Optional[float]:
+        """Get the playback position of an entry in seconds, or None if it is not playing."""
+        if self._playing_entry != entry_id:
+            return None
+        reply = self.command('get_property', 'time-pos')
+        if not reply or reply.get('error') != 'success' or self._playing_entry != entry_id:
+            return None
+        return reply.get('data')
+
+    def wait_for_end(self, entry_id: int, timeout: float) -> Optional[str]:
+        """Wait until a playlist entry has finished.
+
+        Args:
+            entry_id: The playlist entry ID returned by loadfile.
+            timeout: Seconds to wait.
+
+        Returns:
+            The end-file reason (e.g. 'eof', 'stop', 'error'), or None if
+            the entry is still playing.
+        """
+        with self._cond:
+            self._waiting.add(entry_id)
+            try:
+                self._cond.wait_for(lambda: entry_id in self._ended or self._sock is None, timeout)
+            finally:
+                self._waiting.discard(entry_id)
+            if entry_id in self._ended:
+                return self._ended.pop(entry_id)
+            if self._sock is None:
+                return 'quit'
+        return None
+
+    def set_gain(self, gain_db: float) -> bool:
+        """Set the replay gain applied on top of the volume, in dB.
+
+        Uses the volume-gain property (mpv >= 0.36), so the volume itself
+        stays free for the user and for fades.
+        """
+        reply = self.command('set_property', 'volume-gain', round(gain_db, 2))
+        return bool(reply) and reply.get('error') == 'success'
+
+    def stop(self) -> None:
+        """Stop playback and clear the playlist."""
+        if self.is_running():
+            self.command('stop')
+        with self._cond:
+            self._entries = {
+                entry_id: url for entry_id, url in self._entries.items()
+                if entry_id == self._playing_entry
+            }
+            # Nobody is going to ask for the other reasons anymore
+            self._ended = {
+                entry_id: reason for entry_id, reason in self._ended.items()
+                if entry_id in self._waiting
+            }
+
+    def close(self) -> None:
+        """Terminate mpv and release the socket."""
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        with self._cond:
+            self._sock = None
+            self._playing_entry = None
+            self._ended.clear()
+            self._cond.notify_all()
+
+        if self._proc is not None and self._proc.poll() is None:
+            self._proc.terminate()
+            try:
+                self._proc.wait(timeout=5)
+            except subprocess.TimeoutExpired:
+                LOGGER.warning("mpv did not terminate, killing.")
+                self._proc.kill()
+        self._proc = None
+
+    def _read_loop(self) -> None:
+        """Read replies and events from the IPC socket."""
+        sock = self._sock
+        buffer = b''
+        try:
+            while True:
+                chunk = sock.recv(4096)
+                if not chunk:
+                    break
+                buffer += chunk
+                *lines, buffer = buffer.split(b'\n')
+                for line in lines:
+                    if not line.strip():
+                        continue
+                    try:
+                        message = json.loads(line)
+                    except ValueError as e:
+                        # One garbled line must not look like mpv quitting
+                        LOGGER.warning("Ignoring undecodable mpv IPC message %r: %s", line[:200], e)
+                        continue
+                    self._handle_message(message)
+        except OSError as e:
+            LOGGER.debug("mpv IPC reader stopped: %s", e)
+
+        LOGGER.info("mpv IPC connection closed")
+        with self._cond:
+            if self._sock is sock:
+                self._sock = None
+            self._cond.notify_all()
+
+    def _handle_message(self, message: Dict) -> None:
+        """Dispatch a single IPC message."""
+        with self._cond:
+            if 'request_id' in message and 'event' not in message:
+                self._replies[message['request_id']] = message
+            elif message.get('event') == 'start-file':
+                self._playing_entry = message.get('playlist_entry_id')
+            elif message.get('event') == 'playback-restart':
+                # Audio is flowing; queued entries start without a wait, so only loads are timed
+                loaded_at = self._loaded_at.pop(self._playing_entry, None)
+                if loaded_at is not None:
+                    get_metrics().observe(
+                        'sleepy_first_audio_seconds', time.perf_counter() - loaded_at, backend='mpv'
+                    )
+            elif message.get('event') == 'end-file':
+                entry_id = message.get('playlist_entry_id')
+                self._ended[entry_id] = message.get('reason', 'unknown')
+                self._entries.pop(entry_id, None)
+                self._loaded_at.pop(entry_id, None)
+                if self._playing_entry == entry_id:
+                    self._playing_entry = None
+                LOGGER.debug("mpv entry %s ended: %s", entry_id, self._ended[entry_id])
+            self._cond.notify_all()
@@ -0,0 +1,635 @@
+"""Gapless playback of local WAV files through one persistent output."""
+
+import fcntl
+import logging
+import math
+import mmap
+import os
+import struct
+import subprocess
+import threading
+import time
+from typing import List, Optional, Tuple
+
+try:
+    import alsaaudio
+except ImportError:
+    alsaaudio = None
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from sleepy.metrics import get_metrics
+
+LOGGER = logging.getLogger(__name__)
+
+WAVE_FORMAT_PCM = 0x0001
+WAVE_FORMAT_EXTENSIBLE = 0xFFFE
+
+# Sample formats by sample width in bytes, for ALSA and for aplay
+ALSA_FORMATS = {
+    1: 'PCM_FORMAT_U8',
+    2: 'PCM_FORMAT_S16_LE',
+    3: 'PCM_FORMAT_S24_3LE',
+    4: 'PCM_FORMAT_S32_LE',
+}
+APLAY_FORMATS = {
+    1: 'U8',
+    2: 'S16_LE',
+    3: 'S24_3LE',
+    4: 'S32_LE',
+}
+
+# Sample widths numpy can scale and mix
+MIXABLE_DTYPES = {
+    2: '<i2',
+    4: '<i4',
+}
+
+
+class PcmFile:
+    """A PCM WAV file mapped into memory.
+
+    Only the RIFF header is parsed, the samples are read straight from the
+    page cache, so opening a multi-hour file costs no more than a short one.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._fd = os.open(path, os.O_RDONLY)
+        try:
+            self._map = mmap.mmap(self._fd, 0, access=mmap.ACCESS_READ)
+        except (OSError, ValueError):
+            os.close(self._fd)
+            raise
+        try:
+            self.channels, self.sample_width, self.rate, self.data_offset, self.data_size = self._parse()
+        except Exception:
+            self.close()
+            raise
+        self.advise(0, 0, 'POSIX_FADV_SEQUENTIAL')
+
+    @classmethod
+    def open(cls, path: str) -> Optional['PcmFile']:
+        """Map a file if it is an uncompressed PCM WAV.
+
+        Returns:
+            The mapped file, or None if it cannot be played as raw PCM.
+        """
+        try:
+            return cls(path)
+        except (OSError, ValueError, struct.error) as e:
+            LOGGER.debug("Not playing %s as PCM: %s", path, e)
+            return None
+
+    @property
+    def frame_size(self) -> int:
+        return self.channels * self.sample_width
+
+    @property
+    def byte_rate(self) -> int:
+        return self.rate * self.frame_size
+
+    @property
+    def duration(self) -> float:
+        return self.data_size / self.byte_rate
+
+    @property
+    def params(self) -> Tuple[int, int, int]:
+        return self.channels, self.sample_width, self.rate
+
+    def offset_of(self, seconds: float) -> int:
+        """Get the byte offset of a time in the data chunk, at a frame boundary."""
+        frames = int(max(0.0, seconds) * self.rate)
+        return min(frames * self.frame_size, self.data_size)
+
+    def read(self, offset: int, size: int) -> bytes:
+        """Read samples, offset and size in bytes from the start of the data chunk."""
+        start = self.data_offset + offset
+        return self._map[start:start + min(size, self.data_size - offset)]
+
+    def advise(self, offset: int, length: int, advice: str) -> None:
+        """Pass an access hint for a range of the data chunk to the kernel, if it supports it."""
+        if hasattr(os, 'posix_fadvise') and hasattr(os, advice):
+            try:
+                os.posix_fadvise(self._fd, self.data_offset + offset, length, getattr(os, advice))
+            except OSError as e:
+                LOGGER.debug("posix_fadvise failed for %s: %s", self.path, e)
+
+    def release(self, offset: int) -> None:
+        """Drop the pages of the data chunk before an offset from memory and the page cache."""
+        end = (self.data_offset + offset) // mmap.PAGESIZE * mmap.PAGESIZE
+        if end <= 0:
+            return
+        if hasattr(self._map, 'madvise') and hasattr(mmap, 'MADV_DONTNEED'):
+            try:
+                self._map.madvise(mmap.MADV_DONTNEED, 0, end)
+            except OSError as e:
+                LOGGER.debug("madvise failed for %s: %s", self.path, e)
+        self.advise(-self.data_offset, end, 'POSIX_FADV_DONTNEED')
+
+    def close(self) -> None:
+        """Unmap the file."""
+        if not self._map.closed:
+            self._map.close()
+        if self._fd >= 0:
+            os.close(self._fd)
+            self._fd = -1
+
+    def _parse(self) -> Tuple[int, int, int, int, int]:
+        """Find the format and the data chunk of the RIFF file.
+
+        Returns:
+            Channels, sample width, rate, offset and size of the data chunk.
+        """
+        data = self._map
+        riff, _, wave = struct.unpack_from('<4sI4s', data, 0)
+        if riff != b'RIFF' or wave != b'WAVE':
+            raise ValueError("not a RIFF WAVE file")
+
+        fmt = None
+        offset = 12
+        while offset + 8 <= len(data):
+            chunk_id, size = struct.unpack_from('<4sI', data, offset)
+            body = offset + 8
+            if chunk_id == b'fmt ':
+                fmt = struct.unpack_from('<HHIIHH', data, body)
+                if fmt[0] == WAVE_FORMAT_EXTENSIBLE and size >= 26:
+                    # The actual format is the first field of the sub-format GUID
+                    fmt = (struct.unpack_from('<H', data, body + 24)[0],) + fmt[1:]
+            elif chunk_id == b'data':
+                if fmt is None:
+                    raise ValueError("data chunk before fmt chunk")
+                audio_format, channels, rate, _, block_align, bits = fmt
+                width = (bits + 7) // 8
+                if audio_format != WAVE_FORMAT_PCM or width not in ALSA_FORMATS or not channels or not rate:
+                    raise ValueError(f"unsupported format {audio_format}, {bits} bits")
+                if block_align != channels * width:
+                    raise ValueError(f"unsupported block alignment {block_align}")
+                # Files cut off during a copy announce more data than they hold
+                size = min(size, len(data) - body)
+                return channels, width, rate, body, size - size % block_align
+            offset = body + size + size % 2
+        raise ValueError("no data chunk")
+
+
+class PlaybackHandle:
+    """Handle to a file that was handed to the pipeline."""
+
+    def __init__(self, source: PcmFile, gain_db: float = 0.0, crossfade: float = 0.0, start: float = 0.0):
+        self.source = source
+        self.path = source.path
+        self.gain_db = gain_db
+        self.crossfade = crossfade
+        # Bytes of the data chunk written to the output; seeking is setting it
+        self.start_offset = source.offset_of(start)
+        self.offset = self.start_offset
+        self.due = 0.0   # when the output will have played the written samples
+        self.loaded_at: Optional[float] = None
+        self.cancelled = False
+        self.started = threading.Event()
+        self.written = threading.Event()
+        self.ends_at = float('inf')
+
+    @property
+    def position(self) -> float:
+        """Seconds of the file that have been played."""
+        return max(0.0, self.offset / self.source.byte_rate - max(0.0, self.due - time.monotonic()))
+
+    def finished(self) -> bool:
+        """Check whether the file has been fully played or cancelled."""
+        return self.written.is_set() and (self.cancelled or time.monotonic() >= self.ends_at)
+
+    def wait(self) -> None:
+        """Block until the file has been played."""
+        self.written.wait()
+        if not self.cancelled:
+            time.sleep(max(0.0, self.ends_at - time.monotonic()))
+
+    def cancel(self) -> None:
+        """Stop the file at the next chunk boundary."""
+        self.cancelled = True
+
+
+class LocalPipeline:
+    """Streams local WAV files from memory-mapped reads into one persistent output.
+
+    A single writer thread keeps the output open across tracks: an ALSA
+    PCM if pyalsaaudio is installed, otherwise one ``aplay`` reading raw
+    samples from a pipe. The file queued behind the current one is mapped
+    and its first megabytes are read into the page cache while the current
+    one plays, and its samples follow the last ones of the current file
+    without a gap, or overlapping by the crossfade of the queued file.
+    Pages that have been played are dropped again, so multi-hour files do
+    not push everything else out of the page cache.
+
+    Gain and crossfades are computed with numpy, on 16 and 32 bit files.
+    """
+
+    DEVICE = 'default'
+    APLAY_CMD = 'aplay'
+    CHUNK_SECONDS = 0.05  # audio per write, also how long a stop can take
+    READ_AHEAD_BYTES = 8 * 1024 * 1024
+    IDLE_CLOSE = 5.0  # seconds without a file before the output is closed
+    STOP_TIMEOUT = 2.0
+
+    def __init__(self, device: str = DEVICE):
+        self.device = device
+        self._cond = threading.Condition()
+        self._current: Optional[PlaybackHandle] = None
+        self._next: Optional[PlaybackHandle] = None
+        # Written completely, but the output may still be playing it
+        self._tail: Optional[PlaybackHandle] = None
+        self._dropped: List[PlaybackHandle] = []
+        self._closing = False
+        self._thread: Optional[threading.Thread] = None
+        self._pcm = None
+        self._proc: Optional[subprocess.Popen] = None
+        self._params: Optional[Tuple[int, int, int]] = None
+        self._clock = 0.0  # when the output will have played everything written to it
+
+    def play(self, path: str, gain_db: float = 0.0, start: float = 0.0) -> Optional[PlaybackHandle]:
+        """Play a file now, dropping the current and the queued one.
+
+        Args:
+            path: The WAV file.
+            gain_db: Gain to apply to the samples.
+            start: Seconds into the file to start at.
+
+        Returns:
+            A handle to wait on, or None if the file cannot be played by
+            the pipeline, e.g. because it is compressed.
+        """
+        handle = self._load(path, gain_db, start=start)
+        if handle is None:
+            return None
+        handle.source.advise(handle.offset, self.READ_AHEAD_BYTES, 'POSIX_FADV_WILLNEED')
+        handle.loaded_at = time.perf_counter()
+
+        if self._thread is None or not self._thread.is_alive():
+            self._closing = False
+            self._thread = threading.Thread(target=self._output_loop, name='pipeline', daemon=True)
+            self._thread.start()
+
+        with self._cond:
+            self._drop_locked()
+            self._current = handle
+            self._cond.notify_all()
+        return handle
+
+    def queue(self, path: str, gain_db: float = 0.0, crossfade: float = 0.0, start: float = 0.0) -> bool:
+        """Play a file after the current one and start reading it into the page cache.
+
+        Args:
+            path: The WAV file.
+            gain_db: Gain to apply to the samples.
+            crossfade: Seconds to overlap the end of the current file with
+                the start of this one, 0 for a gapless switch.
+            start: Seconds into the file to start at.
+
+        Returns:
+            True if the file was queued, False if nothing is playing or the
+            file cannot be played by the pipeline.
+        """
+        with self._cond:
+            if not self._is_busy_locked():
+                return False
+        handle = self._load(path, gain_db, crossfade, start)
+        if handle is None:
+            return False
+        handle.source.advise(handle.offset, self.READ_AHEAD_BYTES, 'POSIX_FADV_WILLNEED')
+
+        with self._cond:
+            if not self._is_busy_locked():
+                self._dropped.append(handle)
+                self._cond.notify_all()
+                return False
+            if self._current is None:
+                # The output still plays the tail, its samples follow right behind
+                self._current = handle
+                self._cond.notify_all()
+                LOGGER.debug("Queued %s behind %s", path, self._tail.path)
+                return True
+            if self._next is not None:
+                if self._next.started.is_set():
+                    # Already fading in, the fade cannot be taken back
+                    self._dropped.append(handle)
+                    self._cond.notify_all()
+                    return False
+                self._next.cancel()
+                self._dropped.append(self._next)
+            self._next = handle
+            self._cond.notify_all()
+        LOGGER.debug("Queued %s behind %s", path, self._current.path)
+        return True
+
+    def attach(self, path: str, timeout: float = 1.0) -> Optional[PlaybackHandle]:
+        """Get the handle of the file the output is playing if it is the given one.
+
+        If the file is queued but the pipeline has not switched to it yet,
+        waits up to timeout seconds for the switch.
+        """
+        def playing() -> Optional[PlaybackHandle]:
+            for handle in (self._tail, self._current):
+                if handle is not None and handle.path == path and not handle.finished():
+                    return handle
+            return None
+
+        with self._cond:
+            if self._next is not None and self._next.path == path:
+                self._cond.wait_for(lambda: playing() or self._next is None, timeout)
+            return playing()
+
+    def stop(self) -> None:
+        """Stop playback and drop the queued file, blocking until the output is silent."""
+        with self._cond:
+            handles = [handle for handle in (self._tail, self._current, self._next) if handle is not None]
+            self._drop_locked()
+            self._cond.notify_all()
+        for handle in handles:
+            if not handle.written.wait(self.STOP_TIMEOUT):
+                LOGGER.warning("Pipeline did not stop %s in time", handle.path)
+
+    def close(self) -> None:
+        """Stop the writer thread and close the output."""
+        with self._cond:
+            self._drop_locked()
+            self._closing = True
+            self._cond.notify_all()
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout=self.STOP_TIMEOUT)
+        self._thread = None
+
+    def _load(
+        self, path: str, gain_db: float, crossfade: float = 0.0, start: float = 0.0
+    ) -> Optional[PlaybackHandle]:
+        """Map a file for playback if the pipeline can play it at the given gain."""
+        source = PcmFile.open(path)
+        if source is None:
+            return None
+        if gain_db and (numpy is None or source.sample_width not in MIXABLE_DTYPES):
+            LOGGER.debug("Cannot apply gain to %s in the pipeline", path)
+            source.close()
+            return None
+        return PlaybackHandle(source, gain_db, crossfade, start)
+
+    def _is_busy_locked(self) -> bool:
+        """Check whether the output has something to play. Called with the lock held."""
+        if self._current is not None:
+            return not self._current.cancelled
+        return self._tail is not None and not self._tail.finished()
+
+    def _drop_locked(self) -> None:
+        """Cancel the playing and the queued files; the writer releases them. Called with the lock held."""
+        if self._tail is not None and not self._tail.finished():
+            self._tail.cancel()
+            self._dropped.append(self._tail)
+        for handle in (self._current, self._next):
+            if handle is not None:
+                handle.cancel()
+                self._dropped.append(handle)
+        self._tail = None
+        self._current = None
+        self._next = None
+
+    def _output_loop(self) -> None:
+        """Write the current file to the output, chunk by chunk."""
+        while True:
+            with self._cond:
+                if self._current is None and not self._dropped and not self._closing:
+                    if not self._cond.wait_for(
+                        lambda: self._current is not None or self._dropped or self._closing, self.IDLE_CLOSE
+                    ):
+                        self._close_output()
+                        continue
+                dropped, self._dropped = self._dropped, []
+                handle, following = self._current, self._next
+                closing = self._closing
+
+            if any(old.started.is_set() for old in dropped):
+                # Cut off the buffered rest of a stopped file
+                self._close_output()
+            for old in dropped:
+                self._release(old)
+            if closing:
+                break
+            if handle is None:
+                continue
+
+            try:
+                self._write_chunk(handle, following)
+            except Exception as e:
+                LOGGER.error("Failed to play %s: %s", handle.path, e)
+                self._close_output()
+                with self._cond:
+                    if self._current is handle:
+                        self._drop_locked()
+
+        self._close_output()
+
+    def _write_chunk(self, handle: PlaybackHandle, following: Optional[PlaybackHandle]) -> None:
+        """Write the next chunk of a file, mixed with the start of the following one in a crossfade."""
+        source = handle.source
+        step = self._chunk_frames(source.rate) * source.frame_size
+        remaining = source.data_size - handle.offset
+        fade = self._fade_bytes(handle, following)
+        if remaining > fade:
+            size = min(step, remaining - fade)
+            data = self._apply_gain(source.read(handle.offset, size), source, handle.gain_db)
+            mixed = None
+        else:
+            size = min(step, remaining)
+            mixed = following
+            done = fade - remaining
+            data = self._crossfade(
+                source.read(handle.offset, size), handle.gain_db,
+                mixed.source.read(mixed.offset, size), mixed.gain_db,
+                source, done / fade, (done + size) / fade
+            )
+            if not mixed.started.is_set():
+                LOGGER.info("Crossfading into %s over %.1f s", mixed.path, fade / source.byte_rate)
+                get_metrics().inc('sleepy_pipeline_transitions_total', kind='crossfade')
+                mixed.started.set()
+
+        self._write(handle, data)
+        if not handle.started.is_set():
+            handle.started.set()
+            if handle.loaded_at is not None:
+                get_metrics().observe(
+                    'sleepy_first_audio_seconds', time.perf_counter() - handle.loaded_at, backend='pipeline'
+                )
+            else:
+                get_metrics().inc('sleepy_pipeline_transitions_total', kind='gapless')
+
+        handle.offset += size
+        handle.due = self._clock
+        if mixed is not None:
+            mixed.offset += size
+            mixed.due = self._clock
+        self._read_ahead(handle, size)
+        if handle.offset >= source.data_size:
+            self._advance(handle)
+
+    def _advance(self, handle: PlaybackHandle) -> None:
+        """Switch from a file that has been written completely to the queued one."""
+        with self._cond:
+            if self._current is not handle:
+                return
+            self._current, self._next = self._next, None
+            self._tail = handle
+            handle.ends_at = self._clock
+            following = self._current
+            self._cond.notify_all()
+        if following is not None and following.source.params != handle.source.params:
+            # The output has to be reopened for the new format, let it finish first
+            time.sleep(max(0.0, self._clock - time.monotonic()))
+        self._release(handle)
+        if following is not None:
+            LOGGER.debug("Pipeline switched to %s", following.path)
+
+    def _fade_bytes(self, handle: PlaybackHandle, following: Optional[PlaybackHandle]) -> int:
+        """Get the length of the crossfade into the following file, 0 for none."""
+        if (following is None or following.crossfade <= 0 or following.cancelled or numpy is None
+                or following.source.params != handle.source.params
+                or handle.source.sample_width not in MIXABLE_DTYPES):
+            return 0
+        source = handle.source
+        # At most half of what is played of either file, so short tracks still get a body
+        fade = min(
+            int(following.crossfade * source.byte_rate),
+            (source.data_size - handle.start_offset) // 2,
+            (following.source.data_size - following.start_offset) // 2
+        )
+        return fade - fade % source.frame_size
+
+    def _chunk_frames(self, rate: int) -> int:
+        """Get the number of frames written at once."""
+        return max(256, int(rate * self.CHUNK_SECONDS))
+
+    def _read_ahead(self, handle: PlaybackHandle, size: int) -> None:
+        """Keep the page cache warm ahead of the play position and drop what has been played."""
+        window = self.READ_AHEAD_BYTES // 2
+        if handle.offset // window == (handle.offset - size) // window:
+            return
+        handle.source.advise(handle.offset, self.READ_AHEAD_BYTES, 'POSIX_FADV_WILLNEED')
+        handle.source.release(handle.offset - window)
+
+    def _release(self, handle: PlaybackHandle) -> None:
+        """Unmap a file the writer is done with."""
+        handle.source.close()
+        handle.written.set()
+
+    def _apply_gain(self, data: bytes, source: PcmFile, gain_db: float) -> bytes:
+        """Scale samples by a gain in dB."""
+        if not gain_db:
+            return data
+        return self._to_bytes(self._samples(data, source) * 10 ** (gain_db / 20), source)
+
+    def _crossfade(
+        self, data: bytes, gain_db: float, following: bytes, following_gain_db: float,
+        source: PcmFile, start: float, end: float
+    ) -> bytes:
+        """Mix two chunks with equal-power gain curves, start and end being the progress of the fade."""
+        frames = len(data) // source.frame_size
+        progress = numpy.linspace(start, end, frames, endpoint=False)[:, None] * (math.pi / 2)
+        mixed = (
+            self._samples(data, source) * (10 ** (gain_db / 20)) * numpy.cos(progress)
+            + self._samples(following, source) * (10 ** (following_gain_db / 20)) * numpy.sin(progress)
+        )
+        return self._to_bytes(mixed, source)
+
+    @staticmethod
+    def _samples(data: bytes, source: PcmFile):
+        """Get samples as a float array with one column per channel."""
+        return numpy.frombuffer(data, MIXABLE_DTYPES[source.sample_width]).astype(numpy.float64).reshape(
+            -1, source.channels
+        )
+
+    @staticmethod
+    def _to_bytes(samples, source: PcmFile) -> bytes:
+        """Convert float samples back to the sample format of a file, clipping them."""
+        dtype = numpy.dtype(MIXABLE_DTYPES[source.sample_width])
+        info = numpy.iinfo(dtype)
+        return numpy.clip(numpy.rint(samples), info.min, info.max).astype(dtype).tobytes()
+
+    def _write(self, handle: PlaybackHandle, data: bytes) -> None:
+        """Write samples of a file to the output, opening it for their format if needed."""
+        params = handle.source.params
+        if self._params != params:
+            self._close_output()
+            self._open_output(params)
+        if self._pcm is not None:
+            self._pcm.write(data)
+        else:
+            # Page by page, as the pipe frees them, so a stop does not wait for a whole chunk
+            view = memoryview(data)
+            while view and not handle.cancelled:
+                view = view[self._proc.stdin.write(view[:mmap.PAGESIZE]):]
+        channels, width, rate = params
+        self._clock = max(self._clock, time.monotonic()) + len(data) / (channels * width * rate)
+
+    def _open_output(self, params: Tuple[int, int, int]) -> None:
+        """Open the ALSA device, or start aplay reading raw samples from a pipe."""
+        channels, width, rate = params
+        started = time.perf_counter()
+        if alsaaudio is not None:
+            self._pcm = alsaaudio.PCM(
+                type=alsaaudio.PCM_PLAYBACK,
+                mode=alsaaudio.PCM_NORMAL,
+                device=self.device,
+                channels=channels,
+                rate=rate,
+                format=getattr(alsaaudio, ALSA_FORMATS[width]),
+                periodsize=self._chunk_frames(rate),
+            )
+            call = 'alsa:open'
+        else:
+            self._proc = subprocess.Popen(
+                [
+                    self.APLAY_CMD, '-q', '-t', 'raw',
+                    '-f', APLAY_FORMATS[width], '-c', str(channels), '-r', str(rate), '-',
+                ],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.DEVNULL,
+                bufsize=0,
+                start_new_session=True
+            )
+            if hasattr(fcntl, 'F_SETPIPE_SZ'):
+                # A short pipe keeps the play position close to what was written; the
+                # kernel frees pipe space a page at a time, so it needs a few of them
+                pipe_size = max(2 * self._chunk_frames(rate) * channels * width, 4 * mmap.PAGESIZE)
+                try:
+                    fcntl.fcntl(self._proc.stdin, fcntl.F_SETPIPE_SZ, pipe_size)
+                except OSError as e:
+                    LOGGER.debug("Failed to shrink the aplay pipe: %s", e)
+            call = 'aplay:spawn'
+        get_metrics().observe('sleepy_call_seconds', time.perf_counter() - started, call=call)
+        self._params = params
+        LOGGER.debug("Opened pipeline output for %s", params)
+
+    def _close_output(self) -> None:
+        """Close the output, dropping whatever it has not played yet."""
+        if self._pcm is not None:
+            try:
+                self._pcm.close()
+            except Exception as e:
+                LOGGER.debug("Failed to close ALSA device: %s", e)
+            self._pcm = None
+        if self._proc is not None:
+            if self._proc.poll() is None:
+                self._proc.terminate()
+                try:
+                    self._proc.wait(timeout=self.STOP_TIMEOUT)
+                except subprocess.TimeoutExpired:
+                    LOGGER.warning("aplay did not terminate, killing.")
+                    self._proc.kill()
+            try:
+                self._proc.stdin.close()
+            except OSError:
+                pass
+            self._proc = None
+        self._params = None
+        self._clock = 0.0
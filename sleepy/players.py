@@ -1,14 +1,25 @@
 """Content player implementations."""
 
+import asyncio
 import logging
-import random
+import threading
+import time
 from abc import ABC, abstractmethod
 from pathlib import Path
-from typing import Optional
+from typing import Dict, List, Optional, Set
 
 from sleepy.audio import AudioPlayer
-from sleepy.constants import SPECIAL_KEYS, NON_TERMINATING_KEYS, SPECIAL_ACTIONS, Action
-from sleepy.models import PlaylistConfig
+from sleepy.capture import StreamCapture, stream_duration
+from sleepy.constants import SPECIAL_KEYS, NON_TERMINATING_KEYS, SPECIAL_ACTIONS, FAILED_KEY, Action
+from sleepy.delete_queue import DeleteQueue
+from sleepy.library import MediaLibrary
+from sleepy.loudness import gain_db
+from sleepy.metrics import get_metrics
+from sleepy.mirror import PlaylistMirror
+from sleepy.models import LibraryTrack, PlaylistConfig, PlaylistItem, ResolvedTrack
+from sleepy.playlist_cache import PlaylistCache
+from sleepy.prefetch import TrackPrefetcher, resolve_stream_url
+from sleepy.scheduler import ShuffleScheduler
 from sleepy.state import StateContainer
 
 LOGGER = logging.getLogger(__name__)
@@ -19,10 +30,9 @@ class ContentPlayer(ABC):
     
     def __init__(self, audio_player: AudioPlayer):
         self.audio_player = audio_player
-        self.current_index = 0
     
     @abstractmethod
-    def play(self, state: StateContainer) -> str:
+    async def play(self, state: StateContainer) -> str:
         """Play content from playlist.
         
         Args:
@@ -32,114 +42,409 @@ class ContentPlayer(ABC):
             a the special key pressed, or empty string if completed normally.
         """
         raise NotImplementedError
+    
+    def _resume_position(self, playlist: PlaylistConfig, key: str) -> float:
+        """Get the seconds to start a track at: where it was stopped last time, if the playlist resumes tracks."""
+        positions = self.audio_player.positions
+        if not playlist.resume or positions is None:
+            return 0.0
+        return positions.get(key) or 0.0
+    
+    def _set_resume(self, state: StateContainer, playlist: PlaylistConfig, key: str) -> None:
+        """Set the position key and start position of the track about to play."""
+        state.current_position_key = key if playlist.resume else None
+        state.current_start = self._resume_position(playlist, key)
+        if state.current_start:
+            LOGGER.info("Resuming at %.0f s", state.current_start)
 
 
 class YouTubePlayer(ContentPlayer):
     """Plays content from YouTube playlists."""
     
-    def __init__(self, audio_player: AudioPlayer, youtube_auth):
+    MAX_FAILURES = 3  # failed plays in a row after which an item is dropped, e.g. a private video
+    
+    def __init__(
+        self,
+        audio_player: AudioPlayer,
+        youtube_auth,
+        playlist_cache: Optional[PlaylistCache] = None,
+        scheduler: Optional[ShuffleScheduler] = None,
+        delete_queue: Optional[DeleteQueue] = None,
+        mirror: Optional[PlaylistMirror] = None,
+        capture: Optional[StreamCapture] = None
+    ):
         super().__init__(audio_player)
         self.youtube_auth = youtube_auth
+        self.playlist_cache = playlist_cache or PlaylistCache()
+        self.scheduler = scheduler or ShuffleScheduler()
+        self.delete_queue = delete_queue or DeleteQueue(youtube_auth)
+        self.mirror = mirror or PlaylistMirror()
+        self.capture = capture
+        self.prefetcher = TrackPrefetcher()
+        self._streaming_lock = threading.Lock()
+        self._streaming_item_id: Optional[str] = None
+        self._synced_playlists: Set[str] = set()
+        self._failures: Dict[str, int] = {}
     
-    def play(self, state: StateContainer) -> str:
+    async def play(self, state: StateContainer) -> str:
         """Play a YouTube video from the playlist."""
-        # Get the count of items in the playlist
-        item_count = self.youtube_auth.get_playlist_item_count(state.selected_playlist.id)
+        playlist = state.selected_playlist
+        metrics = get_metrics()
+        with metrics.timer('sleepy_track_phase_seconds', player='youtube', phase='sync'):
+            await self._sync_playlist(playlist.id)
         
-        if not item_count or item_count == 0:
-            LOGGER.warning("Playlist is empty")
-            self.audio_player.play_sound("error.wav")
+        with metrics.timer('sleepy_track_phase_seconds', player='youtube', phase='lookup'):
+            # Use the track prefetched during the previous one, if still valid
+            track = await self._take_prefetched(playlist)
+            metrics.inc('sleepy_prefetch_total', result='hit' if track else 'miss')
+            if not track:
+                track = await asyncio.to_thread(self._resolve_track, playlist)
+            if track and not track.stream_url:
+                track.stream_url = self.mirror.lookup(playlist.id, track.item.video_id)
+        if not track:
+            await self.audio_player.play_sound_async("error.wav")
             return ""
         
-        # Choose the index (first or random)
-        idx = self._get_index(item_count, state.selected_playlist.randomize)
+        item = track.item
+        state.current_video_url = item.url
+        state.current_stream_url = track.stream_url
+        state.current_gain_db = 0.0
+        self._set_resume(state, playlist, self._position_key(item))
+        state.current_capture_file = self._capture_file(track, state.current_start)
+        
+        # Resolve the following track while this one plays and, unless the
+        # playlist stops after this track, queue it in mpv for a gapless switch
+        self.prefetcher.schedule(
+            playlist.id,
+            lambda: self._resolve_track(
+                playlist,
+                exclude=item if playlist.delete_after_play else None,
+                resolve_stream=True,
+                advance=False
+            ),
+            None if playlist.shutdown_after_play else lambda next_track: self._queue_next(playlist, item, next_track)
+        )
         
-        # Fetch only the specific item at this index
-        item = self.youtube_auth.get_playlist_item_by_index(state.selected_playlist.id, idx)
+        LOGGER.info("Now playing item %d: %s (%s)", item.position, track.title, item.video_id)
+        with self._streaming_lock:
+            self._streaming_item_id = item.item_id
+        try:
+            with metrics.timer('sleepy_track_phase_seconds', player='youtube', phase='play'):
+                pressed_key = await self.audio_player.stream_video_sound_cancellable(
+                    state, SPECIAL_KEYS, NON_TERMINATING_KEYS
+                )
+        finally:
+            with self._streaming_lock:
+                self._streaming_item_id = None
         
+        with metrics.timer('sleepy_track_phase_seconds', player='youtube', phase='post_play'):
+            if state.current_capture_file:
+                # Only a track that played to its end was recorded completely
+                if pressed_key == "":
+                    await asyncio.to_thread(
+                        self.capture.finish, state.current_capture_file, stream_duration(track.stream_url)
+                    )
+                else:
+                    self.capture.discard(state.current_capture_file)
+            if playlist.randomize:
+                self.scheduler.record_play(playlist.id, item.item_id)
+            
+            # Handle post-play actions
+            if pressed_key == FAILED_KEY:
+                self._record_failure(playlist, item)
+            elif pressed_key == "":
+                self._failures.pop(item.item_id, None)
+            if (pressed_key == "" or SPECIAL_ACTIONS.get(pressed_key) == Action.SKIP_DELETE) and playlist.delete_after_play:
+                self.delete_queue.enqueue(item.item_id)
+                self.playlist_cache.remove_item(playlist.id, item.item_id)
+                self.mirror.remove(playlist.id, item.video_id)
+
+        return pressed_key
+    
+    def _record_failure(self, playlist: PlaylistConfig, item: PlaylistItem) -> None:
+        """Count a failed play of an item and drop the item after MAX_FAILURES in a row.
+        
+        Without this an unplayable item at the head of an ordered playlist
+        would be picked again forever. A delete_after_play playlist deletes
+        it like a played item, any other playlist skips it until the next
+        sync of the playlist index.
+        """
+        failures = self._failures.get(item.item_id, 0) + 1
+        if failures < self.MAX_FAILURES:
+            self._failures[item.item_id] = failures
+            LOGGER.warning("Item %s failed to play (%d/%d)", item.video_id, failures, self.MAX_FAILURES)
+            return
+        
+        self._failures.pop(item.item_id, None)
+        if playlist.delete_after_play:
+            LOGGER.error("Item %s failed to play %d times, deleting it", item.video_id, failures)
+            self.delete_queue.enqueue(item.item_id)
+            self.mirror.remove(playlist.id, item.video_id)
+        else:
+            LOGGER.error("Item %s failed to play %d times, skipping it", item.video_id, failures)
+        self.playlist_cache.remove_item(playlist.id, item.item_id)
+    
+    def _resolve_track(
+        self,
+        playlist: PlaylistConfig,
+        exclude: Optional[PlaylistItem] = None,
+        resolve_stream: bool = False,
+        advance: bool = True
+    ) -> Optional[ResolvedTrack]:
+        """Choose the next item from the playlist index and resolve its metadata.
+        
+        Args:
+            playlist: The playlist to choose from.
+            exclude: Item that must not be chosen, e.g. one about to be deleted.
+            resolve_stream: Also resolve the direct stream URL via yt-dlp.
+            advance: Move the shuffle round past the item. Prefetches leave
+                that to _take_prefetched, so a discarded one skips nothing.
+            
+        Returns:
+            The resolved track, or None if the playlist has nothing to play.
+        """
+        if playlist.randomize:
+            # The shuffle bag never hands out an item twice per round, so
+            # the current item needs no exclusion
+            item_id = self.scheduler.next(
+                playlist.id,
+                self.playlist_cache.version(playlist.id),
+                lambda: self.playlist_cache.item_ids(playlist.id),
+                lambda key: self.playlist_cache.find_item(playlist.id, key) is not None,
+                playlist.shuffle_weighting,
+                advance
+            )
+            if item_id is None:
+                LOGGER.warning("Playlist is empty")
+                return None
+            item = self.playlist_cache.find_item(playlist.id, item_id)
+            return self._resolve_item(playlist, item, resolve_stream)
+        
+        # Get the count of items from the local playlist index
+        item_count = self.playlist_cache.count(playlist.id)
+        if exclude is not None:
+            exclude = self.playlist_cache.find_item(playlist.id, exclude.item_id)
+        if exclude is not None:
+            item_count -= 1
+        
+        if item_count <= 0:
+            if exclude is None:
+                LOGGER.warning("Playlist is empty")
+            return None
+        
+        # Play the playlist in order, skipping over the excluded item
+        idx = 1 if exclude is not None and exclude.position == 0 else 0
+        
+        # Look up the item at this index in the local playlist index
+        item = self.playlist_cache.get_item(playlist.id, idx)
         if not item:
             LOGGER.warning("Failed to fetch playlist item at index %d", idx)
-            self.audio_player.play_sound("error.wav")
-            return ""
-        
-        video_id = item['contentDetails']['videoId']
-        playlist_item_id = item['id']
-        state.current_video_url = f"https://www.youtube.com/watch?v={video_id}"
+            return None
+        return self._resolve_item(playlist, item, resolve_stream)
+    
+    def _resolve_item(self, playlist: PlaylistConfig, item: PlaylistItem, resolve_stream: bool) -> ResolvedTrack:
+        """Resolve the title and, optionally, the stream URL of a playlist item.
         
-        # Get title from snippet or fetch from API if needed
-        title = item.get('snippet', {}).get('title')
+        A mirrored copy of the item is used as its stream URL, mpv plays
+        local files the same way.
+        """
+        # Get title from the cache or fetch from API if needed
+        title = item.title
         if not title:
-            title = self.youtube_auth.get_video_title(video_id)
+            title = self.youtube_auth.get_video_title(item.video_id)
         
-        LOGGER.info("Now playing item %d: %s (%s)", idx, title, video_id)
-        pressed_key = self.audio_player.stream_video_sound_cancellable(
-            state, SPECIAL_KEYS, NON_TERMINATING_KEYS
-        )
+        stream_url = None
+        if resolve_stream:
+            stream_url = self.mirror.lookup(playlist.id, item.video_id) or resolve_stream_url(item.url)
+        if stream_url:
+            LOGGER.debug("Prefetched item %d: %s", item.position, title)
+        return ResolvedTrack(playlist.id, item, title, stream_url)
+    
+    def _queue_next(self, playlist: PlaylistConfig, current: PlaylistItem, next_track: ResolvedTrack) -> None:
+        """Queue a prefetched track behind the current one if it is still streaming."""
+        start = self._resume_position(playlist, self._position_key(next_track.item))
+        with self._streaming_lock:
+            if self._streaming_item_id != current.item_id:
+                return
+            if self.audio_player.queue_stream(
+                next_track.stream_url or next_track.item.url, self._capture_file(next_track, start), start
+            ):
+                LOGGER.debug("Queued next item for gapless playback: %s", next_track.item.video_id)
+    
+    async def _take_prefetched(self, playlist: PlaylistConfig) -> Optional[ResolvedTrack]:
+        """Get the prefetched track if its item is still in the playlist."""
+        playlist_id = playlist.id
+        track = await self.prefetcher.take(playlist_id)
+        if not track:
+            return None
+        if playlist.randomize:
+            self.scheduler.advance(playlist_id, track.item.item_id)
         
-        # Handle post-play actions
-        if (pressed_key == "" or SPECIAL_ACTIONS.get(pressed_key) == Action.SKIP_DELETE) and state.selected_playlist.delete_after_play:
-            self.youtube_auth.remove_playlist_item(playlist_item_id)
-        else:
-            self.current_index += 1
-
-        return pressed_key
+        # Positions shift when items are deleted, so look the item up again
+        item = self.playlist_cache.find_item(playlist_id, track.item.item_id)
+        if not item:
+            LOGGER.debug("Prefetched item %s is gone from the playlist", track.item.item_id)
+            capture_file = self._capture_file(track)
+            if capture_file:
+                self.capture.discard(capture_file)
+            return None
+        track.item = item
+        return track
+    
+    def _capture_file(self, track: ResolvedTrack, start: float = 0.0) -> Optional[str]:
+        """Get the file mpv records a track into, or None if it is not recorded.
+        
+        A track resumed part way through is never recorded completely.
+        """
+        if self.capture is None or start:
+            return None
+        return self.capture.start(track.item.video_id, track.title, track.stream_url)
     
     @staticmethod
-    def _get_index(size: int, randomize: bool) -> int:
-        """Get the next index to play."""
-        if randomize:
-            return random.randrange(size)
-        return 0
+    def _position_key(item: PlaylistItem) -> str:
+        """Get the key the playback position of an item is stored under."""
+        return f'youtube:{item.video_id}'
+    
+    async def _sync_playlist(self, playlist_id: str) -> None:
+        """Refresh the playlist index once per session.
+
+        A playlist that was never cached (or cached empty) is fetched
+        synchronously, otherwise the refresh runs in the background and
+        playback uses the cached copy. The YouTube API client is set up on
+        the first refresh, so nothing of it is loaded before a YouTube
+        playlist is selected.
+        """
+        if playlist_id in self._synced_playlists:
+            return
+        
+        if self.playlist_cache.count(playlist_id):
+            self._synced_playlists.add(playlist_id)
+            threading.Thread(target=self._refresh_playlist, args=(playlist_id,), daemon=True).start()
+        elif await asyncio.to_thread(self._refresh_playlist, playlist_id):
+            self._synced_playlists.add(playlist_id)
+    
+    def _refresh_playlist(self, playlist_id: str) -> bool:
+        """Authenticate if needed and refresh the playlist index."""
+        if self.youtube_auth.ensure_client() is None:
+            return False
+        return self.playlist_cache.refresh(
+            self.youtube_auth, playlist_id, pending_deletes=self.delete_queue.pending_ids
+        )
 
 
 class LocalPlayer(ContentPlayer):
     """Plays content from local filesystem."""
 
-    def __init__(self, audio_player: AudioPlayer):
+    def __init__(
+        self,
+        audio_player: AudioPlayer,
+        library: Optional[MediaLibrary] = None,
+        scheduler: Optional[ShuffleScheduler] = None
+    ):
         super().__init__(audio_player)
+        self.library = library or MediaLibrary()
+        self.scheduler = scheduler or ShuffleScheduler()
         self.current_file: Optional[Path] = None
+        self.loudness_target: Optional[float] = None
+        self.loudness_max_boost = 10.0
+        # Track drawn from the shuffle bag ahead of time per playlist, to queue it
+        self._upcoming: Dict[str, str] = {}
 
-    def play(self, state: StateContainer) -> str:
+    async def play(self, state: StateContainer) -> str:
         """Play an audio file from local directory."""
-        folder_path = Path(state.selected_playlist.id)
+        playlist = state.selected_playlist
+        folder = playlist.id
+        metrics = get_metrics()
         
+        started = time.perf_counter()
         try:
-            items = list(folder_path.iterdir())
-            if not items:
-                LOGGER.warning("Folder is empty: %s", folder_path)
-                self.audio_player.play_sound("error.wav")
+            self.library.refresh(folder)
+            size = self.library.count(folder)
+            if not size:
+                LOGGER.warning("Folder is empty: %s", folder)
+                await self.audio_player.play_sound_async("error.wav")
                 return ""
         except Exception as e:
-            LOGGER.error("Failed to read folder %s: %s", folder_path, e)
-            self.audio_player.play_sound("error.wav")
+            LOGGER.error("Failed to read folder %s: %s", folder, e)
+            await self.audio_player.play_sound_async("error.wav")
             return ""
         
-        idx = self._get_index(len(items), state.selected_playlist.randomize)
-        selected_file = items[idx]
+        track = self._take_upcoming(playlist) or self._next_track(playlist)
+        metrics.observe('sleepy_track_phase_seconds', time.perf_counter() - started, player='local', phase='select')
+        if track is None:
+            LOGGER.error("No track to play in %s", folder)
+            await self.audio_player.play_sound_async("error.wav")
+            return ""
+        selected_file = Path(track.path)
         self.current_file = selected_file
 
         LOGGER.info("Now playing: %s", selected_file)
         state.current_audio_file = str(selected_file)
-        pressed_key = self.audio_player.play_sound_cancellable(
-            state, SPECIAL_KEYS, NON_TERMINATING_KEYS
-        )
+        state.current_gain_db = gain_db(track.loudness, self.loudness_target, self.loudness_max_boost)
+        self._set_resume(state, playlist, track.path)
+        self._queue_upcoming(playlist, track)
+        with metrics.timer('sleepy_track_phase_seconds', player='local', phase='play'):
+            pressed_key = await self.audio_player.play_sound_cancellable(
+                state, SPECIAL_KEYS, NON_TERMINATING_KEYS
+            )
         
-        # Handle post-play actions
-        if (SPECIAL_ACTIONS.get(pressed_key) == Action.SKIP_DELETE and state.selected_playlist.delete_on_skip
-                or pressed_key == "" and state.selected_playlist.delete_after_play):
-            try:
-                selected_file.unlink()
-                LOGGER.info("Deleted file: %s", selected_file)
-            except Exception as e:
-                LOGGER.error("Failed to delete file %s: %s", selected_file, e)
-        else:
-            self.current_index += 1
+        with metrics.timer('sleepy_track_phase_seconds', player='local', phase='post_play'):
+            self.library.mark_played(track.path)
+            if playlist.randomize:
+                self.scheduler.record_play(folder, track.path)
+            
+            # Handle post-play actions
+            if (SPECIAL_ACTIONS.get(pressed_key) == Action.SKIP_DELETE and playlist.delete_on_skip
+                    or pressed_key == "" and playlist.delete_after_play):
+                try:
+                    selected_file.unlink()
+                    self.library.remove(track.path)
+                    LOGGER.info("Deleted file: %s", selected_file)
+                except Exception as e:
+                    LOGGER.error("Failed to delete file %s: %s", selected_file, e)
 
         return pressed_key
     
-    @staticmethod
-    def _get_index(size: int, randomize: bool) -> int:
-        """Get the next index to play."""
-        if randomize:
-            return random.randrange(size)
-        return 0
+    def in_use(self) -> List[str]:
+        """Get the files that are playing or queued to play next."""
+        files = [str(self.current_file)] if self.current_file else []
+        return files + list(self._upcoming.values())
+    
+    def _queue_upcoming(self, playlist: PlaylistConfig, current: LibraryTrack) -> None:
+        """Draw the track after the current one and queue it for a gapless or crossfaded transition.
+        
+        Only randomized playlists that keep playing know their next track
+        in advance; it is kept and played next even if the current track
+        is skipped.
+        """
+        if not playlist.randomize or playlist.shutdown_after_play:
+            return
+        upcoming = self._next_track(playlist)
+        if upcoming is None or upcoming.path == current.path:
+            return
+        self._upcoming[playlist.id] = upcoming.path
+        self.audio_player.queue_local(
+            upcoming.path,
+            gain_db(upcoming.loudness, self.loudness_target, self.loudness_max_boost),
+            playlist.crossfade,
+            self._resume_position(playlist, upcoming.path)
+        )
+    
+    def _take_upcoming(self, playlist: PlaylistConfig) -> Optional[LibraryTrack]:
+        """Get the track drawn ahead of time if it is still in the library."""
+        path = self._upcoming.pop(playlist.id, None)
+        return self.library.get(path) if path else None
+    
+    def _next_track(self, playlist: PlaylistConfig) -> Optional[LibraryTrack]:
+        """Get the next track: the next one of the shuffle bag, or the first one."""
+        if not playlist.randomize:
+            return self.library.get_track(playlist.id, 0)
+        
+        path = self.scheduler.next(
+            playlist.id,
+            self.library.version(playlist.id),
+            lambda: self.library.paths(playlist.id),
+            lambda key: self.library.get(key) is not None,
+            playlist.shuffle_weighting
+        )
+        return self.library.get(path) if path else None
@@ -0,0 +1,281 @@
+"""Persistent local index of YouTube playlist contents."""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Set
+
+from sleepy.constants import PLAYLIST_CACHE_FILE
+from sleepy.models import PlaylistItem
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PlaylistCache:
+    """SQLite-backed store of playlist items, addressable by position.
+
+    Each playlist is stored as rows keyed by (playlist_id, position), so
+    picking a track by index is a single primary key lookup. Refreshes
+    compare the playlist etag first and then only rewrite the pages whose
+    etag changed since the last sync.
+    """
+
+    PAGE_SIZE = 50
+    MAX_AGE = 24 * 60 * 60  # seconds before a refresh is forced
+
+    def __init__(self, db_path: str = PLAYLIST_CACHE_FILE):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS playlists (
+                    playlist_id TEXT PRIMARY KEY,
+                    etag TEXT,
+                    item_count INTEGER NOT NULL DEFAULT 0,
+                    refreshed_at REAL NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS playlist_pages (
+                    playlist_id TEXT NOT NULL,
+                    page INTEGER NOT NULL,
+                    etag TEXT,
+                    PRIMARY KEY (playlist_id, page)
+                );
+                CREATE TABLE IF NOT EXISTS playlist_items (
+                    playlist_id TEXT NOT NULL,
+                    position INTEGER NOT NULL,
+                    item_id TEXT NOT NULL,
+                    video_id TEXT NOT NULL,
+                    title TEXT,
+                    PRIMARY KEY (playlist_id, position)
+                );
+                CREATE INDEX IF NOT EXISTS idx_playlist_items_item_id
+                    ON playlist_items (item_id);
+                """
+            )
+
+    def has_playlist(self, playlist_id: str) -> bool:
+        """Check whether a playlist has been synced at least once."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM playlists WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+        return row is not None
+
+    def count(self, playlist_id: str) -> int:
+        """Get the number of cached items in a playlist."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT item_count FROM playlists WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+        return row[0] if row else 0
+
+    def version(self, playlist_id: str) -> str:
+        """Get a token that changes whenever items were added or removed."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, item_count FROM playlists WHERE playlist_id = ?", (playlist_id,)
+            ).fetchone()
+        return f"{row[0]}:{row[1]}" if row else ''
+
+    def item_ids(self, playlist_id: str) -> List[str]:
+        """Get the playlist item IDs of all cached items."""
+        with self._lock:
+            return [
+                row[0] for row in self._conn.execute(
+                    "SELECT item_id FROM playlist_items WHERE playlist_id = ?", (playlist_id,)
+                )
+            ]
+
+    def video_ids(self, playlist_id: str) -> List[str]:
+        """Get the video IDs of all cached items."""
+        with self._lock:
+            return [
+                row[0] for row in self._conn.execute(
+                    "SELECT video_id FROM playlist_items WHERE playlist_id = ?", (playlist_id,)
+                )
+            ]
+
+    def get_item(self, playlist_id: str, index: int) -> Optional[PlaylistItem]:
+        """Get the cached item at a position.
+
+        Args:
+            playlist_id: YouTube playlist ID.
+            index: Zero-based position in the playlist.
+
+        Returns:
+            The cached item, or None if there is no item at that position.
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT item_id, video_id, title, position FROM playlist_items "
+                "WHERE playlist_id = ? AND position = ?",
+                (playlist_id, index)
+            ).fetchone()
+        return PlaylistItem(*row) if row else None
+
+    def find_item(self, playlist_id: str, item_id: str) -> Optional[PlaylistItem]:
+        """Get a cached item by its playlist item ID, with its current position."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT item_id, video_id, title, position FROM playlist_items "
+                "WHERE playlist_id = ? AND item_id = ?",
+                (playlist_id, item_id)
+            ).fetchone()
+        return PlaylistItem(*row) if row else None
+
+    def remove_item(self, playlist_id: str, item_id: str) -> None:
+        """Remove an item and close the gap it leaves in the positions."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT position FROM playlist_items WHERE playlist_id = ? AND item_id = ?",
+                (playlist_id, item_id)
+            ).fetchone()
+            if not row:
+                return
+            self._conn.execute(
+                "DELETE FROM playlist_items WHERE playlist_id = ? AND position = ?",
+                (playlist_id, row[0])
+            )
+            # Shift in ascending order so the primary key never collides
+            self._conn.execute(
+                "UPDATE playlist_items SET position = -(position - 1) "
+                "WHERE playlist_id = ? AND position > ?",
+                (playlist_id, row[0])
+            )
+            self._conn.execute(
+                "UPDATE playlist_items SET position = -position "
+                "WHERE playlist_id = ? AND position < 0",
+                (playlist_id,)
+            )
+            # Page contents moved, so their etags no longer describe the rows
+            self._conn.execute(
+                "DELETE FROM playlist_pages WHERE playlist_id = ? AND page >= ?",
+                (playlist_id, row[0] // self.PAGE_SIZE)
+            )
+            self._conn.execute(
+                "UPDATE playlists SET item_count = item_count - 1 WHERE playlist_id = ?",
+                (playlist_id,)
+            )
+        LOGGER.debug("Removed item %s from playlist cache %s", item_id, playlist_id)
+
+    def refresh(
+        self,
+        youtube_auth,
+        playlist_id: str,
+        force: bool = False,
+        info: Optional[Dict] = None,
+        pending_deletes: Optional[Callable[[], Set[str]]] = None
+    ) -> bool:
+        """Synchronize a playlist with the YouTube API.
+
+        The playlist etag and item count are checked first; if neither
+        changed and the cache is younger than MAX_AGE nothing else is
+        fetched. Otherwise all pages are walked, but only pages whose etag
+        differs from the stored one are rewritten. Items whose delete is
+        still queued are left out, so a deleted track is not played again
+        before the delete reaches YouTube.
+
+        Args:
+            youtube_auth: Authenticated YouTubeAuthenticator.
+            playlist_id: YouTube playlist ID.
+            force: Walk the pages even if the playlist etag is unchanged.
+            info: The playlist etag and item count if already fetched, e.g.
+                with get_playlist_infos for several playlists at once.
+            pending_deletes: Returns the IDs of items whose delete is queued.
+
+        Returns:
+            True if the cache is up to date, False if the refresh failed.
+        """
+        if info is None:
+            if not youtube_auth.quota.allows('playlists.list'):
+                LOGGER.warning("YouTube quota low, playing %s from the cache", playlist_id)
+                return self.has_playlist(playlist_id)
+            info = youtube_auth.get_playlist_info(playlist_id)
+            if info is None:
+                return False
+
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, item_count, refreshed_at FROM playlists WHERE playlist_id = ?",
+                (playlist_id,)
+            ).fetchone()
+        if (not force and row is not None
+                and row[0] == info['etag'] and row[1] == info['itemCount']
+                and time.time() - row[2] < self.MAX_AGE):
+            LOGGER.debug("Playlist cache for %s is up to date", playlist_id)
+            return True
+        
+        pages = max(1, -(-info['itemCount'] // self.PAGE_SIZE))
+        if row is not None and not youtube_auth.quota.allows('playlistItems.list', pages):
+            LOGGER.warning("YouTube quota low, keeping the cached copy of %s", playlist_id)
+            return True
+
+        try:
+            total = 0
+            page = 0
+            for page_etag, items in youtube_auth.iter_playlist_pages(playlist_id):
+                self._store_page(playlist_id, page, page_etag, items)
+                total += len(items)
+                page += 1
+        except Exception as e:
+            LOGGER.error("Failed to refresh playlist cache for %s: %s", playlist_id, e)
+            return False
+
+        with self._lock, self._conn:
+            self._conn.execute(
+                "DELETE FROM playlist_items WHERE playlist_id = ? AND position >= ?",
+                (playlist_id, total)
+            )
+            self._conn.execute(
+                "DELETE FROM playlist_pages WHERE playlist_id = ? AND page >= ?",
+                (playlist_id, page)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO playlists (playlist_id, etag, item_count, refreshed_at) "
+                "VALUES (?, ?, ?, ?)",
+                (playlist_id, info['etag'], total, time.time())
+            )
+        LOGGER.info("Playlist cache for %s refreshed with %d items", playlist_id, total)
+        
+        # Read after the pages, so deletes queued during the refresh are covered too
+        for item_id in pending_deletes() if pending_deletes else ():
+            self.remove_item(playlist_id, item_id)
+        return True
+
+    def _store_page(self, playlist_id: str, page: int, page_etag: Optional[str], items: list) -> None:
+        """Write one page of API items unless its etag is unchanged."""
+        with self._lock, self._conn:
+            row = self._conn.execute(
+                "SELECT etag FROM playlist_pages WHERE playlist_id = ? AND page = ?",
+                (playlist_id, page)
+            ).fetchone()
+            if page_etag and row and row[0] == page_etag:
+                return
+
+            start = page * self.PAGE_SIZE
+            self._conn.execute(
+                "DELETE FROM playlist_items WHERE playlist_id = ? AND position >= ? AND position < ?",
+                (playlist_id, start, start + self.PAGE_SIZE)
+            )
+            self._conn.executemany(
+                "INSERT INTO playlist_items (playlist_id, position, item_id, video_id, title) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [
+                    (
+                        playlist_id,
+                        start + offset,
+                        item['id'],
+                        item['contentDetails']['videoId'],
+                        item.get('snippet', {}).get('title'),
+                    )
+                    for offset, item in enumerate(items)
+                ]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO playlist_pages (playlist_id, page, etag) VALUES (?, ?, ?)",
+                (playlist_id, page, page_etag)
+            )
@@ -0,0 +1,96 @@
+"""Playback positions of long tracks, kept across skips and shutdowns."""
+
+import logging
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Optional
+
+from sleepy.constants import POSITIONS_FILE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class PositionStore:
+    """Where playback of a track stopped, by track key.
+
+    Keys are file paths for local tracks and ``youtube:<video_id>`` for
+    YouTube videos. Positions are updated in memory while a track plays
+    and written to disk in one transaction at most every FLUSH_INTERVAL
+    seconds, and whenever playback stops, so tracking costs no disk write
+    per update. A track that played to its end is forgotten.
+    """
+
+    MIN_POSITION = 30.0              # seconds into a track before its position is worth keeping
+    FLUSH_INTERVAL = 60.0
+    MAX_AGE = 30 * 24 * 60 * 60      # positions untouched this long are dropped
+
+    def __init__(self, db_path: str = POSITIONS_FILE):
+        self._lock = threading.Lock()
+        # Changes not written yet, None for a forgotten position
+        self._pending: Dict[str, Optional[float]] = {}
+        self._flushed_at = time.monotonic()
+
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS positions (
+                    key TEXT PRIMARY KEY,
+                    position REAL NOT NULL,
+                    updated_at REAL NOT NULL
+                )
+                """
+            )
+            self._conn.execute("DELETE FROM positions WHERE updated_at < ?", (time.time() - self.MAX_AGE,))
+
+    def get(self, key: str) -> Optional[float]:
+        """Get the position to resume a track at, in seconds, or None to start from the beginning."""
+        with self._lock:
+            if key in self._pending:
+                return self._pending[key]
+            row = self._conn.execute("SELECT position FROM positions WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def update(self, key: str, position: float) -> None:
+        """Remember the position of a playing track, writing all changes if the last write is old enough."""
+        with self._lock:
+            self._pending[key] = position if position >= self.MIN_POSITION else None
+            due = time.monotonic() - self._flushed_at >= self.FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def forget(self, key: str) -> None:
+        """Drop the position of a track that played to its end."""
+        with self._lock:
+            self._pending[key] = None
+        self.flush()
+
+    def flush(self) -> None:
+        """Write the changed positions to disk."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            self._flushed_at = time.monotonic()
+            if not pending:
+                return
+            now = time.time()
+            try:
+                with self._conn:
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO positions (key, position, updated_at) VALUES (?, ?, ?)",
+                        [(key, position, now) for key, position in pending.items() if position is not None]
+                    )
+                    self._conn.executemany(
+                        "DELETE FROM positions WHERE key = ?",
+                        [(key,) for key, position in pending.items() if position is None]
+                    )
+            except sqlite3.Error as e:
+                LOGGER.warning("Failed to store playback positions: %s", e)
+
+    def close(self) -> None:
+        """Write pending positions and close the database."""
+        self.flush()
+        with self._lock:
+            self._conn.close()
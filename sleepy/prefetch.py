@@ -0,0 +1,132 @@
+"""Background prefetching of the next track."""
+
+import asyncio
+import logging
+import subprocess
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Optional
+
+from sleepy.metrics import get_metrics
+from sleepy.models import ResolvedTrack
+
+LOGGER = logging.getLogger(__name__)
+
+
+def resolve_stream_url(url: str, timeout: int = 60) -> Optional[str]:
+    """Resolve the direct audio stream URL of a YouTube video.
+
+    Args:
+        url: The YouTube watch URL.
+        timeout: Seconds to wait for yt-dlp.
+
+    Returns:
+        The direct stream URL, or None if resolving failed.
+    """
+    try:
+        with get_metrics().timer('sleepy_call_seconds', call='yt-dlp:resolve'):
+            result = subprocess.run(
+                ['yt-dlp', '--no-playlist', '-f', 'bestaudio', '--get-url', url],
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                check=False,
+                timeout=timeout
+            )
+    except subprocess.TimeoutExpired:
+        LOGGER.warning("Resolving stream URL timed out: %s", url)
+        return None
+    except Exception as e:
+        LOGGER.warning("Failed to resolve stream URL for %s: %s", url, e)
+        return None
+
+    if result.returncode != 0:
+        LOGGER.warning("Failed to resolve stream URL for %s: %s", url, result.stderr.decode().strip())
+        return None
+
+    lines = result.stdout.decode().strip().splitlines()
+    return lines[0] if lines else None
+
+
+class TrackPrefetcher:
+    """Resolves the next track on a background thread while the current one plays."""
+
+    # Resolved googlevideo URLs expire after roughly six hours
+    STREAM_URL_TTL = 3 * 60 * 60
+
+    def __init__(self):
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='prefetch')
+        self._future: Optional[Future] = None
+        self._playlist_id: Optional[str] = None
+
+    def schedule(
+        self,
+        playlist_id: str,
+        resolve: Callable[[], Optional[ResolvedTrack]],
+        on_ready: Optional[Callable[[ResolvedTrack], None]] = None
+    ) -> None:
+        """Start resolving the next track in the background.
+
+        Args:
+            playlist_id: ID of the playlist the track is resolved for.
+            resolve: Callable returning the resolved track, or None.
+            on_ready: Called on the prefetch thread once a track is resolved.
+        """
+        self.cancel()
+        self._playlist_id = playlist_id
+        self._future = self._executor.submit(resolve)
+        if on_ready:
+            self._future.add_done_callback(
+                lambda future: self._notify(future, on_ready)
+            )
+
+    @staticmethod
+    def _notify(future: Future, on_ready: Callable[[ResolvedTrack], None]) -> None:
+        """Pass a successfully resolved track on to a callback."""
+        if future.cancelled() or future.exception() is not None:
+            return
+        track = future.result()
+        if track is not None:
+            try:
+                on_ready(track)
+            except Exception as e:
+                LOGGER.warning("Prefetch callback failed: %s", e)
+
+    async def take(self, playlist_id: str) -> Optional[ResolvedTrack]:
+        """Take the prefetched track if it belongs to the given playlist.
+
+        Waits for a prefetch for the same playlist that is still running,
+        since finishing it is never slower than starting the same work from
+        scratch. A prefetch for another playlist is dropped without waiting.
+
+        Args:
+            playlist_id: ID of the playlist that is about to play.
+
+        Returns:
+            The prefetched track, or None if nothing usable was prefetched.
+        """
+        future, self._future = self._future, None
+        if future is None:
+            return None
+        if self._playlist_id != playlist_id:
+            LOGGER.debug("Dropping the prefetch for playlist %s", self._playlist_id)
+            future.cancel()
+            return None
+
+        try:
+            track = await asyncio.wrap_future(future)
+        except Exception as e:
+            LOGGER.warning("Prefetch failed: %s", e)
+            return None
+
+        if track is None or track.playlist_id != playlist_id:
+            return None
+        if track.stream_url and time.time() - track.resolved_at > self.STREAM_URL_TTL:
+            LOGGER.debug("Prefetched stream URL expired for %s", track.item.video_id)
+            track.stream_url = None
+        return track
+
+    def cancel(self) -> None:
+        """Drop the pending prefetch, if any."""
+        if self._future is not None:
+            self._future.cancel()
+            self._future = None
@@ -0,0 +1,121 @@
+"""Bookkeeping of the YouTube Data API quota."""
+
+import logging
+import sqlite3
+import threading
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+from typing import Dict, Optional, Tuple
+
+from sleepy.constants import QUOTA_FILE, YOUTUBE_QUOTA_COSTS
+from sleepy.metrics import get_metrics
+
+try:
+    from zoneinfo import ZoneInfo
+    _QUOTA_TZ = ZoneInfo('America/Los_Angeles')
+except Exception:
+    _QUOTA_TZ = timezone(timedelta(hours=-8))
+
+LOGGER = logging.getLogger(__name__)
+
+
+class QuotaExhaustedError(Exception):
+    """Raised instead of making an API call the remaining quota cannot cover."""
+
+
+class QuotaTracker:
+    """Counts API calls and quota units per quota day.
+
+    The daily quota resets at midnight Pacific time. Calls that can be
+    served from the local cache instead (reads) stop once only the reserve
+    is left; the reserve is kept for playlist item deletes.
+    """
+
+    DAILY_LIMIT = 10000
+    RESERVE = 500
+
+    def __init__(self, db_path: str = QUOTA_FILE, daily_limit: int = DAILY_LIMIT, reserve: int = RESERVE):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.daily_limit = daily_limit
+        self.reserve = reserve
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                """
+                CREATE TABLE IF NOT EXISTS usage (
+                    day TEXT NOT NULL,
+                    method TEXT NOT NULL,
+                    calls INTEGER NOT NULL DEFAULT 0,
+                    units INTEGER NOT NULL DEFAULT 0,
+                    PRIMARY KEY (day, method)
+                )
+                """
+            )
+
+    @staticmethod
+    def today() -> str:
+        """Get the current quota day."""
+        return datetime.now(_QUOTA_TZ).date().isoformat()
+
+    @staticmethod
+    def seconds_until_reset() -> float:
+        """Get the seconds until the quota resets."""
+        now = datetime.now(_QUOTA_TZ)
+        midnight = (now + timedelta(days=1)).replace(hour=0, minute=0, second=0, microsecond=0)
+        return (midnight - now).total_seconds()
+
+    def used(self) -> int:
+        """Get the units spent on the current quota day."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT COALESCE(SUM(units), 0) FROM usage WHERE day = ?", (self.today(),)
+            ).fetchone()
+        return row[0]
+
+    def remaining(self) -> int:
+        """Get the units left on the current quota day."""
+        return max(0, self.daily_limit - self.used())
+
+    def allows(self, method: str, count: int = 1, essential: bool = False) -> bool:
+        """Check whether calls fit into the remaining quota.
+
+        Args:
+            method: API method, e.g. 'playlistItems.list'.
+            count: Number of calls.
+            essential: Whether the calls may use the reserve.
+        """
+        floor = 0 if essential else self.reserve
+        return self.remaining() - YOUTUBE_QUOTA_COSTS.get(method, 1) * count >= floor
+
+    def charge(self, method: str, count: int = 1) -> None:
+        """Record calls that were sent to the API."""
+        units = YOUTUBE_QUOTA_COSTS.get(method, 1) * count
+        get_metrics().inc('sleepy_youtube_quota_units_total', units, method=method)
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO usage (day, method, calls, units) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (day, method) DO UPDATE SET "
+                "calls = calls + excluded.calls, units = units + excluded.units",
+                (self.today(), method, count, units)
+            )
+
+    def summary(self, day: Optional[str] = None) -> Dict[str, Tuple[int, int]]:
+        """Get the (calls, units) per API method of a quota day, today by default."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT method, calls, units FROM usage WHERE day = ? ORDER BY method", (day or self.today(),)
+            ).fetchall()
+        return {method: (calls, units) for method, calls, units in rows}
+
+    def log_summary(self) -> None:
+        """Log today's API usage."""
+        summary = self.summary()
+        if not summary:
+            return
+        LOGGER.info(
+            "YouTube API usage today: %s (%d of %d units)",
+            ', '.join(f"{method} {calls} calls/{units} units" for method, (calls, units) in summary.items()),
+            sum(units for _, units in summary.values()),
+            self.daily_limit
+        )
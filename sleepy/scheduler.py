@@ -0,0 +1,257 @@
+"""Persistent shuffle-bag order for randomized playlists."""
+
+import logging
+import math
+import random
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+from sleepy.constants import SHUFFLE_FILE
+
+LOGGER = logging.getLogger(__name__)
+
+
+class ShuffleScheduler:
+    """Plays every item of a playlist once per round, in random order.
+
+    Each item of a playlist gets a random rank and a round walks the items
+    in rank order, so picking the next item is one index lookup. Ranks are
+    exponentially distributed with the item's weight as rate, which makes
+    the order a weighted random permutation (Efraimidis-Spirakis). Because
+    the exponential distribution is memoryless, an item that shows up in
+    the middle of a round is given the rank ``cursor + Exp(weight)`` and
+    lands at a random spot among the items that have not played yet,
+    without touching any other row. Items that disappear are dropped when
+    the playlist version changes, or skipped when they are picked.
+    """
+
+    RECENCY_SCALE = 7 * 24 * 60 * 60  # seconds until a played item has full weight again
+    MIN_WEIGHT = 0.05
+
+    def __init__(self, db_path: str = SHUFFLE_FILE):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        with self._conn:
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS bags (
+                    playlist_id TEXT PRIMARY KEY,
+                    version TEXT,
+                    weighting TEXT,
+                    cursor REAL NOT NULL DEFAULT 0
+                );
+                CREATE TABLE IF NOT EXISTS bag_items (
+                    playlist_id TEXT NOT NULL,
+                    item_key TEXT NOT NULL,
+                    rank REAL NOT NULL,
+                    PRIMARY KEY (playlist_id, item_key)
+                );
+                CREATE INDEX IF NOT EXISTS idx_bag_items_rank
+                    ON bag_items (playlist_id, rank);
+                CREATE TABLE IF NOT EXISTS plays (
+                    playlist_id TEXT NOT NULL,
+                    item_key TEXT NOT NULL,
+                    play_count INTEGER NOT NULL DEFAULT 0,
+                    last_played REAL,
+                    PRIMARY KEY (playlist_id, item_key)
+                );
+                """
+            )
+
+    def next(
+        self,
+        playlist_id: str,
+        version: str,
+        keys: Callable[[], Iterable[str]],
+        exists: Callable[[str], bool],
+        weighting: Optional[str] = None,
+        advance: bool = True
+    ) -> Optional[str]:
+        """Advance to the next item of a playlist.
+
+        Args:
+            playlist_id: ID of the playlist.
+            version: Changes whenever items were added or removed.
+            keys: Returns the keys of all current items; only called when
+                the version changed.
+            exists: Checks whether an item is still in the playlist.
+            weighting: None for a uniform shuffle, or one of SHUFFLE_WEIGHTINGS:
+                'plays' prefers items played less often, 'recency' items
+                not played lately.
+            advance: Move the round past the item. Without it the item is
+                only looked up, e.g. for a prefetch, and handed out again
+                until advance() is called for it.
+
+        Returns:
+            The key of the next item, or None if the playlist is empty.
+        """
+        with self._lock:
+            cursor = self._prepare(playlist_id, version, keys, weighting)
+            reshuffled = False
+            while True:
+                found = self._conn.execute(
+                    "SELECT item_key, rank FROM bag_items WHERE playlist_id = ? AND rank > ? "
+                    "ORDER BY rank LIMIT 1",
+                    (playlist_id, cursor)
+                ).fetchone()
+                if found is None:
+                    if reshuffled:
+                        return None
+                    LOGGER.info("Shuffle round of %s finished, reshuffling", playlist_id)
+                    self._reshuffle(playlist_id, weighting)
+                    cursor, reshuffled = 0.0, True
+                    continue
+
+                key, cursor = found
+                if exists(key):
+                    if advance:
+                        with self._conn:
+                            self._conn.execute(
+                                "UPDATE bags SET cursor = ? WHERE playlist_id = ?", (cursor, playlist_id)
+                            )
+                    return key
+                # Gone since the last sync, drop it lazily
+                with self._conn:
+                    self._conn.execute(
+                        "DELETE FROM bag_items WHERE playlist_id = ? AND item_key = ?", (playlist_id, key)
+                    )
+
+    def advance(self, playlist_id: str, key: str) -> None:
+        """Move the round past an item that next() returned without advancing."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "UPDATE bags SET cursor = ("
+                "SELECT rank FROM bag_items WHERE playlist_id = ? AND item_key = ?"
+                ") WHERE playlist_id = ? AND cursor < ("
+                "SELECT rank FROM bag_items WHERE playlist_id = ? AND item_key = ?"
+                ")",
+                (playlist_id, key, playlist_id, playlist_id, key)
+            )
+
+    def upcoming(
+        self,
+        playlist_id: str,
+        version: str,
+        keys: Callable[[], Iterable[str]],
+        count: int,
+        weighting: Optional[str] = None
+    ) -> List[str]:
+        """Get the keys of the items that play next, without advancing.
+
+        Only the rest of the current round is known; the order of the next
+        round is drawn when it starts. Arguments are the same as for next.
+        """
+        with self._lock:
+            cursor = self._prepare(playlist_id, version, keys, weighting)
+            return [
+                row[0] for row in self._conn.execute(
+                    "SELECT item_key FROM bag_items WHERE playlist_id = ? AND rank > ? "
+                    "ORDER BY rank LIMIT ?",
+                    (playlist_id, cursor, count)
+                )
+            ]
+
+    def record_play(self, playlist_id: str, key: str) -> None:
+        """Add a playback of an item to the history used for weighting."""
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO plays (playlist_id, item_key, play_count, last_played) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT (playlist_id, item_key) DO UPDATE SET "
+                "play_count = play_count + 1, last_played = excluded.last_played",
+                (playlist_id, key, time.time())
+            )
+
+    def _prepare(
+        self, playlist_id: str, version: str, keys: Callable[[], Iterable[str]], weighting: Optional[str]
+    ) -> float:
+        """Sync the bag if the playlist or weighting changed. The caller holds the lock.
+
+        Returns:
+            The rank of the item played last in the current round.
+        """
+        row = self._conn.execute(
+            "SELECT version, weighting, cursor FROM bags WHERE playlist_id = ?", (playlist_id,)
+        ).fetchone()
+        if row is None or row[1] != weighting:
+            self._sync(playlist_id, version, keys(), weighting, reshuffle=True)
+            return 0.0
+        if row[0] != version:
+            self._sync(playlist_id, version, keys(), weighting, reshuffle=False)
+        return row[2]
+
+    def _sync(self, playlist_id: str, version: str, keys: Iterable[str], weighting: Optional[str], reshuffle: bool) -> None:
+        """Apply added and removed items. The caller holds the lock."""
+        current = set(keys)
+        known = {
+            row[0] for row in self._conn.execute(
+                "SELECT item_key FROM bag_items WHERE playlist_id = ?", (playlist_id,)
+            )
+        }
+        row = self._conn.execute(
+            "SELECT cursor FROM bags WHERE playlist_id = ?", (playlist_id,)
+        ).fetchone()
+        cursor = row[0] if row and not reshuffle else 0.0
+        added = current - known
+        removed = known - current
+
+        with self._conn:
+            self._conn.executemany(
+                "DELETE FROM bag_items WHERE playlist_id = ? AND item_key = ?",
+                [(playlist_id, key) for key in removed]
+            )
+            self._conn.executemany(
+                "INSERT INTO bag_items (playlist_id, item_key, rank) VALUES (?, ?, ?)",
+                [(playlist_id, key, cursor + self._draw(playlist_id, key, weighting)) for key in added]
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO bags (playlist_id, version, weighting, cursor) VALUES (?, ?, ?, ?)",
+                (playlist_id, version, weighting, cursor)
+            )
+        if reshuffle:
+            self._reshuffle(playlist_id, weighting)
+        LOGGER.debug(
+            "Shuffle bag of %s synced: %d added, %d removed", playlist_id, len(added), len(removed)
+        )
+
+    def _reshuffle(self, playlist_id: str, weighting: Optional[str]) -> None:
+        """Start a new round with fresh ranks for every item. The caller holds the lock."""
+        keys = [
+            row[0] for row in self._conn.execute(
+                "SELECT item_key FROM bag_items WHERE playlist_id = ? ORDER BY rank", (playlist_id,)
+            )
+        ]
+        ranks = {key: self._draw(playlist_id, key, weighting) for key in keys}
+        if len(ranks) > 1:
+            # Never open a round with the item that closed the previous one
+            last = keys[-1]
+            ranks[last] += min(rank for key, rank in ranks.items() if key != last)
+        with self._conn:
+            self._conn.executemany(
+                "UPDATE bag_items SET rank = ? WHERE playlist_id = ? AND item_key = ?",
+                [(rank, playlist_id, key) for key, rank in ranks.items()]
+            )
+            self._conn.execute("UPDATE bags SET cursor = 0 WHERE playlist_id = ?", (playlist_id,))
+
+    def _draw(self, playlist_id: str, key: str, weighting: Optional[str]) -> float:
+        """Draw a rank for an item: exponential with its weight as rate."""
+        # 1 - random() is in (0, 1], so the log is always defined
+        return -math.log(1.0 - random.random()) / self._weight(playlist_id, key, weighting)
+
+    def _weight(self, playlist_id: str, key: str, weighting: Optional[str]) -> float:
+        """Get the weight of an item from its play history."""
+        if weighting is None:
+            return 1.0
+        row = self._conn.execute(
+            "SELECT play_count, last_played FROM plays WHERE playlist_id = ? AND item_key = ?",
+            (playlist_id, key)
+        ).fetchone()
+        if row is None:
+            return 1.0
+        if weighting == 'plays':
+            return 1.0 / (1 + row[0])
+        age = time.time() - (row[1] or 0)
+        return max(self.MIN_WEIGHT, min(1.0, age / self.RECENCY_SCALE))
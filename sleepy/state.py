@@ -15,7 +15,12 @@ class StateContainer:
         self.selected_playlist: Optional[PlaylistConfig] = None
 
         self.current_video_url: Optional[str] = None
+        self.current_stream_url: Optional[str] = None
         self.current_audio_file: Optional[str] = None
+        self.current_capture_file: Optional[str] = None
+        self.current_gain_db: float = 0.0
+        self.current_position_key: Optional[str] = None
+        self.current_start: float = 0.0
         self.do_download: bool = False
 
     @property
@@ -45,6 +50,15 @@ class StateContainer:
         self._current_video_url = value
         LOGGER.debug("Video URL changed to %s", self.current_video_url)
 
+    @property
+    def current_stream_url(self):
+        return self._current_stream_url
+
+    @current_stream_url.setter
+    def current_stream_url(self, value):
+        self._current_stream_url = value
+        LOGGER.debug("Stream URL changed to %s", self.current_stream_url)
+
     @property
     def current_audio_file(self):
         return self._current_audio_file
@@ -54,6 +68,42 @@ class StateContainer:
         self._current_audio_file = value
         LOGGER.debug("Current audio file changed to %s", self.current_audio_file)
 
+    @property
+    def current_capture_file(self):
+        return self._current_capture_file
+
+    @current_capture_file.setter
+    def current_capture_file(self, value):
+        self._current_capture_file = value
+        LOGGER.debug("Capture file changed to %s", self.current_capture_file)
+
+    @property
+    def current_gain_db(self):
+        return self._current_gain_db
+
+    @current_gain_db.setter
+    def current_gain_db(self, value):
+        self._current_gain_db = value
+        LOGGER.debug("Playback gain changed to %.1f dB", self.current_gain_db)
+
+    @property
+    def current_position_key(self):
+        return self._current_position_key
+
+    @current_position_key.setter
+    def current_position_key(self, value):
+        self._current_position_key = value
+        LOGGER.debug("Position key changed to %s", self.current_position_key)
+
+    @property
+    def current_start(self):
+        return self._current_start
+
+    @current_start.setter
+    def current_start(self, value):
+        self._current_start = value
+        LOGGER.debug("Start position changed to %.1f s", self.current_start)
+
     @property
     def do_download(self):
         return self._do_download
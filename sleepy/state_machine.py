@@ -1,19 +1,27 @@
 """State machine implementation."""
 
+import asyncio
 import logging
 import shutil
 import subprocess
-import time
 from pathlib import Path
 from typing import Optional
 
 from sleepy.state import StateContainer
 from sleepy.audio import AudioPlayer
+from sleepy.capture import StreamCapture
 from sleepy.config import ConfigManager
-from sleepy.constants import SPECIAL_KEYS, SPECIAL_ACTIONS, Action, State, LOCAL_ASMR_DIR
+from sleepy.constants import SPECIAL_KEYS, SPECIAL_ACTIONS, INTERRUPT_KEY, FAILED_KEY, Action, State, LOCAL_ASMR_DIR
+from sleepy.download_queue import DownloadQueue
 from sleepy.downloader import YouTubeDownloader
-from sleepy.input_handler import KeyboardPoller
+from sleepy.input_handler import get_input_reader
+from sleepy.library import MediaLibrary
+from sleepy.loudness import LoudnessAnalyzer
+from sleepy.metrics import MetricsExporter, get_metrics
 from sleepy.players import LocalPlayer, YouTubePlayer
+from sleepy.positions import PositionStore
+from sleepy.scheduler import ShuffleScheduler
+from sleepy.storage import StorageManager
 from sleepy.youtube import YouTubeAuthenticator
 
 LOGGER = logging.getLogger(__name__)
@@ -22,6 +30,9 @@ LOGGER = logging.getLogger(__name__)
 class StateMachine:
     """Main application state machine."""
     
+    FAILURE_BACKOFF = 2       # seconds to wait after a failed track, doubled per failure in a row
+    MAX_FAILURE_BACKOFF = 60  # seconds
+    
     def __init__(
         self,
         config: ConfigManager,
@@ -31,57 +42,123 @@ class StateMachine:
         self.config = config
         self.audio_player = audio_player
         self.youtube_auth = youtube_auth
-        self.youtube_player = YouTubePlayer(audio_player, youtube_auth)
-        self.local_player = LocalPlayer(audio_player)
-        self.downloader = YouTubeDownloader(audio_player)
+        self.library = MediaLibrary()
+        self.scheduler = ShuffleScheduler()
+        self.capture = StreamCapture()
+        self.positions = PositionStore()
+        audio_player.positions = self.positions
+        self.youtube_player = YouTubePlayer(
+            audio_player, youtube_auth, scheduler=self.scheduler, capture=self.capture
+        )
+        self.local_player = LocalPlayer(audio_player, self.library, self.scheduler)
+        self.storage = StorageManager(
+            self.library,
+            self.youtube_player.mirror,
+            self.capture,
+            protect=self.local_player.in_use
+        )
+        self.loudness = LoudnessAnalyzer(self.library)
+        self.metrics = MetricsExporter()
+        self.downloader = YouTubeDownloader(audio_player, capture=self.capture)
+        self.download_queue = DownloadQueue(self.downloader, audio_player)
         self.state = StateContainer()
+        self._sleep_timer: Optional[asyncio.Task] = None
+        self._failures = 0
     
-    def run(self) -> None:
+    async def run(self) -> None:
         """Run the application state machine."""
+        get_input_reader().bind_loop(asyncio.get_running_loop())
         try:
             while self.state.current_state != State.QUIT:
                 try:
-                    self._execute_state()
+                    await self._execute_state()
                 except Exception as e:
                     LOGGER.error("Error in state %s: %s", self.state.current_state, e)
                     self.state.current_state = State.QUIT
-        except KeyboardInterrupt:
-            LOGGER.info("Interrupted by user")
+        finally:
+            self._cancel_sleep_timer()
+            self.metrics.stop()
+            self.download_queue.stop()
+            self.youtube_player.delete_queue.stop()
+            self.storage.stop()
+            self.loudness.stop()
+            self.library.close()
+            self.youtube_auth.close()
+            self.audio_player.close()
+            self.positions.close()
     
-    def _execute_state(self) -> None:
+    async def _execute_state(self) -> None:
         """Execute the current state's logic."""
+        with get_metrics().timer('sleepy_state_seconds', state=self.state.current_state.value):
+            await self._run_state()
+    
+    async def _run_state(self) -> None:
+        """Dispatch to the handler of the current state."""
         if self.state.current_state == State.INIT:
-            self._state_init()
+            await self._state_init()
         elif self.state.current_state == State.SELECT:
-            self._state_select()
+            await self._state_select()
         elif self.state.current_state == State.PLAY:
-            self._state_play()
+            await self._state_play()
         elif self.state.current_state == State.WAIT:
-            self._state_wait()
+            await self._state_wait()
         elif self.state.current_state == State.SHUTDOWN:
-            self._state_shutdown()
+            await self._state_shutdown()
     
-    def _state_init(self) -> None:
+    async def _state_init(self) -> None:
         """Initialize the application."""
         LOGGER.info("Initializing application")
         self.config.load()
-        self.audio_player.play_sound("up.wav")
+        asmr_playlist = self.config.playlist_for_folder(LOCAL_ASMR_DIR)
+        if asmr_playlist:
+            self.downloader.set_format(asmr_playlist.storage_codec, asmr_playlist.storage_bitrate)
+        # Streams are recorded only if they can be stored in the download format as they are
+        self.capture.codec = self.downloader.codec if self.config.download_capture else None
+        self.download_queue.start(
+            workers=self.config.download_workers,
+            max_attempts=self.config.download_max_attempts,
+            retry_backoff=self.config.download_retry_backoff
+        )
+        self.library.start()
+        self.storage.configure(
+            self.config.storage_quotas, self.config.storage_min_free_bytes, self.config.storage_log_max_age
+        )
+        self.storage.start()
+        self.local_player.loudness_target = self.config.loudness_target
+        self.local_player.loudness_max_boost = self.config.loudness_max_boost
+        if self.config.loudness_target is not None:
+            self.loudness.start(
+                playlist.id for playlist in self.config.playlists.values() if playlist.is_local()
+            )
+        self.audio_player.volume = self.config.volume_level
+        self.audio_player.skip_fade = self.config.skip_fade
+        if not self.audio_player.mute:
+            await asyncio.to_thread(self.audio_player.set_mute, False)
+        self.youtube_auth.quota.daily_limit = self.config.youtube_quota_per_day
+        self.youtube_auth.quota.reserve = self.config.youtube_quota_reserve
+        self._register_gauges()
+        self.metrics.configure(self.config.metrics_port, self.config.metrics_file, self.config.metrics_interval)
+        self.metrics.start()
+        await self.audio_player.play_sound_async("up.wav")
+        # Sends deletes left over from the last session
+        self.youtube_player.delete_queue.start()
         
-        # self.youtube_auth.authenticate()
+        # The YouTube client is set up by YouTubePlayer once a YouTube playlist is selected
         self.state.current_state = State.SELECT
         
     
-    def _state_select(self) -> None:
+    async def _state_select(self) -> None:
         """Select a playlist."""
         LOGGER.info("Waiting for playlist selection")
-        self.youtube_player.current_index = 0
-        self.local_player.current_index = 0
+        self._cancel_sleep_timer()
+        # mpv IPC and pipeline stops can take seconds, keep the loop free for input and timers
+        await asyncio.to_thread(self.audio_player.stop_stream)
         
-        self.audio_player.play_sound("ping.wav")
+        await asyncio.to_thread(self.audio_player.play_sound, "ping.wav", False)
         self.state.selected_playlist = None
         
         while not self.state.selected_playlist:
-            key = self._wait_for_key()
+            key = await self._wait_for_key()
             
             if key in self.config.playlists:
                 self.state.selected_playlist = self.config.playlists[key]
@@ -90,12 +167,16 @@ class StateMachine:
                 return
             else:
                 LOGGER.warning("Invalid key: %s", key)
-                self.audio_player.play_sound("error.wav")
+                await asyncio.to_thread(self.audio_player.play_sound, "error.wav", False)
         
         self.state.current_state = State.PLAY
-        self.audio_player.play_sound("ok.wav")
+        await self.audio_player.play_sound_async("ok.wav")
+        if self.state.selected_playlist.sleep_timer:
+            self._sleep_timer = asyncio.create_task(
+                self._run_sleep_timer(self.state.selected_playlist.sleep_timer * 60)
+            )
     
-    def _state_play(self) -> None:
+    async def _state_play(self) -> None:
         """Play content from selected playlist."""
         if not self.state.selected_playlist:
             LOGGER.error("No playlist selected")
@@ -108,33 +189,53 @@ class StateMachine:
         )
         
         try:
-            pressed_key = player.play(self.state)
-            self._handle_dot_action()
-            if not self._handle_action_key(pressed_key, State.PLAY) and self.state.selected_playlist.shutdown_after_play:
+            pressed_key = await player.play(self.state)
+            with get_metrics().timer('sleepy_track_phase_seconds', player='state_machine', phase='dot_action'):
+                self._handle_dot_action()
+            if pressed_key != FAILED_KEY:
+                self._failures = 0
+            if pressed_key == INTERRUPT_KEY:
+                self.state.current_state = State.SHUTDOWN
+            elif pressed_key == FAILED_KEY:
+                await self._back_off()
+            elif not self._handle_action_key(pressed_key, State.PLAY) and self.state.selected_playlist.shutdown_after_play:
                 self.state.current_state = State.WAIT
 
         except Exception as e:
             LOGGER.error("Error during PLAY:", e)
             self.state.current_state = State.QUIT
     
-    def _state_wait(self) -> None:
+    async def _back_off(self) -> None:
+        """Signal a failed track and wait before the next one, longer after each failure in a row."""
+        self._failures += 1
+        delay = min(self.MAX_FAILURE_BACKOFF, self.FAILURE_BACKOFF * 2 ** (self._failures - 1))
+        LOGGER.warning("Track failed to play (%d in a row), retrying in %d s", self._failures, delay)
+        await self.audio_player.play_sound_async("error.wav")
+        await asyncio.sleep(delay)
+    
+    async def _state_wait(self) -> None:
         """Wait before shutdown."""
         LOGGER.info("Waiting before shutdown")
+        await asyncio.to_thread(self.audio_player.stop_stream)
         self.state.current_audio_file = "./sounds/wait.wav"
-        pressed_key = self.audio_player.play_sound_cancellable(
+        self.state.current_position_key = None
+        self.state.current_start = 0.0
+        pressed_key = await self.audio_player.play_sound_cancellable(
             self.state, SPECIAL_KEYS
         )
         if not self._handle_action_key(pressed_key, State.PLAY):
-            self.audio_player.set_mute(True)
+            await asyncio.to_thread(self.audio_player.set_mute, True, self.config.skip_fade)
             self.state.current_state = State.SHUTDOWN
     
-    def _state_shutdown(self) -> None:
+    async def _state_shutdown(self) -> None:
         """Shutdown the system."""
         LOGGER.info("Shutting down")
-        self.audio_player.play_sound("shutdown.wav")
+        await self.audio_player.play_sound_async("shutdown.wav")
+        if not await asyncio.to_thread(self.youtube_player.delete_queue.flush, 30):
+            LOGGER.warning("Playlist item deletes still pending, sending them on the next start")
         try:
             subprocess.Popen(["sudo", "shutdown", "-h", "+1"])
-            self.audio_player.set_mute(True)
+            await asyncio.to_thread(self.audio_player.set_mute, True)
         except Exception as e:
             LOGGER.error("Shutdown command failed: %s", e)
         self.state.current_state = State.QUIT
@@ -144,6 +245,48 @@ class StateMachine:
         LOGGER.info("Exiting application")
         self.audio_player.play_sound("down.wav")
     
+    def _register_gauges(self) -> None:
+        """Expose the YouTube quota and the local storage use as gauges."""
+        metrics = get_metrics()
+        quota = self.youtube_auth.quota
+        metrics.gauge('sleepy_youtube_quota_used_units', quota.used, "Quota units spent today")
+        metrics.gauge('sleepy_youtube_quota_remaining_units', quota.remaining, "Quota units left today")
+        metrics.gauge('sleepy_mirror_bytes', self.youtube_player.mirror.total_bytes, "Size of the offline mirror")
+        for storage_quota in self.config.storage_quotas:
+            metrics.gauge(
+                'sleepy_folder_bytes',
+                lambda folder=storage_quota.folder: self.library.usage(folder)[1],
+                "Bytes used by a limited local folder",
+                folder=storage_quota.folder
+            )
+    
+    async def _run_sleep_timer(self, seconds: float) -> None:
+        """Fade out and shut down once the sleep timer of the playlist expires.
+        
+        The fade ends when the timer does, in the middle of a track if need
+        be. Cancelling the timer during the fade restores the volume.
+        """
+        fade = min(self.config.sleep_fade, seconds)
+        LOGGER.info("Sleep timer set to %g minutes", seconds / 60)
+        fading = False
+        try:
+            await asyncio.sleep(seconds - fade)
+            LOGGER.info("Sleep timer expiring, fading out over %.0f s", fade)
+            fading = True
+            await asyncio.to_thread(self.audio_player.set_mute, True, fade)
+        except asyncio.CancelledError:
+            if fading:
+                await asyncio.to_thread(self.audio_player.set_mute, False)
+            raise
+        self._sleep_timer = None
+        self.audio_player.interrupt()
+    
+    def _cancel_sleep_timer(self) -> None:
+        """Stop a running sleep timer."""
+        if self._sleep_timer is not None:
+            self._sleep_timer.cancel()
+            self._sleep_timer = None
+    
     def _handle_action_key(self, key: str, next_state: Optional[State] = None) -> bool:
         """Handle special action keys.
         
@@ -174,13 +317,13 @@ class StateMachine:
         return False
     
     @staticmethod
-    def _wait_for_key() -> str:
+    async def _wait_for_key() -> str:
         """Wait for a key press."""
-        with KeyboardPoller() as kp:
-            while True:
-                if kp.kbhit():
-                    return kp.getch()
-                time.sleep(0.1)
+        reader = get_input_reader()
+        while True:
+            key = await reader.get_key_async()
+            if key is not None:
+                return key
 
     def _handle_dot_action(self) -> None:
         """Handle the deferred dot-key action after a track finishes."""
@@ -193,7 +336,8 @@ class StateMachine:
             self._move_to_asmr(self.local_player.current_file)
             self.local_player.current_file = None
         elif self.state.current_video_url:
-            self.downloader.download(self.state.current_video_url)
+            # Queued jobs download in the background and survive a shutdown
+            self.download_queue.enqueue(self.state.current_video_url)
             self.state.current_video_url = None
 
     def _move_to_asmr(self, file_path: Path) -> None:
@@ -203,6 +347,7 @@ class StateMachine:
             dest_dir.mkdir(parents=True, exist_ok=True)
             dest = dest_dir / file_path.name
             shutil.move(str(file_path), str(dest))
+            self.library.move(str(file_path), str(dest))
             LOGGER.info("Moved %s -> %s", file_path, dest)
         except Exception as e:
             LOGGER.error("Failed to move %s to %s: %s", file_path, dest_dir, e)
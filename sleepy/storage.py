@@ -0,0 +1,212 @@
+"""Size limits for the local folders and a free-space watchdog."""
+
+import logging
+import os
+import shutil
+import threading
+import time
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional
+
+from sleepy.constants import LOCAL_ASMR_DIR
+from sleepy.library import MediaLibrary
+from sleepy.metrics import get_metrics
+from sleepy.models import LibraryTrack, StorageQuota
+
+LOGGER = logging.getLogger(__name__)
+
+
+class StorageManager:
+    """Keeps the local folders within their quotas and the SD card from filling up.
+
+    A background thread checks every CHECK_INTERVAL seconds. The bytes and
+    files used per folder come from the media library, which keeps them up
+    to date incrementally, so a check costs a few stats and no tree walk.
+    A folder over its quota has files deleted in the order of its eviction
+    policy; paths returned by protect, e.g. the file that is playing or
+    queued next, are never deleted. When the free space of the file system
+    drops below the minimum, only data that can be fetched or written again
+    is deleted: mirrored YouTube items, stream captures and download
+    failure logs. Library files beyond their folder quota are never touched
+    for it. Old download failure logs are deleted as well.
+    """
+
+    CHECK_INTERVAL = 5 * 60  # seconds between checks
+    LOG_PATTERN = 'download_failed_*.log'
+
+    def __init__(
+        self,
+        library: MediaLibrary,
+        mirror=None,
+        capture=None,
+        protect: Optional[Callable[[], Iterable[str]]] = None
+    ):
+        self.library = library
+        self.mirror = mirror
+        self.capture = capture
+        self.protect = protect or (lambda: ())
+        self.quotas: List[StorageQuota] = []
+        self.min_free_bytes = 0
+        self.log_max_age: Optional[float] = None
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopping = threading.Event()
+        self._worker: Optional[threading.Thread] = None
+
+    def configure(self, quotas: List[StorageQuota], min_free_bytes: int, log_max_age: Optional[float]) -> None:
+        """Set the limits to enforce.
+
+        Args:
+            quotas: Limits per folder.
+            min_free_bytes: Free space to keep on the file system of ./local.
+            log_max_age: Seconds after which download failure logs are
+                deleted, or None to keep them.
+        """
+        self.quotas = quotas
+        self.min_free_bytes = min_free_bytes
+        self.log_max_age = log_max_age
+
+    def start(self) -> None:
+        """Start the background checks."""
+        if self._worker is not None and self._worker.is_alive():
+            return
+        self._stopping.clear()
+        self._worker = threading.Thread(target=self._check_loop, name='storage', daemon=True)
+        self._worker.start()
+
+    def stop(self) -> None:
+        """Stop the background checks."""
+        self._stopping.set()
+        self._wakeup.set()
+        if self._worker is not None:
+            self._worker.join(timeout=2)
+            self._worker = None
+
+    def request_check(self) -> None:
+        """Run a check soon, e.g. after a large download."""
+        self._wakeup.set()
+
+    def check(self) -> int:
+        """Enforce all quotas, the free-space minimum and the log retention.
+
+        Returns:
+            The number of bytes freed.
+        """
+        with self._lock:
+            freed = sum(self._enforce(quota) for quota in self.quotas)
+            freed += self._ensure_free_space()
+            freed += self._cleanup_logs(self.log_max_age)
+        return freed
+
+    def _check_loop(self) -> None:
+        """Check at startup and then every CHECK_INTERVAL seconds."""
+        while not self._stopping.is_set():
+            try:
+                self.check()
+            except Exception as e:
+                LOGGER.error("Storage check failed: %s", e)
+            self._wakeup.wait(self.CHECK_INTERVAL)
+            self._wakeup.clear()
+
+    def _enforce(self, quota: StorageQuota) -> int:
+        """Delete files of a folder until it is within its quota."""
+        self.library.refresh(quota.folder)
+        files, used = self.library.usage(quota.folder)
+        if (quota.max_bytes is None or used <= quota.max_bytes) and (quota.max_files is None or files <= quota.max_files):
+            return 0
+
+        freed = deleted = 0
+        for track in self._candidates(quota):
+            if ((quota.max_bytes is None or used - freed <= quota.max_bytes)
+                    and (quota.max_files is None or files - deleted <= quota.max_files)):
+                break
+            if self._delete(track):
+                freed += track.size
+                deleted += 1
+        LOGGER.info(
+            "%s over quota: deleted %d files (%.1f MB, policy %s)",
+            quota.folder, deleted, freed / 1024 / 1024, quota.policy
+        )
+        return freed
+
+    def _ensure_free_space(self) -> int:
+        """Delete regenerable data until the file system has the minimum free space."""
+        if not self.min_free_bytes:
+            return 0
+        missing = self.min_free_bytes - self._free_bytes()
+        if missing <= 0:
+            return 0
+
+        LOGGER.warning("Low disk space: %.1f MB below the minimum", missing / 1024 / 1024)
+        freed = 0
+        if self.mirror is not None:
+            freed += self.mirror.evict(max_bytes=max(0, self.mirror.total_bytes() - missing))
+        if freed < missing and self.capture is not None:
+            freed += self.capture.evict()
+        if freed < missing:
+            freed += self._cleanup_logs(0)
+        if freed < missing:
+            LOGGER.error(
+                "Could not free enough space, %.1f MB still missing. Library files are only deleted "
+                "by the folder quotas, lower max_size_mb under Storage in config.yaml to make room",
+                (missing - freed) / 1024 / 1024
+            )
+        return freed
+
+    def _free_bytes(self) -> int:
+        """Get the free space of the file system holding the local folders."""
+        path = Path(LOCAL_ASMR_DIR).parent
+        return shutil.disk_usage(path if path.exists() else '.').free
+
+    def _candidates(self, quota: StorageQuota) -> Iterable[LibraryTrack]:
+        """Yield the tracks of a folder in eviction order, skipping protected ones."""
+        protected = {os.path.normpath(path) for path in self.protect() if path}
+        while True:
+            tracks = [
+                track for track in self.library.eviction_order(quota.folder, quota.policy)
+                if track.path not in protected
+            ]
+            if not tracks:
+                return
+            yield from tracks
+            # Every yielded track is deleted or dropped from the index, so the
+            # next query starts behind them; stop if nothing moved
+            if self.library.get(tracks[-1].path) is not None:
+                return
+
+    def _delete(self, track: LibraryTrack) -> bool:
+        """Delete a track from disk and the library."""
+        try:
+            Path(track.path).unlink(missing_ok=True)
+        except OSError as e:
+            LOGGER.error("Failed to delete %s: %s", track.path, e)
+            return False
+        self.library.remove(track.path)
+        get_metrics().inc('sleepy_storage_deleted_bytes_total', track.size, folder=track.folder)
+        LOGGER.debug("Deleted %s (%.1f MB)", track.path, track.size / 1024 / 1024)
+        return True
+
+    def _cleanup_logs(self, max_age: Optional[float]) -> int:
+        """Delete download failure logs older than max_age seconds, none if it is None.
+
+        Returns:
+            The number of bytes freed.
+        """
+        if max_age is None:
+            return 0
+        cutoff = time.time() - max_age
+        folders = {os.path.normpath(LOCAL_ASMR_DIR)} | {os.path.normpath(quota.folder) for quota in self.quotas}
+        removed = freed = 0
+        for folder in folders:
+            for log in Path(folder).glob(self.LOG_PATTERN):
+                try:
+                    stat = log.stat()
+                    if stat.st_mtime < cutoff:
+                        log.unlink()
+                        removed += 1
+                        freed += stat.st_size
+                except OSError as e:
+                    LOGGER.debug("Failed to delete %s: %s", log, e)
+        if removed:
+            LOGGER.info("Deleted %d old download failure logs", removed)
+        return freed
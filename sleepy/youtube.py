@@ -1,30 +1,34 @@
 """YouTube API authentication and management."""
 
+import json
 import logging
 import os
-import pickle
+import threading
 from pathlib import Path
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional, Tuple
 
-from google.auth.transport.requests import Request
-from google_auth_oauthlib.flow import InstalledAppFlow
-from googleapiclient.discovery import build
-
-from sleepy.constants import YOUTUBE_SCOPE
-import time
+from sleepy.constants import YOUTUBE_DISCOVERY_FILE
+from sleepy.credentials import CredentialManager
+from sleepy.metrics import get_metrics
+from sleepy.quota import QuotaExhaustedError, QuotaTracker
 
 LOGGER = logging.getLogger(__name__)
 
 
 class YouTubeAuthenticator:
-    """Handles YouTube API authentication and credential management."""
+    """Handles YouTube API authentication and credential management.
     
-    CREDENTIALS_FILE = 'cred.json'
-    TOKEN_FILE = 'token.pickle'
+    The Google client libraries take seconds to import on a Pi, so they
+    are only imported once the API is actually used.
+    """
     
     def __init__(self, audio_player=None):
         self.audio_player = audio_player
+        self.credentials = CredentialManager()
+        self.quota = QuotaTracker()
         self.client = None
+        self._auth_lock = threading.Lock()
+        self._http_lock = threading.Lock()
     
     def authenticate(self) -> Optional[object]:
         """Authenticate with YouTube API.
@@ -32,14 +36,19 @@ class YouTubeAuthenticator:
         Returns:
             YouTube API client, or None if authentication failed.
         """
-        creds = self._load_existing_credentials()
+        creds = self.credentials.load()
         
         if not creds or not creds.valid:
-            creds = self._refresh_or_acquire_credentials(creds)
+            if not self.credentials.refresh():
+                # Acquire new credentials
+                if self.audio_player:
+                    self.audio_player.play_sound("error.wav")
+                creds = self.credentials.acquire()
         
         if creds:
             try:
-                self.client = build('youtube', 'v3', credentials=creds)
+                self.client = self._build_client(self.credentials.authorized_http())
+                self.credentials.start()
                 LOGGER.info("YouTube API authenticated successfully")
                 return self.client
             except Exception as e:
@@ -47,62 +56,39 @@ class YouTubeAuthenticator:
         
         return None
     
-    def _load_existing_credentials(self) -> Optional[object]:
-        """Load credentials from token file if available."""
-        if not Path(self.TOKEN_FILE).exists():
-            return None
-        
-        try:
-            with open(self.TOKEN_FILE, 'rb') as f:
-                creds = pickle.load(f)
-                LOGGER.info("Loaded credentials from %s", self.TOKEN_FILE)
-                if hasattr(creds, 'expiry'):
-                    LOGGER.info("Token expiry: %s", creds.expiry)
-                return creds
-        except Exception as e:
-            LOGGER.error("Failed to load credentials: %s", e)
-            return None
+    def close(self) -> None:
+        """Stop the background token refresh and log the quota spent."""
+        self.credentials.close()
+        self.quota.log_summary()
+    
+    def ensure_client(self) -> Optional[object]:
+        """Get the YouTube API client, authenticating on first use."""
+        with self._auth_lock:
+            if self.client is None:
+                self.authenticate()
+        return self.client
     
-    def _refresh_or_acquire_credentials(self, creds: Optional[object]) -> Optional[object]:
-        """Refresh existing credentials or acquire new ones."""
-        # Try to refresh
-        if creds and creds.expired and creds.refresh_token:
+    @staticmethod
+    def _build_client(http) -> object:
+        """Build the API client from the discovery document cached on disk."""
+        from googleapiclient.discovery import build, build_from_document
+        
+        doc_path = Path(YOUTUBE_DISCOVERY_FILE)
+        if doc_path.exists():
             try:
-                creds.refresh(Request())
-                LOGGER.info("Credentials refreshed successfully")
-                return creds
+                return build_from_document(doc_path.read_text(), http=http)
             except Exception as e:
-                LOGGER.error("Failed to refresh credentials: %s", e)
-        
-        # Acquire new credentials
-        if self.audio_player:
-            self.audio_player.play_sound("error.wav")
+                LOGGER.warning("Cached discovery document unusable, rebuilding: %s", e)
         
+        client = build('youtube', 'v3', http=http)
         try:
-            flow = InstalledAppFlow.from_client_secrets_file(
-                self.CREDENTIALS_FILE,
-                YOUTUBE_SCOPE
-            )
-            creds = flow.run_console()
-            
-            if not creds:
-                LOGGER.warning("No credentials obtained from authentication flow")
-                return None
-            
-            LOGGER.info("New credentials acquired")
-            
-            # Save credentials
-            with open(self.TOKEN_FILE, 'wb') as f:
-                pickle.dump(creds, f)
-            LOGGER.info("Credentials saved to %s", self.TOKEN_FILE)
-            
-            return creds
-        except (KeyboardInterrupt, EOFError):
-            LOGGER.warning("Authentication cancelled by user")
-            return None
+            doc_path.parent.mkdir(parents=True, exist_ok=True)
+            # The resource keeps the parsed discovery document it was built from
+            doc_path.write_text(json.dumps(client._rootDesc))
+            LOGGER.info("Cached discovery document in %s", doc_path)
         except Exception as e:
-            LOGGER.error("Authentication failed: %s", e)
-            return None
+            LOGGER.warning("Failed to cache discovery document: %s", e)
+        return client
     
     def get_playlist_items(self, playlist_id: str) -> Optional[List[Dict]]:
         """Fetch items from a YouTube playlist.
@@ -123,7 +109,7 @@ class YouTubeAuthenticator:
                 playlistId=playlist_id,
                 maxResults=50
             )
-            response = request.execute()
+            response = self._execute(request, 'playlistItems.list')
             items = response.get('items', [])
             LOGGER.info("Found %d items in playlist", len(items))
             return items
@@ -149,7 +135,7 @@ class YouTubeAuthenticator:
                 part="snippet",
                 id=video_id
             )
-            response = request.execute()
+            response = self._execute(request, 'videos.list')
             videos = response.get('items', [])
             if videos:
                 title = videos[0]['snippet']['title']
@@ -178,7 +164,7 @@ class YouTubeAuthenticator:
                 part="contentDetails",
                 id=playlist_id
             )
-            response = request.execute()
+            response = self._execute(request, 'playlists.list')
             playlists = response.get('items', [])
             if playlists:
                 count = playlists[0]['contentDetails']['itemCount']
@@ -189,6 +175,81 @@ class YouTubeAuthenticator:
             LOGGER.error("Failed to fetch playlist count: %s", e)
             return None
     
+    def get_playlist_info(self, playlist_id: str) -> Optional[Dict]:
+        """Get the etag and item count of a YouTube playlist.
+
+        Args:
+            playlist_id: YouTube playlist ID.
+
+        Returns:
+            Dict with 'etag' and 'itemCount', or None if failed.
+        """
+        return self.get_playlist_infos([playlist_id]).get(playlist_id)
+
+    def get_playlist_infos(self, playlist_ids: List[str]) -> Dict[str, Dict]:
+        """Get the etag and item count of several YouTube playlists.
+
+        Up to 50 playlists are looked up per call, for one quota unit.
+
+        Args:
+            playlist_ids: YouTube playlist IDs, duplicates are looked up once.
+
+        Returns:
+            Maps playlist IDs to dicts with 'etag' and 'itemCount'. Playlists
+            that were not found or failed to load are missing.
+        """
+        if not self.client:
+            LOGGER.error("YouTube client not initialized")
+            return {}
+
+        playlist_ids = list(dict.fromkeys(playlist_ids))
+        infos = {}
+        try:
+            for start in range(0, len(playlist_ids), 50):
+                request = self.client.playlists().list(
+                    part="contentDetails",
+                    id=','.join(playlist_ids[start:start + 50]),
+                    maxResults=50
+                )
+                response = self._execute(request, 'playlists.list')
+                for playlist in response.get('items', []):
+                    infos[playlist['id']] = {
+                        'etag': playlist.get('etag'),
+                        'itemCount': playlist['contentDetails']['itemCount'],
+                    }
+        except Exception as e:
+            LOGGER.error("Failed to fetch playlist info: %s", e)
+        return infos
+
+    def iter_playlist_pages(self, playlist_id: str) -> Iterator[Tuple[Optional[str], List[Dict]]]:
+        """Iterate over all pages of a YouTube playlist.
+
+        Args:
+            playlist_id: YouTube playlist ID.
+
+        Yields:
+            Tuples of (page etag, page items), 50 items per page.
+
+        Raises:
+            Exception: If the client is missing or a page request fails.
+        """
+        if not self.client:
+            raise RuntimeError("YouTube client not initialized")
+
+        page_token = None
+        while True:
+            request = self.client.playlistItems().list(
+                part="snippet,contentDetails",
+                playlistId=playlist_id,
+                maxResults=50,
+                pageToken=page_token
+            )
+            response = self._execute(request, 'playlistItems.list')
+            yield response.get('etag'), response.get('items', [])
+            page_token = response.get('nextPageToken')
+            if not page_token:
+                return
+
     def get_playlist_item_by_index(self, playlist_id: str, index: int) -> Optional[Dict]:
         """Get a specific item from a YouTube playlist by index.
         
@@ -216,7 +277,7 @@ class YouTubeAuthenticator:
             
             # Paginate to the correct page
             for _ in range(page_num):
-                response = request.execute()
+                response = self._execute(request, 'playlistItems.list')
                 page_token = response.get('nextPageToken')
                 if not page_token:
                     return None
@@ -227,7 +288,7 @@ class YouTubeAuthenticator:
                     pageToken=page_token
                 )
             
-            response = request.execute()
+            response = self._execute(request, 'playlistItems.list')
             items = response.get('items', [])
             if len(items) > index_in_page:
                 LOGGER.info("Fetched item at index %d from playlist", index)
@@ -251,11 +312,68 @@ class YouTubeAuthenticator:
             return False
         
         try:
-            self.client.playlistItems().delete(id=item_id).execute()
-            # If execute() completes without exception, deletion succeeded
-            time.sleep(1)
+            self._execute(self.client.playlistItems().delete(id=item_id), 'playlistItems.delete', essential=True)
             LOGGER.info("Removed playlist item: %s", item_id)
             return True
         except Exception as e:
             LOGGER.error("Failed to remove playlist item %s: %s", item_id, e)
             raise
+    
+    def remove_playlist_items(self, item_ids: List[str]) -> Dict[str, bool]:
+        """Remove several items from YouTube playlists with one batch request.
+        
+        Args:
+            item_ids: YouTube playlist item IDs, at most 50.
+            
+        Returns:
+            Maps each item ID to True if it is gone, False if removing it failed.
+            
+        Raises:
+            QuotaExhaustedError: If the remaining quota cannot cover the deletes.
+        """
+        if not self.client:
+            LOGGER.error("YouTube client not initialized")
+            return {}
+        if not self.quota.allows('playlistItems.delete', len(item_ids), essential=True):
+            raise QuotaExhaustedError("Daily YouTube quota exhausted")
+        
+        results = {}
+        
+        def on_response(request_id: str, response, exception) -> None:
+            # An item that is already gone counts as removed; HttpError carries the HTTP response
+            if exception is None or getattr(getattr(exception, 'resp', None), 'status', None) == 404:
+                results[request_id] = True
+            else:
+                LOGGER.error("Failed to remove playlist item %s: %s", request_id, exception)
+                results[request_id] = False
+        
+        batch = self.client.new_batch_http_request(callback=on_response)
+        for item_id in item_ids:
+            batch.add(self.client.playlistItems().delete(id=item_id), request_id=item_id)
+        try:
+            with self._http_lock, get_metrics().timer('sleepy_call_seconds', call='youtube:batch'):
+                batch.execute()
+        finally:
+            self.quota.charge('playlistItems.delete', len(item_ids))
+        LOGGER.info("Removed %d of %d playlist items", sum(results.values()), len(item_ids))
+        return results
+    
+    def _execute(self, request, method: str, essential: bool = False) -> Dict:
+        """Execute an API request on the shared HTTP session and count its quota.
+        
+        Args:
+            request: The prepared API request.
+            method: API method name used for quota accounting, e.g. 'playlists.list'.
+            essential: Whether the call may use the quota reserve.
+            
+        Raises:
+            QuotaExhaustedError: If the remaining quota cannot cover the call.
+        """
+        if not self.quota.allows(method, essential=essential):
+            raise QuotaExhaustedError(f"Daily YouTube quota too low for {method}")
+        # httplib2 connections must not be shared between threads
+        with self._http_lock, get_metrics().timer('sleepy_call_seconds', call=f'youtube:{method}'):
+            try:
+                return request.execute()
+            finally:
+                self.quota.charge(method)
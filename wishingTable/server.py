@@ -1,16 +1,46 @@
-"""Local server that downloads a YouTube video as WAV and transfers it to SleePy via scp."""
+"""Local server that downloads YouTube videos as audio and transfers them to SleePy over SSH.
 
-import glob
+Downloads run as background jobs: POST /download returns a job id right
+away, GET /jobs/{id} reports the progress and GET /jobs/{id}/events streams
+it as server-sent events. Requests for a video that is already queued or
+done return the existing job.
+
+Jobs pass through three stages, each with its own pool of slots, so one
+job uploads while the next is transcoded and a third downloads: yt-dlp
+fetches the original audio stream, ffmpeg transcodes it here on the
+workstation (optionally loudness-normalized) and the result is uploaded.
+Uploads share one SSH connection (SFTP, via paramiko) to the SleePy
+host, are resumed after a dropped connection and land under a hidden
+.part name that is renamed once complete. Without paramiko each file is
+copied with scp.
+"""
+
+import asyncio
+import json
 import logging
 import os
 import re
+import shlex
+import shutil
 import subprocess
 import tempfile
+import threading
+import time
 import uuid
+from collections import deque
+from dataclasses import asdict, dataclass, field
 from pathlib import Path
+from typing import Dict, List, Optional
+from urllib.parse import parse_qs, urlparse
+
+try:
+    import paramiko
+except ImportError:
+    paramiko = None
 
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, field_validator
 
 logging.basicConfig(level=logging.DEBUG)
@@ -24,14 +54,48 @@ app = FastAPI()
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
-    allow_methods=["POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "OPTIONS"],
     allow_headers=["Content-Type"],
 )
 
 _YOUTUBE_RE = re.compile(r"^https://(www\.)?youtube\.com/watch\?")
-_SCP_DEST = "SleePy:~/Music/local/input/"
+_PROGRESS_RE = re.compile(r"^\[download\]\s+([\d.]+)%")
+_SSH_HOST = os.environ.get("SLEEPY_SSH_HOST", "SleePy")   # host alias from ~/.ssh/config
+_REMOTE_DIR = "Music/local/input"                          # relative to the home directory
 _DOWNLOAD_TIMEOUT = 600   # seconds for yt-dlp
 _SCP_TIMEOUT = 120        # seconds for scp
+_SSH_TIMEOUT = 15         # seconds to connect to SleePy
+_SFTP_TIMEOUT = 60        # seconds an SFTP read or write may stall
+_TRANSFER_ATTEMPTS = 3    # uploads resume where the last attempt stopped
+_TRANSFER_BACKOFF = 5     # seconds before the second attempt, doubled for each further one
+_CHUNK_SIZE = 256 * 1024
+_JOB_TTL = 60 * 60        # seconds finished jobs are kept for status queries
+_EVENT_INTERVAL = 0.5     # seconds between SSE status polls
+
+# Concurrent downloads and uploads, e.g. SLEEPY_WORKERS=3
+_WORKERS = max(1, int(os.environ.get("SLEEPY_WORKERS", "2")))
+_TRANSFER_WORKERS = max(1, int(os.environ.get("SLEEPY_TRANSFER_WORKERS", "2")))
+_TRANSCODE_WORKERS = max(1, int(os.environ.get("SLEEPY_TRANSCODE_WORKERS", str(os.cpu_count() or 2))))
+
+# Storage format of the transferred file, e.g. SLEEPY_AUDIO_FORMAT=flac or SLEEPY_AUDIO_QUALITY=128k.
+# Format: ffmpeg encoder, container, file extension
+_AUDIO_FORMATS = {
+    "wav": ("pcm_s16le", "wav", "wav"),
+    "flac": ("flac", "flac", "flac"),
+    "opus": ("libopus", "ogg", "opus"),
+    "vorbis": ("libvorbis", "ogg", "ogg"),
+    "mp3": ("libmp3lame", "mp3", "mp3"),
+}
+_AUDIO_FORMAT = os.environ.get("SLEEPY_AUDIO_FORMAT", "wav").lower()
+_AUDIO_QUALITY = os.environ.get("SLEEPY_AUDIO_QUALITY", "96k")
+if _AUDIO_FORMAT not in _AUDIO_FORMATS:
+    LOGGER.warning(f"Unknown SLEEPY_AUDIO_FORMAT '{_AUDIO_FORMAT}', using wav")
+    _AUDIO_FORMAT = "wav"
+
+# Integrated loudness target in LUFS, e.g. SLEEPY_LOUDNESS=-18; unset keeps the original level
+_LOUDNESS = os.environ.get("SLEEPY_LOUDNESS")
+_TRUE_PEAK = -1.5   # dBTP
+_LOUDNESS_RANGE = 11
 
 # Prepend common choco-installed tool paths so yt-dlp subprocess finds node + ffmpeg
 _EXTRA_PATHS = [
@@ -51,89 +115,462 @@ class DownloadRequest(BaseModel):
     def must_be_youtube_watch(cls, v: str) -> str:
         if not _YOUTUBE_RE.match(v):
             raise ValueError("Only YouTube watch URLs are accepted")
+        if not _video_id(v):
+            raise ValueError("URL has no video id")
         return v
 
 
-@app.post("/download")
-def download(req: DownloadRequest) -> dict:
-    job_dir = Path(tempfile.gettempdir()) / f"sleepy_{uuid.uuid4().hex}"
-    job_dir.mkdir()
-    LOGGER.info(f"Download request for: {req.url}")
-    LOGGER.info(f"Working dir: {job_dir}")
+class JobFailed(Exception):
+    """A download or transfer step failed; the message is shown to the user."""
+
+
+@dataclass
+class Job:
+    id: str
+    video_id: str
+    url: str
+    status: str = "queued"    # queued, downloading, converting, transferring, done, error
+    progress: float = 0.0     # progress of the current stage in percent
+    file: Optional[str] = None
+    source_bytes: Optional[int] = None   # size of the downloaded stream
+    wav_bytes: Optional[int] = None      # size the track would have as 16-bit WAV
+    file_bytes: Optional[int] = None     # size of the transferred file
+    saved_bytes: Optional[int] = None    # wav_bytes - file_bytes
+    detail: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status not in ("done", "error")
+
+
+_jobs: Dict[str, Job] = {}
+_jobs_by_video: Dict[str, str] = {}
+_tasks = set()
+_slots = asyncio.Semaphore(_WORKERS)
+_transfer_slots = asyncio.Semaphore(_TRANSFER_WORKERS)
+_transcode_slots = asyncio.Semaphore(_TRANSCODE_WORKERS)
+
+
+class SftpPool:
+    """SFTP sessions to SleePy over one shared SSH connection.
+
+    Connection settings (HostName, User, Port, IdentityFile) come from the
+    host's entry in ~/.ssh/config, like for scp. Idle sessions are kept for
+    the next job; the connection is reopened when it dropped.
+    """
+
+    def __init__(self, host: str):
+        self.host = host
+        self._lock = threading.Lock()
+        self._client = None
+        self._idle: List = []
+
+    def acquire(self):
+        """Get an idle SFTP session or open a new one."""
+        with self._lock:
+            transport = self._client.get_transport() if self._client else None
+            if transport is None or not transport.is_active():
+                self._connect()
+            if self._idle:
+                return self._idle.pop()
+            sftp = self._client.open_sftp()
+            # A stalled connection must not hold a transfer slot forever
+            sftp.get_channel().settimeout(_SFTP_TIMEOUT)
+            return sftp
+
+    def release(self, sftp, broken: bool = False) -> None:
+        """Return a session to the pool, or close it if it failed."""
+        with self._lock:
+            if broken:
+                sftp.close()
+            else:
+                self._idle.append(sftp)
+
+    def _connect(self) -> None:
+        """Open the SSH connection. The caller holds the lock."""
+        for sftp in self._idle:
+            sftp.close()
+        self._idle = []
+        if self._client:
+            self._client.close()
+
+        options = {}
+        config_path = Path.home() / ".ssh" / "config"
+        if config_path.exists():
+            options = paramiko.SSHConfig.from_path(str(config_path)).lookup(self.host)
+        client = paramiko.SSHClient()
+        client.load_system_host_keys()
+        client.connect(
+            options.get("hostname", self.host),
+            port=int(options.get("port", 22)),
+            username=options.get("user"),
+            key_filename=options.get("identityfile"),
+            timeout=_SSH_TIMEOUT,
+        )
+        client.get_transport().set_keepalive(30)
+        self._client = client
+        LOGGER.info(f"Connected to {self.host} for SFTP uploads")
+
+
+_sftp_pool = SftpPool(_SSH_HOST) if paramiko else None
 
+
+def _video_id(url: str) -> Optional[str]:
+    """Get the video id of a watch URL, so playlist/time parameters don't split jobs."""
+    ids = parse_qs(urlparse(url).query).get("v")
+    return ids[0] if ids else None
+
+
+def _prune_jobs() -> None:
+    """Forget finished jobs older than _JOB_TTL."""
+    cutoff = time.time() - _JOB_TTL
+    for job in [job for job in _jobs.values() if job.finished and job.finished < cutoff]:
+        del _jobs[job.id]
+        if _jobs_by_video.get(job.video_id) == job.id:
+            del _jobs_by_video[job.video_id]
+
+
+@app.post("/download", status_code=202)
+async def download(req: DownloadRequest) -> dict:
+    _prune_jobs()
+    video_id = _video_id(req.url)
+
+    # Coalesce repeated clicks on the same video; a failed job may be retried
+    existing = _jobs.get(_jobs_by_video.get(video_id, ""))
+    if existing and existing.status != "error":
+        LOGGER.info(f"Video {video_id} already has job {existing.id} ({existing.status})")
+        return {**asdict(existing), "duplicate": True}
+
+    job = Job(id=uuid.uuid4().hex[:12], video_id=video_id, url=req.url)
+    _jobs[job.id] = job
+    _jobs_by_video[video_id] = job.id
+    LOGGER.info(f"Job {job.id} queued for: {req.url}")
+
+    task = asyncio.create_task(_run_job(job))
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return {**asdict(job), "duplicate": False}
+
+
+@app.get("/jobs")
+def list_jobs() -> list:
+    return [asdict(job) for job in sorted(_jobs.values(), key=lambda job: job.created, reverse=True)]
+
+
+@app.get("/jobs/{job_id}")
+def get_job(job_id: str) -> dict:
+    job = _jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return asdict(job)
+
+
+@app.get("/jobs/{job_id}/events")
+async def job_events(job_id: str) -> StreamingResponse:
+    job = _jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def stream():
+        last = None
+        while True:
+            state = asdict(job)
+            if state != last:
+                yield f"data: {json.dumps(state)}\n\n"
+                last = state
+            if not job.active:
+                return
+            await asyncio.sleep(_EVENT_INTERVAL)
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def _run_job(job: Job) -> None:
+    """Download a job once a download slot is free, then upload it once a transfer slot is free."""
+    job_dir = Path(tempfile.gettempdir()) / f"sleepy_{job.id}"
+    job_dir.mkdir()
+    LOGGER.info(f"Job {job.id} working dir: {job_dir}")
     try:
-        dl = subprocess.run(
-            [
-                "yt-dlp",
-                "--extract-audio",
-                "--audio-format", "wav",
-                "-o", str(job_dir / "%(title)s.%(ext)s"),
-                "--cookies-from-browser", "firefox",  # or chromium if Firefox not available
-                req.url
-            ],
-            capture_output=True,
-            text=True,
-            timeout=_DOWNLOAD_TIMEOUT,
-            env=_ENV,
+        async with _slots:
+            source = await asyncio.to_thread(_download, job, job_dir)
+        job.status, job.progress = "converting", 0.0
+        async with _transcode_slots:
+            file_path = await asyncio.to_thread(_transcode, job, source)
+        job.file = file_path.name
+        job.status, job.progress = "transferring", 0.0
+        async with _transfer_slots:
+            await asyncio.to_thread(_transfer, job, file_path)
+        job.status, job.progress = "done", 100.0
+        LOGGER.info(
+            f"Job {job.id} done: {job.file} transferred, {job.file_bytes / 1e6:.1f} MB "
+            f"({(job.saved_bytes or 0) / 1e6:.1f} MB saved against WAV)"
         )
+    except JobFailed as e:
+        job.status, job.detail = "error", str(e)
+        LOGGER.error(f"Job {job.id} failed: {e}")
+    except Exception as e:
+        job.status, job.detail = "error", str(e)
+        LOGGER.exception(f"Job {job.id} failed unexpectedly: {e}")
+    finally:
+        job.finished = time.time()
+        LOGGER.debug(f"Cleaning up {job_dir}")
+        shutil.rmtree(job_dir, ignore_errors=True)
 
-        LOGGER.debug(f"yt-dlp stdout: {dl.stdout}")
-        LOGGER.debug(f"yt-dlp stderr: {dl.stderr}")
-        LOGGER.debug(f"yt-dlp returncode: {dl.returncode}")
-
-        if dl.returncode != 0:
-            error_detail = dl.stderr.strip()
-            LOGGER.error(f"yt-dlp failed: {error_detail}")
-            
-            # Provide helpful error messages
-            if "n challenge solving failed" in error_detail:
-                detail = "JavaScript runtime needed. Install Node.js or try a different video (Shorts may not have audio)."
-            elif "nsig extraction failed" in error_detail or "Requested format is not available" in error_detail:
-                detail = "Video format not available (may be Shorts or restricted). Try a music/podcast/ASMR video."
+
+def _download(job: Job, job_dir: Path) -> Path:
+    """Run yt-dlp for the original audio stream, following its progress output."""
+    cmd = [
+        "yt-dlp",
+        "--newline",  # one progress line per update instead of \r redraws
+        "-f", "bestaudio/best",
+        "-o", str(job_dir / "%(title)s.%(ext)s"),
+        "--cookies-from-browser", "firefox",  # or chromium if Firefox not available
+        job.url,
+    ]
+
+    job.status = "downloading"
+    dl = subprocess.Popen(
+        cmd,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        env=_ENV,
+    )
+    timed_out = threading.Event()
+
+    def kill() -> None:
+        timed_out.set()
+        dl.kill()
+
+    timer = threading.Timer(_DOWNLOAD_TIMEOUT, kill)
+    timer.start()
+    output = deque(maxlen=20)
+    try:
+        for line in dl.stdout:
+            line = line.rstrip()
+            output.append(line)
+            match = _PROGRESS_RE.match(line)
+            if match:
+                job.progress = float(match.group(1))
             else:
-                detail = error_detail[:200]  # Cap error message length
-            
-            raise HTTPException(status_code=500, detail=detail)
+                LOGGER.debug(f"yt-dlp [{job.id}]: {line}")
+        returncode = dl.wait()
+    finally:
+        timer.cancel()
+
+    LOGGER.debug(f"yt-dlp returncode: {returncode}")
+    if timed_out.is_set():
+        raise JobFailed(f"yt-dlp timed out after {_DOWNLOAD_TIMEOUT} s")
+    if returncode != 0:
+        error_detail = "\n".join(line for line in output if not _PROGRESS_RE.match(line)).strip()
+        LOGGER.error(f"yt-dlp failed: {error_detail}")
+
+        # Provide helpful error messages
+        if "n challenge solving failed" in error_detail:
+            raise JobFailed("JavaScript runtime needed. Install Node.js or try a different video (Shorts may not have audio).")
+        if "nsig extraction failed" in error_detail or "Requested format is not available" in error_detail:
+            raise JobFailed("Video format not available (may be Shorts or restricted). Try a music/podcast/ASMR video.")
+        raise JobFailed(error_detail[-200:])  # Cap error message length, the end has the reason
+
+    files = [f for f in job_dir.iterdir() if f.is_file() and f.suffix not in (".part", ".ytdl")]
+    LOGGER.info(f"Downloaded: {files}")
+    if not files:
+        raise JobFailed("yt-dlp finished but no file was found")
+    job.source_bytes = files[0].stat().st_size
+    return files[0]
+
+
+def _transcode(job: Job, source: Path) -> Path:
+    """Encode a downloaded stream into the storage format with ffmpeg. Runs on a worker thread.
+
+    ffmpeg streams from file to file, so even a multi-hour track is never
+    held in memory. With a loudness target, a first pass measures the
+    track and the second applies a linear gain (two-pass loudnorm).
+    """
+    encoder, container, ext = _AUDIO_FORMATS[_AUDIO_FORMAT]
+    out_dir = source.parent / "out"
+    out_dir.mkdir(exist_ok=True)
+    target = out_dir / f"{source.stem}.{ext}"
+
+    duration, sample_rate, channels = _probe(source)
+    filters = []
+    if _LOUDNESS:
+        measured = _measure_loudness(job, source, duration)
+        filters.append(
+            f"loudnorm=I={_LOUDNESS}:TP={_TRUE_PEAK}:LRA={_LOUDNESS_RANGE}"
+            f":measured_I={measured['input_i']}:measured_TP={measured['input_tp']}"
+            f":measured_LRA={measured['input_lra']}:measured_thresh={measured['input_thresh']}"
+            f":offset={measured['target_offset']}:linear=true"
+        )
+
+    cmd = ["ffmpeg", "-nostdin", "-y", "-i", str(source), "-vn", "-map_metadata", "0"]
+    if filters:
+        # loudnorm upsamples to 192 kHz internally; opus only takes 48 kHz
+        cmd += ["-af", ",".join(filters), "-ar", "48000" if _AUDIO_FORMAT == "opus" else str(sample_rate)]
+    cmd += ["-c:a", encoder]
+    if _AUDIO_QUALITY and _AUDIO_FORMAT not in ("wav", "flac"):
+        cmd += ["-b:a", _AUDIO_QUALITY]
+    cmd += ["-f", container, str(target)]
+    _run_ffmpeg(job, cmd, duration, 50.0 if _LOUDNESS else 0.0)
+
+    job.file_bytes = target.stat().st_size
+    job.wav_bytes = int(duration * sample_rate * channels * 2)
+    job.saved_bytes = job.wav_bytes - job.file_bytes
+    LOGGER.info(
+        f"Job {job.id} transcoded to {_AUDIO_FORMAT}: {job.source_bytes / 1e6:.1f} MB download, "
+        f"{job.file_bytes / 1e6:.1f} MB file, {job.wav_bytes / 1e6:.1f} MB as WAV"
+    )
+    source.unlink(missing_ok=True)
+    return target
+
+
+def _probe(source: Path) -> tuple:
+    """Get the duration in seconds, sample rate and channel count of an audio file."""
+    probe = subprocess.run(
+        [
+            "ffprobe", "-v", "error", "-select_streams", "a:0",
+            "-show_entries", "format=duration:stream=sample_rate,channels", "-of", "json", str(source),
+        ],
+        capture_output=True,
+        text=True,
+        env=_ENV,
+    )
+    if probe.returncode != 0:
+        raise JobFailed(f"ffprobe failed: {probe.stderr.strip()[-200:]}")
+    info = json.loads(probe.stdout)
+    stream = (info.get("streams") or [{}])[0]
+    return (
+        float(info.get("format", {}).get("duration") or 0),
+        int(stream.get("sample_rate") or 48000),
+        int(stream.get("channels") or 2),
+    )
+
+
+def _measure_loudness(job: Job, source: Path, duration: float) -> dict:
+    """First loudnorm pass: measure the loudness of a track."""
+    cmd = [
+        "ffmpeg", "-nostdin", "-i", str(source), "-vn",
+        "-af", f"loudnorm=I={_LOUDNESS}:TP={_TRUE_PEAK}:LRA={_LOUDNESS_RANGE}:print_format=json",
+        "-f", "null", "-",
+    ]
+    stderr = _run_ffmpeg(job, cmd, duration, 0.0, scale=0.5)
+    # The measurement is the last JSON object ffmpeg prints
+    start, end = stderr.rfind("{"), stderr.rfind("}")
+    if start < 0 or end < start:
+        raise JobFailed("Loudness measurement failed")
+    return json.loads(stderr[start:end + 1])
+
+
+def _run_ffmpeg(job: Job, cmd: list, duration: float, base: float, scale: Optional[float] = None) -> str:
+    """Run ffmpeg and map its progress onto job.progress.
+
+    Args:
+        base: Progress in percent when this pass starts.
+        scale: Share of the progress bar this pass covers, the rest by default.
+
+    Returns:
+        The stderr output of ffmpeg.
+    """
+    scale = scale if scale is not None else (100.0 - base) / 100.0
+    cmd = cmd[:1] + ["-progress", "pipe:1", "-nostats", "-loglevel", "info"] + cmd[1:]
+    with tempfile.TemporaryFile("w+", errors="replace") as stderr:
+        proc = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=stderr, text=True, env=_ENV)
+        for line in proc.stdout:
+            key, _, value = line.strip().partition("=")
+            if key == "out_time_us" and duration and value.isdigit():
+                job.progress = base + 100.0 * scale * min(1.0, int(value) / 1e6 / duration)
+        returncode = proc.wait()
+        stderr.seek(0)
+        output = stderr.read()
+    if returncode != 0:
+        raise JobFailed(f"ffmpeg failed: {output.strip()[-200:]}")
+    return output
 
-        wav_files = list(job_dir.glob("*.wav"))
-        LOGGER.info(f"Found {len(wav_files)} WAV files: {wav_files}")
-        
-        if not wav_files:
-            LOGGER.error(f"No WAV files found in {job_dir}")
-            raise HTTPException(status_code=500, detail="yt-dlp finished but no .wav file was found")
 
-        file_path = wav_files[0]
-        LOGGER.info(f"Transferring {file_path} to {_SCP_DEST}")
+def _transfer(job: Job, file_path: Path) -> None:
+    """Copy a finished file to SleePy. Runs on a worker thread."""
+    if _sftp_pool is None:
+        _transfer_scp(file_path)
+        return
 
+    LOGGER.info(f"Uploading {file_path} to {_SSH_HOST}:{_REMOTE_DIR}")
+    for attempt in range(1, _TRANSFER_ATTEMPTS + 1):
+        if attempt > 1:
+            time.sleep(_TRANSFER_BACKOFF * 2 ** (attempt - 2))
+        try:
+            sftp = _sftp_pool.acquire()
+        except Exception as e:
+            LOGGER.warning(f"Connecting to {_SSH_HOST} failed (attempt {attempt}): {e}")
+            continue
+        try:
+            _upload(job, sftp, file_path, resume=attempt > 1)
+            _sftp_pool.release(sftp)
+            return
+        except Exception as e:
+            _sftp_pool.release(sftp, broken=True)
+            LOGGER.warning(f"Upload of {file_path.name} failed (attempt {attempt}): {e}")
+    raise JobFailed(f"Upload to {_SSH_HOST} failed after {_TRANSFER_ATTEMPTS} attempts")
+
+
+def _upload(job: Job, sftp, file_path: Path, resume: bool) -> None:
+    """Upload a file under a hidden .part name, then rename it.
+
+    With resume, a .part file left by the previous attempt is continued
+    instead of sent again.
+    """
+    remote = f"{_REMOTE_DIR}/{file_path.name}"
+    temp = f"{_REMOTE_DIR}/.{file_path.name}.part"
+    size = file_path.stat().st_size
+    offset = 0
+    if resume:
+        try:
+            offset = sftp.stat(temp).st_size
+        except IOError:
+            pass
+    if offset > size:
+        offset = 0
+    if offset:
+        LOGGER.info(f"Resuming upload of {file_path.name} at {offset} of {size} bytes")
+
+    with open(file_path, "rb") as src, sftp.open(temp, "r+b" if offset else "wb") as dst:
+        dst.set_pipelined(True)
+        src.seek(offset)
+        dst.seek(offset)
+        sent = offset
+        while chunk := src.read(_CHUNK_SIZE):
+            dst.write(chunk)
+            sent += len(chunk)
+            job.progress = 100.0 * sent / size if size else 100.0
+    # SleePy ignores hidden files, so the file appears complete or not at all
+    sftp.posix_rename(temp, remote)
+
+
+def _transfer_scp(file_path: Path) -> None:
+    """Copy a file with scp under a hidden .part name and rename it over ssh."""
+    temp = f".{file_path.name}.part"
+    LOGGER.info(f"Transferring {file_path} to {_SSH_HOST}:~/{_REMOTE_DIR}/")
+    try:
         scp = subprocess.run(
-            ["scp", str(file_path), _SCP_DEST],
+            ["scp", str(file_path), f"{_SSH_HOST}:~/{_REMOTE_DIR}/{temp}"],
             capture_output=True,
             text=True,
             timeout=_SCP_TIMEOUT,
         )
-
         LOGGER.debug(f"scp stdout: {scp.stdout}")
         LOGGER.debug(f"scp stderr: {scp.stderr}")
         LOGGER.debug(f"scp returncode: {scp.returncode}")
-
         if scp.returncode != 0:
-            LOGGER.error(f"scp failed: {scp.stderr.strip()}")
-            raise HTTPException(status_code=500, detail=scp.stderr.strip())
-
-        LOGGER.info(f"Success: {file_path.name} downloaded and transferred")
-        return {"status": "ok", "file": file_path.name}
-
-    except HTTPException:
-        raise
-    except Exception as e:
-        LOGGER.exception(f"Unexpected error: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
-        
-    finally:
-        LOGGER.debug(f"Cleaning up {job_dir}")
-        for f in job_dir.glob("*"):
-            f.unlink(missing_ok=True)
-        try:
-            job_dir.rmdir()
-        except OSError:
-            pass
+            raise JobFailed(scp.stderr.strip())
+        mv = subprocess.run(
+            ["ssh", _SSH_HOST, "mv", shlex.quote(f"{_REMOTE_DIR}/{temp}"), shlex.quote(f"{_REMOTE_DIR}/{file_path.name}")],
+            capture_output=True,
+            text=True,
+            timeout=_SCP_TIMEOUT,
+        )
+        if mv.returncode != 0:
+            raise JobFailed(mv.stderr.strip())
+    except subprocess.TimeoutExpired:
+        raise JobFailed(f"scp timed out after {_SCP_TIMEOUT} s")
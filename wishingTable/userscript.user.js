@@ -1,8 +1,8 @@
 // ==UserScript==
 // @name         SleePy Downloader
 // @namespace    sleepy-downloader
-// @version      1.0
-// @description  Adds a button to YouTube watch pages that downloads the current video as WAV to SleePy
+// @version      1.2
+// @description  Adds a button to YouTube watch pages that sends the audio of the current video to SleePy
 // @match        https://www.youtube.com/*
 // @grant        GM_xmlhttpRequest
 // @connect      127.0.0.1
@@ -13,6 +13,7 @@
   'use strict';
 
   const SERVER = 'http://127.0.0.1:5001';
+  const POLL_MS = 1000;
 
   // ── Button ──────────────────────────────────────────────────────────────────
   const btn = document.createElement('button');
@@ -40,7 +41,7 @@
   // ── State helpers ────────────────────────────────────────────────────────────
   const STATES = {
     idle:    { bg: '#ff0000', label: '⬇ SleePy', disabled: false },
-    loading: { bg: '#888888', label: '⏳ Downloading…', disabled: true },
+    loading: { bg: '#888888', label: '⏳ Queued…',      disabled: true },
     success: { bg: '#2a9d2a', label: null,             disabled: false },
     error:   { bg: '#cc0000', label: null,             disabled: false },
   };
@@ -61,9 +62,66 @@
     const onWatch = location.pathname === '/watch' &&
                     new URLSearchParams(location.search).has('v');
     btn.style.display = onWatch ? 'block' : 'none';
+    // A running job keeps going on the server, the new page just starts idle
+    currentJob = null;
     if (onWatch) setState('idle');
   }
 
+  // ── Job polling ──────────────────────────────────────────────────────────────
+  // The server answers right away with a job id; the job is then polled until
+  // it is done. Only the job of the video on screen updates the button.
+  let currentJob = null;
+
+  const STATUS_LABELS = {
+    queued:       () => '⏳ Queued…',
+    downloading:  (job) => `⏳ Downloading ${Math.round(job.progress)}%`,
+    converting:   () => '⏳ Converting…',
+    transferring: (job) => `⏳ Sending to SleePy ${Math.round(job.progress)}%`,
+  };
+
+  function showJob(job) {
+    if (job.id !== currentJob) return;
+    if (job.status === 'done') {
+      currentJob = null;
+      const saved = job.saved_bytes > 0 ? ` (−${(job.saved_bytes / 1e6).toFixed(0)} MB)` : '';
+      setState('success', `✓ ${job.file}${saved}`);
+      resetAfter(6000);
+    } else if (job.status === 'error') {
+      currentJob = null;
+      setState('error', `✗ ${(job.detail ?? 'Unknown error').slice(0, 60)}`);
+      resetAfter(5000);
+    } else {
+      setState('loading', STATUS_LABELS[job.status]?.(job));
+      setTimeout(() => poll(job.id), POLL_MS);
+    }
+  }
+
+  function fail(jobId, label) {
+    if (jobId !== currentJob) return;
+    currentJob = null;
+    setState('error', label);
+    resetAfter(5000);
+  }
+
+  function poll(jobId) {
+    if (jobId !== currentJob) return;
+    GM_xmlhttpRequest({
+      method:  'GET',
+      url:     `${SERVER}/jobs/${jobId}`,
+      timeout: 10000,
+      onload(res) {
+        try {
+          if (res.status === 404) return fail(jobId, '✗ Job lost — server restarted?');
+          showJob(JSON.parse(res.responseText));
+        } catch {
+          fail(jobId, '✗ Bad response');
+        }
+      },
+      onerror()   { fail(jobId, '✗ Server unreachable — is it running?'); },
+      ontimeout() { setTimeout(() => poll(jobId), POLL_MS); },
+    });
+  }
+
   // ── Click handler ────────────────────────────────────────────────────────────
   btn.addEventListener('click', () => {
     setState('loading');
@@ -73,16 +131,16 @@
       url:     `${SERVER}/download`,
       headers: { 'Content-Type': 'application/json' },
       data:    JSON.stringify({ url: location.href }),
-      timeout: 660000, // 11 min — covers long videos + scp transfer
+      timeout: 10000,
 
       onload(res) {
         try {
           const json = JSON.parse(res.responseText);
-          if (json.status === 'ok') {
-            setState('success', `✓ ${json.file}`);
-            resetAfter(6000);
+          if (json.id) {
+            currentJob = json.id;
+            showJob(json);
           } else {
-            const detail = json.detail ?? 'Unknown error';
+            const detail = typeof json.detail === 'string' ? json.detail : 'Unknown error';
             setState('error', `✗ ${detail.slice(0, 60)}`);
             resetAfter(5000);
           }